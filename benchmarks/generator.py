@@ -0,0 +1,145 @@
+import bisect
+import itertools
+import random
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Tuple
+
+CATEGORIES = ['Выпечка', 'Закуски', 'Салаты', 'Супы', 'Горячее', 'Гарниры', 'Десерты', 'Напитки']
+
+
+@dataclass
+class GeneratorConfig:
+    """
+    Параметры синтетического потока заказов.
+    Args:
+        users: Количество пользователей
+        restaurants: Количество ресторанов
+        menu_size: Количество блюд в меню каждого ресторана
+        min_items, max_items: Границы количества позиций в заказе
+        max_quantity: Максимальное количество одного блюда в позиции
+        zipf_s: Параметр распределения Ципфа для выбора пользователя, ресторана и блюда (0 - равномерно)
+        status_mix: Доли финальных статусов заказа
+        seed: Зерно генератора случайных чисел, чтобы прогоны были воспроизводимы
+    """
+    users: int = 1000
+    restaurants: int = 20
+    menu_size: int = 40
+    min_items: int = 1
+    max_items: int = 6
+    max_quantity: int = 3
+    zipf_s: float = 1.1
+    status_mix: Dict[str, float] = field(default_factory=lambda: {'CLOSED': 0.85, 'CANCELLED': 0.15})
+    seed: int = 42
+
+
+class _ZipfChoice:
+    """
+    Выбор индекса из [0, n) с вероятностью, пропорциональной 1 / (k + 1) ** s.
+    """
+
+    def __init__(self, n: int, s: float, rnd: random.Random) -> None:
+        weights = [1 / (k + 1) ** s for k in range(n)]
+        self._cum_weights = list(itertools.accumulate(weights))
+        self._rnd = rnd
+
+    def __call__(self) -> int:
+        x = self._rnd.random() * self._cum_weights[-1]
+        return bisect.bisect_left(self._cum_weights, x)
+
+
+class OrderEventGenerator:
+    """
+    Генерирует документы пользователей и ресторанов (в формате Redis)
+    и события заказов в формате исходного топика.
+    """
+
+    def __init__(self, config: GeneratorConfig) -> None:
+        self._config = config
+        self._rnd = random.Random(config.seed)
+        self.users = [self._make_user(i) for i in range(config.users)]
+        self.restaurants = [self._make_restaurant(i) for i in range(config.restaurants)]
+        self._pick_user = _ZipfChoice(config.users, config.zipf_s, self._rnd)
+        self._pick_restaurant = _ZipfChoice(config.restaurants, config.zipf_s, self._rnd)
+        self._pick_item = _ZipfChoice(config.menu_size, config.zipf_s, self._rnd)
+        self._statuses = list(config.status_mix.keys())
+        self._status_weights = list(config.status_mix.values())
+
+    def _uid(self) -> str:
+        return uuid.UUID(int=self._rnd.getrandbits(128)).hex[:24]
+
+    def _make_user(self, i: int) -> Dict:
+        return {
+            '_id': self._uid(),
+            'name': f'Пользователь {i}',
+            'login': f'user_{i}',
+            'update_ts_utc': '2022-01-01 00:00:00'
+        }
+
+    def _make_restaurant(self, i: int) -> Dict:
+        menu = []
+        for j in range(self._config.menu_size):
+            menu.append({
+                '_id': self._uid(),
+                'name': f'Блюдо {i}-{j}',
+                'price': self._rnd.randrange(100, 1500, 10),
+                'category': self._rnd.choice(CATEGORIES)
+            })
+        return {
+            '_id': self._uid(),
+            'name': f'Ресторан {i}',
+            'menu': menu,
+            'update_ts_utc': '2022-01-01 00:00:00'
+        }
+
+    def redis_documents(self) -> Dict[str, Dict]:
+        """
+        Документы, которые STG-сервис читает из Redis, по ключу _id.
+        """
+        return {doc['_id']: doc for doc in itertools.chain(self.users, self.restaurants)}
+
+    def _order_items(self, restaurant: Dict) -> Tuple[List[Dict], int]:
+        count = self._rnd.randint(self._config.min_items, self._config.max_items)
+        items = {}
+        for _ in range(count):
+            dish = restaurant['menu'][self._pick_item()]
+            items[dish['_id']] = {
+                'id': dish['_id'],
+                'name': dish['name'],
+                'price': dish['price'],
+                'quantity': self._rnd.randint(1, self._config.max_quantity)
+            }
+        cost = sum(item['price'] * item['quantity'] for item in items.values())
+        return list(items.values()), cost
+
+    def events(self, count: int, start_id: int = 1_000_000,
+               start_dt: datetime = datetime(2022, 5, 1)) -> Iterator[Dict]:
+        """
+        Генерирует count событий заказов с последовательными object_id.
+        """
+        for n in range(count):
+            object_id = start_id + n
+            user = self.users[self._pick_user()]
+            restaurant = self.restaurants[self._pick_restaurant()]
+            items, cost = self._order_items(restaurant)
+            dt = (start_dt + timedelta(seconds=n * 7)).strftime('%Y-%m-%d %H:%M:%S')
+            status = self._rnd.choices(self._statuses, self._status_weights)[0]
+            yield {
+                'object_id': object_id,
+                'object_type': 'order',
+                'sent_dttm': dt,
+                'payload': {
+                    'restaurant': {'id': restaurant['_id']},
+                    'date': dt,
+                    'user': {'id': user['_id']},
+                    'order_items': items,
+                    'bonus_payment': 0,
+                    'cost': cost,
+                    'payment': cost,
+                    'bonus_grant': 0,
+                    'statuses': [{'status': status, 'dttm': dt}],
+                    'final_status': status,
+                    'update_ts': dt
+                }
+            }
@@ -0,0 +1,65 @@
+"""
+Нагрузочный прогон на записи production-топиков: реальный перекос ключей и размеры сообщений вместо синтетики.
+
+Запись делается в контейнере STG-сервиса командой service_stg/src/record.py: окно исходного, STG- и DDS-топиков
+и снимок Redis в сжатых файлах. Каждый слой переигрывает запись своего входного топика через настоящий
+процессор: STG - исходный топик, DDS - топик STG, CDM - топик DDS. Kafka и Redis заменены заглушками в памяти,
+Postgres - локальный.
+
+Пример запуска из корня репозитория:
+    python -m benchmarks.replay --recording ./rec-0501 --speed 1 --pg-host localhost
+    python -m benchmarks.replay --recording ./rec-0501 --speed 10 --stages dds,cdm
+    python -m benchmarks.replay --recording ./rec-0501 --speed 0      # без пауз, максимальная скорость
+
+С --speed сообщения подаются по своему времени в топике: задержка (latency_p50_ms, latency_p99_ms) считается
+от поступления сообщения до фиксации его offset, как у настоящего консьюмера. Схемы stg, dds и cdm
+пересоздаются, как в benchmarks.run, поэтому запускать можно только на локальном Postgres.
+"""
+import argparse
+import json
+import os
+
+from benchmarks.run import COLUMNS, STAGE_INPUTS, STAGES, print_table, reset_schema, run_stage, stage_file
+
+REPLAY_COLUMNS = COLUMNS[:5] + ['latency_p50_ms', 'latency_p99_ms'] + COLUMNS[5:]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Прогон процессоров STG, DDS и CDM на записи топиков')
+    parser.add_argument('--recording', required=True, help='Каталог записи (record.py)')
+    parser.add_argument('--speed', type=float, default=1,
+                        help='Темп подачи: 1 - как в записи, N - в N раз быстрее, 0 - максимальная скорость')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='Слои через запятую; слои без записи входного топика пропускаются')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--wire-format', choices=['json', 'msgpack'], default='json')
+    parser.add_argument('--keep-schema', action='store_true',
+                        help='Не пересоздавать схемы (например, чтобы прогнать DDS на уже заполненном хранилище)')
+    parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+    parser.add_argument('--pg-host', default=os.getenv('PG_WAREHOUSE_HOST') or 'localhost')
+    parser.add_argument('--pg-port', type=int, default=int(os.getenv('PG_WAREHOUSE_PORT') or 5432))
+    parser.add_argument('--pg-db', default=os.getenv('PG_WAREHOUSE_DBNAME') or 'postgres')
+    parser.add_argument('--pg-user', default=os.getenv('PG_WAREHOUSE_USER') or 'postgres')
+    parser.add_argument('--pg-password', default=os.getenv('PG_WAREHOUSE_PASSWORD') or '')
+    args = parser.parse_args()
+
+    stages = []
+    for stage in (s for s in args.stages.split(',') if s):
+        if os.path.exists(stage_file(args.recording, STAGE_INPUTS[stage])):
+            stages.append(stage)
+        else:
+            print(f'{stage}: нет записи {STAGE_INPUTS[stage]}(.gz), слой пропущен')
+
+    if not args.keep_schema:
+        reset_schema(args)
+    # Выход слоев не сохраняется: каждый слой читает запись своего входного топика, а не результат предыдущего.
+    results = [run_stage(args, stage, args.recording, output=False) for stage in stages]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    elif results:
+        print_table(results, REPLAY_COLUMNS)
+
+
+if __name__ == '__main__':
+    main()
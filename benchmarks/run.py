@@ -0,0 +1,142 @@
+"""
+Бенчмарк пропускной способности STG -> DDS -> CDM на синтетическом потоке заказов.
+
+Пример запуска из корня репозитория:
+    python -m benchmarks.run --orders 5000 --pg-host localhost --pg-user postgres
+
+Скрипт пересоздает схемы stg, dds и cdm в указанной базе из sql_scripts/create_all_tables.sql,
+поэтому запускать его нужно только на локальном Postgres.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+import psycopg
+
+from benchmarks.generator import GeneratorConfig, OrderEventGenerator
+from benchmarks.stage import ROOT, write_records
+
+SQL_SCRIPT = os.path.join(ROOT, 'sql_scripts', 'create_all_tables.sql')
+STAGES = ['stg', 'dds', 'cdm']
+# Каждый слой читает то, что отправил в Kafka предыдущий.
+STAGE_INPUTS = {'stg': 'source.jsonl', 'dds': 'stg.jsonl', 'cdm': 'dds.jsonl', 'fused': 'source.jsonl'}
+COLUMNS = ['stage', 'messages', 'messages_per_second', 'batch_p50_ms', 'batch_p99_ms',
+           'db_connections', 'db_statements', 'db_round_trips_per_message', 'bytes_per_message']
+
+
+def reset_schema(args) -> None:
+    with open(SQL_SCRIPT, encoding='utf-8') as f:
+        script = f.read()
+    with psycopg.connect(host=args.pg_host, port=args.pg_port, dbname=args.pg_db,
+                         user=args.pg_user, password=args.pg_password, autocommit=True) as conn:
+        conn.execute('DROP SCHEMA IF EXISTS cdm, dds, stg CASCADE')
+        conn.execute(script)
+
+
+def prepare_input(args, workdir: str) -> None:
+    generator = OrderEventGenerator(GeneratorConfig(
+        users=args.users,
+        restaurants=args.restaurants,
+        menu_size=args.menu_size,
+        min_items=args.min_items,
+        max_items=args.max_items,
+        zipf_s=args.zipf,
+        status_mix={'CLOSED': args.closed_share, 'CANCELLED': 1 - args.closed_share},
+        seed=args.seed
+    ))
+    with open(os.path.join(workdir, 'redis.json'), 'w', encoding='utf-8') as f:
+        json.dump(generator.redis_documents(), f, ensure_ascii=False)
+
+    records = []
+    for event in generator.events(args.orders):
+        sent = datetime.strptime(event['sent_dttm'], '%Y-%m-%d %H:%M:%S')
+        records.append({'value': event, 'timestamp': int(sent.timestamp() * 1000)})
+    write_records(os.path.join(workdir, 'source.jsonl'), records)
+
+
+def stage_file(workdir: str, name: str) -> str:
+    # Записи production-топиков (record.py) сжаты: source.jsonl.gz, redis.json.gz и т.д.
+    path = os.path.join(workdir, name)
+    if not os.path.exists(path) and os.path.exists(f'{path}.gz'):
+        return f'{path}.gz'
+    return path
+
+
+def run_stage(args, stage: str, workdir: str, output: bool = True) -> dict:
+    cmd = [
+        sys.executable, os.path.join(ROOT, 'benchmarks', 'stage.py'),
+        '--stage', stage,
+        '--input', stage_file(workdir, STAGE_INPUTS[stage]),
+        '--redis', stage_file(workdir, 'redis.json'),
+        '--batch-size', str(args.batch_size),
+        '--speed', str(args.speed),
+        '--wire-format', args.wire_format,
+        '--pg-host', args.pg_host,
+        '--pg-port', str(args.pg_port),
+        '--pg-db', args.pg_db,
+        '--pg-user', args.pg_user,
+        '--pg-password', args.pg_password,
+    ]
+    if output:
+        cmd += ['--output', os.path.join(workdir, f'{stage}.jsonl')]
+    result = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return json.loads(result.strip().splitlines()[-1])
+
+
+def print_table(results, columns=COLUMNS) -> None:
+    widths = [max(len(col), *(len(str(r[col])) for r in results)) for col in columns]
+    print('  '.join(col.ljust(w) for col, w in zip(columns, widths)))
+    for r in results:
+        print('  '.join(str(r[col]).ljust(w) for col, w in zip(columns, widths)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Бенчмарк процессоров STG, DDS и CDM')
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--restaurants', type=int, default=20)
+    parser.add_argument('--menu-size', type=int, default=40)
+    parser.add_argument('--min-items', type=int, default=1)
+    parser.add_argument('--max-items', type=int, default=6)
+    parser.add_argument('--zipf', type=float, default=1.1)
+    parser.add_argument('--closed-share', type=float, default=0.85)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--wire-format', choices=['json', 'msgpack'], default='json',
+                        help='Формат исходящих сообщений слоев (размер - в колонке bytes_per_message)')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='Темп подачи заказов по времени отправки: 1 - реальное время, N - в N раз быстрее, '
+                             '0 - все сразу')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='Слои через запятую. DDS и CDM читают результат предыдущего слоя из --workdir, '
+                             'fused - все три слоя в одном процессе (service_pipeline)')
+    parser.add_argument('--workdir', help='Каталог для сгенерированных сообщений (по умолчанию временный)')
+    parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+    parser.add_argument('--pg-host', default=os.getenv('PG_WAREHOUSE_HOST') or 'localhost')
+    parser.add_argument('--pg-port', type=int, default=int(os.getenv('PG_WAREHOUSE_PORT') or 5432))
+    parser.add_argument('--pg-db', default=os.getenv('PG_WAREHOUSE_DBNAME') or 'postgres')
+    parser.add_argument('--pg-user', default=os.getenv('PG_WAREHOUSE_USER') or 'postgres')
+    parser.add_argument('--pg-password', default=os.getenv('PG_WAREHOUSE_PASSWORD') or '')
+    args = parser.parse_args()
+
+    stages = [s for s in args.stages.split(',') if s]
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench-')
+    os.makedirs(workdir, exist_ok=True)
+
+    reset_schema(args)
+    prepare_input(args, workdir)
+
+    results = [run_stage(args, stage, workdir) for stage in stages]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Прогон одного процессора на заранее подготовленных сообщениях.
+Запускается отдельным процессом из benchmarks.run: у каждого сервиса свой пакет lib,
+поэтому процессоры разных слоев нельзя импортировать в один интерпретатор.
+Исключение - fused: совмещенный режим (service_pipeline) с общим lib из service_stg,
+все три слоя в одном процессе, заказ передается между ними в памяти.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICE_DIRS = {
+    'stg': os.path.join(ROOT, 'service_stg', 'src'),
+    'dds': os.path.join(ROOT, 'service_dds', 'src'),
+    'cdm': os.path.join(ROOT, 'service_cdm', 'src'),
+}
+# Поле ключа исходящих сообщений, как в KAFKA_MESSAGE_KEY по умолчанию у сервисов.
+OUTPUT_KEYS = {'stg': 'payload.user.id', 'dds': 'user.id', 'fused': 'user.id'}
+# Subject исходящих сообщений в реестре схем, как KAFKA_SCHEMA_SUBJECT по умолчанию у сервисов.
+OUTPUT_SUBJECTS = {'stg': 'stg-orders', 'dds': 'dds-orders', 'fused': 'dds-orders'}
+# Каталоги в sys.path для каждого прогона, первый имеет приоритет.
+STAGE_PATHS = {
+    'stg': [SERVICE_DIRS['stg']],
+    'dds': [SERVICE_DIRS['dds']],
+    'cdm': [SERVICE_DIRS['cdm']],
+    'fused': [SERVICE_DIRS['stg'], SERVICE_DIRS['dds'], SERVICE_DIRS['cdm']],
+}
+
+
+def open_text(path: str):
+    # Записи топиков (service_stg/src/record.py) сжаты gzip.
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def read_records(path: str) -> List[Dict]:
+    with open_text(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_records(path: str, records: List[Dict]) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False))
+            f.write('\n')
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def build_processor(args, consumer, producer, db):
+    from stubs import InMemoryRedisClient
+
+    logger = logging.getLogger(f'benchmark.{args.stage}')
+    logger.setLevel(logging.WARNING)
+
+    if args.stage == 'fused':
+        from cdm_loader.cdm_message_processor_job import CdmMessageProcessor
+        from cdm_loader.repository.cdm_repository import CdmRepository
+        from dds_loader.dds_message_processor_job import DdsMessageProcessor
+        from dds_loader.repository.dds_repository import DdsRepository
+        from lib.kafka_connect import InProcessProducer
+        from stg_loader.repository.stg_repository import StgRepository
+        from stg_loader.stg_message_processor_job import StgMessageProcessor
+        with open_text(args.redis) as f:
+            redis_client = InMemoryRedisClient(json.load(f))
+        # Выход конвейера - то, что DDS отдал бы в топик CDM.
+        cdm_proc = CdmMessageProcessor(None, CdmRepository(db), args.batch_size, logger)
+        to_cdm = InProcessProducer('in-process-cdm', cdm_proc.process, producer, cdm_proc.flush)
+        dds_proc = DdsMessageProcessor(None, to_cdm, DdsRepository(db), args.batch_size, logger)
+        to_dds = InProcessProducer('in-process-dds', dds_proc.process, on_flush=dds_proc.flush)
+        return StgMessageProcessor(consumer, to_dds, redis_client, StgRepository(db), args.batch_size, logger)
+
+    if args.stage == 'stg':
+        from stg_loader.repository.stg_repository import StgRepository
+        from stg_loader.stg_message_processor_job import StgMessageProcessor
+        with open_text(args.redis) as f:
+            redis_client = InMemoryRedisClient(json.load(f))
+        return StgMessageProcessor(consumer, producer, redis_client, StgRepository(db), args.batch_size, logger)
+
+    if args.stage == 'dds':
+        from dds_loader.dds_message_processor_job import DdsMessageProcessor
+        from dds_loader.repository.dds_repository import DdsRepository
+        return DdsMessageProcessor(consumer, producer, DdsRepository(db), args.batch_size, logger)
+
+    from cdm_loader.cdm_message_processor_job import CdmMessageProcessor
+    from cdm_loader.repository.cdm_repository import CdmRepository
+    return CdmMessageProcessor(consumer, CdmRepository(db), args.batch_size, logger)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Прогон одного процессора на сообщениях из файла')
+    parser.add_argument('--stage', choices=sorted(STAGE_PATHS), required=True)
+    parser.add_argument('--input', required=True)
+    parser.add_argument('--output')
+    parser.add_argument('--redis')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--wire-format', choices=['json', 'msgpack'], default='json')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='Темп подачи сообщений по их timestamp: 1 - как в записи, N - в N раз быстрее, '
+                             '0 - все сразу')
+    parser.add_argument('--pg-host', default='localhost')
+    parser.add_argument('--pg-port', type=int, default=5432)
+    parser.add_argument('--pg-db', default='postgres')
+    parser.add_argument('--pg-user', default='postgres')
+    parser.add_argument('--pg-password', default='')
+    args = parser.parse_args()
+
+    # Подключаем код нужного сервиса и заглушки.
+    for path in reversed(STAGE_PATHS[args.stage]):
+        sys.path.insert(0, path)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from stubs import CountingPgConnect, InMemoryKafkaConsumer, InMemoryKafkaProducer
+
+    consumer = InMemoryKafkaConsumer(f'{args.stage}-input', read_records(args.input), args.speed)
+    from lib.kafka_connect import WireFormat
+    producer = InMemoryKafkaProducer(f'{args.stage}-output', OUTPUT_KEYS.get(args.stage, ''),
+                                     WireFormat(args.wire_format, subject=OUTPUT_SUBJECTS.get(args.stage, '')))
+    db = CountingPgConnect(args.pg_host, args.pg_port, args.pg_db, args.pg_user, args.pg_password,
+                           sslmode='disable')
+    proc = build_processor(args, consumer, producer, db)
+
+    messages = consumer.remaining()
+    batch_latencies = []
+    started = time.perf_counter()
+    while consumer.remaining():
+        batch_started = time.perf_counter()
+        proc.run()
+        batch_latencies.append(time.perf_counter() - batch_started)
+    elapsed = time.perf_counter() - started
+
+    if args.output:
+        write_records(args.output, producer.records)
+
+    round_trips = db.counter['connections'] + db.counter['statements'] - db.counter['pipelined']
+    print(json.dumps({
+        'stage': args.stage,
+        'messages': messages,
+        'produced': len(producer.records),
+        'bytes_per_message': round(producer.bytes / len(producer.records)) if producer.records else 0,
+        'seconds': round(elapsed, 3),
+        'messages_per_second': round(messages / elapsed, 1) if elapsed else 0.0,
+        'batch_p50_ms': round(percentile(batch_latencies, 0.5) * 1000, 1),
+        'batch_p99_ms': round(percentile(batch_latencies, 0.99) * 1000, 1),
+        'db_connections': db.counter['connections'],
+        'db_statements': db.counter['statements'],
+        'db_round_trips_per_message': round(round_trips / messages, 1) if messages else 0.0,
+        # Задержка от поступления сообщения до фиксации offset после обработки; без --speed все сообщения
+        # поступают в начале прогона, и задержка показывает только время разбора очереди.
+        'latency_p50_ms': round(percentile(consumer.latencies, 0.5) * 1000, 1),
+        'latency_p99_ms': round(percentile(consumer.latencies, 0.99) * 1000, 1),
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Заглушки внешних сервисов с тем же интерфейсом, что и классы из lib.
+Модуль импортируется после того, как в sys.path добавлен src нужного сервиса.
+"""
+import json
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+from lib.kafka_connect import KafkaMessage, WireFormat, message_key
+from lib.pg import PgConnect
+
+
+class InMemoryKafkaConsumer:
+    def __init__(self, topic: str, records: Iterable[Dict], speed: float = 0) -> None:
+        """
+        Args:
+            topic: Имя топика, которое процессор использует в метках метрик
+            records: Записи вида {'value': ..., 'headers': {...}, 'timestamp': ..., 'key': ...};
+                записи топиков (record.py) дополнительно содержат partition и size исходного сообщения
+            speed: Темп выдачи по timestamp записей: 1 - как в записи, N - в N раз быстрее, 0 - все сразу
+        """
+        self.topic = topic
+        records = list(records)
+        if speed > 0:
+            records.sort(key=lambda r: r.get('timestamp') or 0)
+        self._messages = []
+        for offset, record in enumerate(records):
+            value = record['value']
+            self._messages.append(KafkaMessage(
+                value=value,
+                headers={k: v.encode() for k, v in (record.get('headers') or {}).items()},
+                topic=topic,
+                partition=record.get('partition', 0),
+                offset=offset,
+                timestamp=record.get('timestamp'),
+                size=record.get('size') or len(json.dumps(value)),
+                key=record.get('key')
+            ))
+        self._position = 0
+        self._speed = speed
+        self._first_timestamp = min((m.timestamp for m in self._messages if m.timestamp), default=0)
+        self._started: Optional[float] = None
+        # Моменты поступления прочитанных, но не зафиксированных сообщений. При commit по ним считается
+        # задержка: от поступления сообщения в топик до фиксации его offset после обработки.
+        self._uncommitted: List[float] = []
+        self.latencies: List[float] = []
+
+    def remaining(self) -> int:
+        return len(self._messages) - self._position
+
+    def consume(self, timeout: float = 3.0) -> Optional[Dict]:
+        message = self.consume_message(timeout)
+        return message.value if message else None
+
+    def consume_message(self, timeout: float = 3.0) -> Optional[KafkaMessage]:
+        if self._position >= len(self._messages):
+            return None
+        if self._started is None:
+            self._started = time.perf_counter()
+        message = self._messages[self._position]
+        # Как poll настоящего консьюмера: ждем сообщение не дольше timeout.
+        due = self._due(message)
+        wait = due - time.perf_counter()
+        if wait > timeout:
+            time.sleep(timeout)
+            return None
+        if wait > 0:
+            time.sleep(wait)
+        self._position += 1
+        self._uncommitted.append(due)
+        return message
+
+    def _due(self, message: KafkaMessage) -> float:
+        if self._speed <= 0 or not message.timestamp:
+            return self._started
+        return self._started + (message.timestamp - self._first_timestamp) / 1000 / self._speed
+
+    def seek(self, message: KafkaMessage) -> None:
+        self._position = message.offset
+        if self._uncommitted:
+            self._uncommitted.pop()
+
+    def commit(self, transaction=None) -> None:
+        now = time.perf_counter()
+        self.latencies.extend(now - due for due in self._uncommitted)
+        self._uncommitted = []
+
+    def rewind(self) -> None:
+        pass
+
+    def on_revoke(self, handler) -> None:
+        pass
+
+    def assigned_partitions(self) -> List[int]:
+        return [0]
+
+    def lag(self) -> Dict[int, int]:
+        return {0: self.remaining()}
+
+
+class InMemoryKafkaProducer:
+    def __init__(self, topic: str, key_field: str = '', wire_format: Optional[WireFormat] = None) -> None:
+        self.topic = topic
+        self.key_field = key_field
+        self.wire_format = wire_format or WireFormat()
+        self.records: List[Dict] = []
+        self.bytes = 0
+
+    def produce(self, payload: Dict, headers: Optional[Dict[str, str]] = None, key: Optional[str] = None) -> None:
+        if key is None and self.key_field:
+            key = message_key(payload, self.key_field)
+        # Кодируем и декодируем так же, как настоящие продюсер и консьюмер, чтобы стоимость формата попала в замер.
+        # В файл записывается уже декодированное значение, заголовки формата не нужны.
+        raw, encoded_headers = self.wire_format.encode(payload, headers)
+        self.bytes += len(raw)
+        self.records.append({'value': self.wire_format.decode(raw, encoded_headers),
+                             'headers': headers or {}, 'key': key})
+
+    def flush(self, timeout: float = 10) -> None:
+        pass
+
+
+class InMemoryRedisClient:
+    def __init__(self, documents: Dict[str, Dict]) -> None:
+        self._documents = {k: json.dumps(v) for k, v in documents.items()}
+
+    def set(self, k, v):
+        self._documents[k] = json.dumps(v)
+
+    def get(self, k) -> Dict:
+        return json.loads(self._documents[k])
+
+
+class _CountingCursor:
+    def __init__(self, cursor, counter: Dict[str, int]) -> None:
+        self._cursor = cursor
+        self._counter = counter
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._cursor.__exit__(*exc)
+
+    def execute(self, *args, **kwargs):
+        self._counter['statements'] += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, params_seq, *args, **kwargs):
+        self._counter['statements'] += 1
+        return self._cursor.executemany(params_seq, *args, **kwargs)
+
+    def copy(self, *args, **kwargs):
+        self._counter['statements'] += 1
+        return self._cursor.copy(*args, **kwargs)
+
+
+class _CountingConnection:
+    def __init__(self, conn, counter: Dict[str, int]) -> None:
+        self._conn = conn
+        self._counter = counter
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return _CountingCursor(self._conn.cursor(*args, **kwargs), self._counter)
+
+    def execute(self, *args, **kwargs):
+        self._counter['statements'] += 1
+        return self._conn.execute(*args, **kwargs)
+
+    @contextmanager
+    def pipeline(self):
+        # Запросы блока pipeline уходят в базу без ожидания ответа: весь блок - один round trip.
+        before = self._counter['statements']
+        with self._conn.pipeline() as pipeline:
+            yield pipeline
+        self._counter['pipelined'] += max(self._counter['statements'] - before - 1, 0)
+
+
+class CountingPgConnect(PgConnect):
+    """
+    PgConnect, который считает открытые соединения и выполненные запросы.
+    Каждый запрос и каждое соединение - как минимум один сетевой round trip до Postgres, кроме запросов
+    в режиме pipeline: pipelined - сколько запросов ушло в базу без отдельного round trip.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.counter = {'connections': 0, 'statements': 0, 'pipelined': 0}
+
+    @contextmanager
+    def connection(self):
+        self.counter['connections'] += 1
+        with super().connection() as conn:
+            yield _CountingConnection(conn, self.counter)
@@ -1,14 +1,29 @@
 import logging
+from datetime import date, timedelta
 
 from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask
+from flask import Flask, Response, jsonify, request
 
 from app_config import AppConfig
+from lib.metrics import render_metrics
+from lib.profiling import BatchProfiler
 from cdm_loader.cdm_message_processor_job import CdmMessageProcessor
+from cdm_loader.refresh import CdmCountersRefresh
 from cdm_loader.repository.cdm_repository import CdmRepository
+from cdm_loader.sketches import DistinctUsersQuery
+from cdm_loader.topk import UserTopKIndex
 
 app = Flask(__name__)
 
+# Профайлер оборачивает функции run и run_retries процессора и включается по запросу к /admin/profile.
+profiler = BatchProfiler()
+
+# Запросы к скетчам уникальных пользователей, создаются при старте вместе с подключением к базе.
+sketch_query: DistinctUsersQuery = None
+
+# Индекс топов пользователей в памяти, создается при старте, если задан CDM_TOPK_MAX_ENTRIES.
+topk_index: UserTopKIndex = None
+
 
 # Заводим endpoint для проверки, поднялся ли сервис.
 # Обратиться к нему можно будет GET-запросом по адресу localhost:5000/health.
@@ -18,17 +33,93 @@ def health():
     return 'healthy'
 
 
-if __name__ == '__main__':
-    # Устанавливаем уровень логгирования в Debug, чтобы иметь возможность просматривать отладочные логи.
-    app.logger.setLevel(logging.DEBUG)
+# Endpoint для сбора метрик Prometheus: счетчики сообщений, длительность батчей,
+# задержки вставки в таблицы и отставание консьюмера.
+# Обратиться к нему можно будет GET-запросом по адресу localhost:5000/metrics.
+@app.get('/metrics')
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
+# Включение профилирования следующих N батчей:
+# POST localhost:5000/admin/profile?batches=5&mode=sampling (или mode=cprofile).
+# GET того же адреса вернет статус и агрегированный профиль,
+# а GET /admin/profile/collapsed - стеки в формате collapsed для построения flamegraph.
+@app.post('/admin/profile')
+def start_profile():
+    try:
+        profiler.start(
+            batches=int(request.args.get('batches', 1)),
+            mode=request.args.get('mode', 'sampling'),
+            interval=float(request.args.get('interval', 0.005)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(profiler.status())
+
+
+@app.get('/admin/profile')
+def get_profile():
+    return jsonify(dict(profiler.status(), report=profiler.report(int(request.args.get('top', 50)))))
+
 
+@app.get('/admin/profile/collapsed')
+def get_profile_collapsed():
+    return Response(profiler.collapsed(), content_type='text/plain; charset=utf-8')
+
+
+# Приблизительное число уникальных пользователей товара или категории за период по дневным скетчам:
+# GET localhost:5000/sketches/distinct-users?dimension=product&from=2024-05-01&to=2024-05-07[&id=<md5>].
+# Без id возвращаются все товары (категории) периода по убыванию.
+@app.get('/sketches/distinct-users')
+def get_distinct_users():
+    if not request.args.get('from'):
+        return jsonify({'error': 'from is required'}), 400
+    try:
+        dimension = request.args.get('dimension', 'product')
+        date_from = date.fromisoformat(request.args['from'])
+        date_to = date.fromisoformat(request.args.get('to', request.args['from']))
+        if 'id' in request.args:
+            return jsonify({'dimension_id': request.args['id'],
+                            'distinct_users': sketch_query.distinct_users(dimension, request.args['id'],
+                                                                          date_from, date_to)})
+        return jsonify(sketch_query.distinct_users_all(dimension, date_from, date_to))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+# Топ товаров или категорий пользователя по числу заказанных единиц:
+# GET localhost:5000/users/<user_id>/top?dimension=product&limit=10.
+# user_id - id пользователя в исходной системе или его ключ из витрин (md5).
+@app.get('/users/<user_id>/top')
+def get_user_top(user_id: str):
+    if topk_index is None:
+        return jsonify({'error': 'top-k index is disabled'}), 404
+    try:
+        limit = int(request.args.get('limit', 10))
+        return jsonify({'user_id': user_id,
+                        'items': topk_index.top(user_id, request.args.get('dimension', 'product'), limit)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+if __name__ == '__main__':
     # Инициализируем конфиг. Для удобства, вынесли логику получения значений переменных окружения в отдельный класс.
     config = AppConfig()
 
+    # Уровень логгирования задается через LOG_LEVEL (по умолчанию INFO).
+    # Для просмотра отладочных логов достаточно выставить LOG_LEVEL=DEBUG.
+    app.logger.setLevel(logging.getLevelName(config.log_level))
+
     # Инициализируем параметры подключения к сервисам
     kafka_consumer = config.kafka_consumer()
-    cdm_repository = CdmRepository(config.pg_warehouse_db())
+    cdm_repository = CdmRepository(config.pg_warehouse_db(), bool(config.pg_pipeline))
+    sketch_query = DistinctUsersQuery(config.pg_warehouse_db())
     batch_size = 100
+    if config.cdm_topk_max_entries:
+        topk_index = UserTopKIndex(config.pg_warehouse_db(), app.logger, config.cdm_topk_max_entries)
+        if config.cdm_topk_rebuild:
+            topk_index.rebuild()
 
     # Инициализируем процессор сообщений.
     # Пока он пустой. Нужен для того, чтобы потом в нем писать логику обработки сообщений из Kafka.
@@ -36,12 +127,30 @@ if __name__ == '__main__':
         kafka_consumer,
         cdm_repository,
         batch_size,
-        app.logger)
+        app.logger,
+        config.log_payload_sample_rate,
+        config.failure_handler(),
+        config.kafka_retry_consumer(),
+        config.batch_max_bytes,
+        stream_counters=not config.cdm_refresh_interval,
+        topk_index=topk_index)
 
     # Запускаем процессор в бэкграунде.
     # BackgroundScheduler будет по расписанию вызывать функцию run нашего обработчика(StgMessageProcessor).
     scheduler = BackgroundScheduler()
-    scheduler.add_job(func=proc.run, trigger="interval", seconds=config.DEFAULT_JOB_INTERVAL)
+    scheduler.add_job(func=profiler.wrap(proc.run), trigger="interval", seconds=config.DEFAULT_JOB_INTERVAL)
+    # Сообщения из retry-топика обрабатываются отдельным джобом и не задерживают основной поток.
+    if config.kafka_retry_topic:
+        scheduler.add_job(func=profiler.wrap(proc.run_retries), trigger="interval", seconds=config.DEFAULT_JOB_INTERVAL)
+    # В режиме пересчета счетчики строятся set-based запросами по DDS от сохраненного watermark.
+    if config.cdm_refresh_interval:
+        counters_refresh = CdmCountersRefresh(
+            config.pg_warehouse_db(),
+            app.logger,
+            overlap=timedelta(minutes=config.cdm_refresh_overlap_minutes),
+            on_refresh=topk_index.clear if topk_index else None)
+        scheduler.add_job(func=counters_refresh.run, trigger="interval", seconds=config.cdm_refresh_interval,
+                          max_instances=1)
     scheduler.start()
 
     # стартуем Flask-приложение.
@@ -1,6 +1,7 @@
 import os
+from typing import Optional
 
-from lib.kafka_connect import KafkaConsumer, KafkaProducer
+from lib.kafka_connect import FailureHandler, KafkaConsumer, KafkaProducer, SchemaRegistry, WireFormat
 from lib.pg import PgConnect
 
 
@@ -16,12 +17,55 @@ class AppConfig:
         self.kafka_consumer_password = str(os.getenv('KAFKA_CONSUMER_PASSWORD') or "")
         self.kafka_consumer_group = str(os.getenv('KAFKA_CONSUMER_GROUP') or "")
         self.kafka_consumer_topic = str(os.getenv('KAFKA_SOURCE_TOPIC') or "")
+        # Постоянный id участника консьюмер-группы (static membership). По умолчанию - имя пода из POD_NAME;
+        # пустое значение - динамическое членство. Id должен сохраняться при перезапуске, поэтому
+        # случайный HOSTNAME контейнера для этого не подходит.
+        self.kafka_instance_id = str(os.getenv('KAFKA_GROUP_INSTANCE_ID') or os.getenv('POD_NAME') or "")
+        self.kafka_session_timeout_ms = int(os.getenv('KAFKA_SESSION_TIMEOUT_MS') or 45000)
+        # Ограничения памяти консьюмера: объем одного ответа брокера на fetch (не меньше 1000000), очередь
+        # предзагруженных librdkafka сообщений в КБ и объем прочитанных, но еще не зафиксированных сообщений,
+        # после которого чтение партиций приостанавливается до commit.
+        self.kafka_fetch_max_bytes = int(os.getenv('KAFKA_FETCH_MAX_BYTES') or 8388608)
+        self.kafka_queued_max_kbytes = int(os.getenv('KAFKA_QUEUED_MAX_KBYTES') or 16384)
+        self.kafka_max_inflight_bytes = int(os.getenv('KAFKA_MAX_INFLIGHT_BYTES') or 33554432)
+        # Лимит объема батча процессора в байтах, в дополнение к числу сообщений (0 - без лимита).
+        self.batch_max_bytes = int(os.getenv('BATCH_MAX_BYTES') or 8388608)
+        self.kafka_debug = str(os.getenv('KAFKA_DEBUG') or "")
+        self.kafka_producer_username = str(os.getenv('KAFKA_CONSUMER_USERNAME') or "")
+        self.kafka_producer_password = str(os.getenv('KAFKA_CONSUMER_PASSWORD') or "")
+
+        # Реестр схем для чтения msgpack-сообщений (по умолчанию lib/kafka_connect/schemas.json).
+        # Формат каждого входящего сообщения определяется по его заголовку content-type.
+        self.kafka_schema_registry = str(os.getenv('KAFKA_SCHEMA_REGISTRY') or "")
+
+        # Топики для повторной обработки и для сообщений, которые обработать не удалось.
+        # Если топик не задан, соответствующий маршрут отключен.
+        self.kafka_retry_topic = str(os.getenv('KAFKA_RETRY_TOPIC') or "")
+        self.kafka_dlq_topic = str(os.getenv('KAFKA_DLQ_TOPIC') or "")
+        self.retry_max_attempts = int(os.getenv('RETRY_MAX_ATTEMPTS') or 5)
+        self.retry_base_backoff = float(os.getenv('RETRY_BASE_BACKOFF') or 1.0)
+        self.retry_max_backoff = float(os.getenv('RETRY_MAX_BACKOFF') or 300.0)
 
         self.pg_warehouse_host = str(os.getenv('PG_WAREHOUSE_HOST') or "")
         self.pg_warehouse_port = int(str(os.getenv('PG_WAREHOUSE_PORT') or 0))
         self.pg_warehouse_dbname = str(os.getenv('PG_WAREHOUSE_DBNAME') or "")
         self.pg_warehouse_user = str(os.getenv('PG_WAREHOUSE_USER') or "")
         self.pg_warehouse_password = str(os.getenv('PG_WAREHOUSE_PASSWORD') or "")
+        # 1 - вставки одного сообщения отправляются в базу одной транзакцией в режиме pipeline libpq,
+        # без ожидания ответа на каждый запрос; 0 - каждая вставка отдельной транзакцией.
+        self.pg_pipeline = int(os.getenv('PG_PIPELINE') or 1)
+
+        # Интервал инкрементального пересчета витрин из DDS в секундах. 0 - счетчики обновляются потоком из Kafka.
+        self.cdm_refresh_interval = int(os.getenv('CDM_REFRESH_INTERVAL') or 0)
+        self.cdm_refresh_overlap_minutes = float(os.getenv('CDM_REFRESH_OVERLAP_MINUTES') or 5)
+
+        # Бюджет индекса топов пользователей в памяти - число записей счетчиков (0 - API топов отключено)
+        # и загрузка индекса из витрин при старте (0/1).
+        self.cdm_topk_max_entries = int(os.getenv('CDM_TOPK_MAX_ENTRIES') or 0)
+        self.cdm_topk_rebuild = int(os.getenv('CDM_TOPK_REBUILD') or 0)
+
+        self.log_level = str(os.getenv('LOG_LEVEL') or "INFO").upper()
+        self.log_payload_sample_rate = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE') or 0)
 
 
     def kafka_consumer(self):
@@ -32,9 +76,78 @@ class AppConfig:
             self.kafka_consumer_password,
             self.kafka_consumer_topic,
             self.kafka_consumer_group,
+            self.CERTIFICATE_PATH,
+            self.kafka_debug,
+            self.wire_format(),
+            instance_id=self.kafka_instance_id,
+            session_timeout_ms=self.kafka_session_timeout_ms,
+            fetch_max_bytes=self.kafka_fetch_max_bytes,
+            queued_max_kbytes=self.kafka_queued_max_kbytes,
+            max_inflight_bytes=self.kafka_max_inflight_bytes
+        )
+
+    def wire_format(self) -> WireFormat:
+        return WireFormat(registry=SchemaRegistry(self.kafka_schema_registry) if self.kafka_schema_registry else None)
+
+    # Retry- и dead-letter топики пишутся в JSON: их читают люди и сторонние инструменты.
+    def _topic_producer(self, topic: str) -> Optional[KafkaProducer]:
+        if not topic:
+            return None
+        return KafkaProducer(
+            self.kafka_host,
+            self.kafka_port,
+            self.kafka_producer_username,
+            self.kafka_producer_password,
+            topic,
             self.CERTIFICATE_PATH
         )
 
+    def failure_handler(self) -> FailureHandler:
+        return FailureHandler(
+            self._topic_producer(self.kafka_retry_topic),
+            self._topic_producer(self.kafka_dlq_topic),
+            self.retry_max_attempts,
+            self.retry_base_backoff,
+            self.retry_max_backoff
+        )
+
+    # Консьюмер для переигрывания топика: партиции назначаются вручную, offset группы не фиксируются.
+    def kafka_replay_consumer(self, topic: str = '') -> KafkaConsumer:
+        return KafkaConsumer(
+            self.kafka_host,
+            self.kafka_port,
+            self.kafka_consumer_username,
+            self.kafka_consumer_password,
+            topic or self.kafka_consumer_topic,
+            f'{self.kafka_consumer_group}-replay',
+            self.CERTIFICATE_PATH,
+            self.kafka_debug,
+            self.wire_format(),
+            subscribe=False,
+            fetch_max_bytes=self.kafka_fetch_max_bytes,
+            queued_max_kbytes=self.kafka_queued_max_kbytes
+        )
+
+    def kafka_retry_consumer(self) -> Optional[KafkaConsumer]:
+        if not self.kafka_retry_topic:
+            return None
+        return KafkaConsumer(
+            self.kafka_host,
+            self.kafka_port,
+            self.kafka_consumer_username,
+            self.kafka_consumer_password,
+            self.kafka_retry_topic,
+            self.kafka_consumer_group,
+            self.CERTIFICATE_PATH,
+            self.kafka_debug,
+            self.wire_format(),
+            instance_id=f'{self.kafka_instance_id}-retry' if self.kafka_instance_id else '',
+            session_timeout_ms=self.kafka_session_timeout_ms,
+            fetch_max_bytes=self.kafka_fetch_max_bytes,
+            queued_max_kbytes=self.kafka_queued_max_kbytes,
+            max_inflight_bytes=self.kafka_max_inflight_bytes
+        )
+
     def pg_warehouse_db(self):
         return PgConnect(
             self.pg_warehouse_host,
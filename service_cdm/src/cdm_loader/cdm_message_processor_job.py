@@ -1,8 +1,14 @@
-from datetime import datetime
+import threading
 from logging import Logger
 
-from lib.kafka_connect.kafka_connectors import KafkaConsumer
+from lib.kafka_connect import FailureHandler, KafkaConsumer, KafkaMessage
+from lib.log import BatchStats, StructuredLogger
+from lib.metrics import BATCH_DURATION, CONSUMER_LAG, MESSAGES_CONSUMED, MESSAGES_FAILED
+from lib.tracing import TraceContext
 from cdm_loader.repository.cdm_repository import CdmRepository
+from cdm_loader.rollups import SalesRollups
+from cdm_loader.sketches import DistinctUserSketches
+from cdm_loader.topk import UserTopKIndex
 
 
 class CdmMessageProcessor:
@@ -10,37 +16,131 @@ class CdmMessageProcessor:
                  consumer: KafkaConsumer,
                  cdm_repository: CdmRepository,
                  batch_size: int = 100,
-                 logger: Logger = None) -> None:
+                 logger: Logger = None,
+                 log_sample_rate: float = 0.0,
+                 failure_handler: FailureHandler = None,
+                 retry_consumer: KafkaConsumer = None,
+                 batch_max_bytes: int = 0,
+                 stream_counters: bool = True,
+                 topk_index: UserTopKIndex = None) -> None:
         self._consumer = consumer
         self._cdm_repository = cdm_repository
         self._batch_size = batch_size
-        self._logger = logger
+        # Батч ограничен и по объему: пачка крупных заказов не раздувает память процесса (0 - только по числу).
+        self._batch_max_bytes = batch_max_bytes
+        self._logger = StructuredLogger(logger, log_sample_rate)
+        self._failures = failure_handler or FailureHandler()
+        self._retry_consumer = retry_consumer
+        # Перед отзывом партиций при ребалансировке дописываем накопленное за батч, после чего консьюмер
+        # фиксирует offset отзываемых партиций.
+        for c in (consumer, retry_consumer):
+            if c:
+                c.on_revoke(self.flush)
+        # Если счетчики пересчитываются из DDS по расписанию, поток их не инкрементирует,
+        # иначе заказы будут учтены дважды.
+        self._stream_counters = stream_counters
+        # Индекс топов пользователей для API чтения получает те же инкременты, что и витрины.
+        self._topk_index = topk_index
+        # Скетчи уникальных пользователей и заказы для агрегатов продаж копятся в памяти за батч
+        # и записываются в flush. Накопители общие для основного и retry-джобов, поэтому батчи идут по очереди:
+        # иначе flush одного батча выгребет чужие заказы, а offset другого зафиксируется до их записи.
+        # В совмещенном режиме process и flush вызывают параллельные джобы DDS, они берут ту же блокировку.
+        # Блокировка повторно входимая: flush вызывается и из батча, и из обработчика отзыва партиций.
+        self._sketches = DistinctUserSketches()
+        self._rollups = SalesRollups()
+        self._batch_lock = threading.RLock()
 
     # функция, которая будет вызываться по расписанию.
     def run(self) -> None:
+        self._run_batch(self._consumer)
+
+    # функция, которая по расписанию обрабатывает сообщения из retry-топика.
+    def run_retries(self) -> None:
+        if self._retry_consumer:
+            self._run_batch(self._retry_consumer, delayed=True)
+
+    def _run_batch(self, consumer: KafkaConsumer, delayed: bool = False) -> None:
+        with self._batch_lock:
+            self._consume_batch(consumer, delayed)
+
+    def _consume_batch(self, consumer: KafkaConsumer, delayed: bool = False) -> None:
         # Пишем в лог, что джоб был запущен.
-        self._logger.info(f"{datetime.utcnow()}: START")
+        self._logger.debug('START', topic=consumer.topic)
+        stats = BatchStats()
 
-        # Имитация работы. Здесь будет реализована обработка сообщений.
         for _ in range(self._batch_size):
-            msg = self._consumer.consume()
-            if not msg:
+            message = consumer.consume_message()
+            if not message:
                 self._logger.debug('Сообщений из кафки нет')
                 break
-            self._logger.debug(f'Получено сообщение из кафки: {msg}')
+            if delayed and self._failures.due_in(message) > 0:
+                # Время повтора еще не наступило: возвращаем сообщение в очередь до следующего запуска.
+                consumer.seek(message)
+                break
+            stats.consumed += 1
+            stats.bytes += message.size
+            MESSAGES_CONSUMED.labels(consumer.topic).inc()
+            self._logger.payload('Получено сообщение из кафки', message.value, offset=message.offset)
             try:
-                self._logger.debug('Начинаем вставлять данные в таблицу user_category_counters')
-                self._cdm_repository.insert_to_user_category_counters(msg)
-                self._logger.debug('Данные загружены в таблицу user_category_counters')
+                self._process(message)
+            except Exception as e:
+                # Ошибочное сообщение уходит в retry- или dead-letter топик, батч продолжается.
+                stats.failed += 1
+                MESSAGES_FAILED.labels(consumer.topic).inc()
+                route = self._failures.handle(message, e)
+                self._logger.error('Ошибка при обработке сообщения',
+                                   offset=message.offset, error=repr(e), route=route)
+            if self._batch_max_bytes and stats.bytes >= self._batch_max_bytes:
+                break
 
-                self._logger.debug('Начинаем вставлять данные в таблицу user_product_counters')
-                self._cdm_repository.insert_to_user_product_counters(msg)
-                self._logger.debug('Данные загружены в таблицу user_product_counters')
+        # Агрегаты батча записываются до фиксации offset: если запись не удалась, батч будет прочитан снова.
+        self.flush()
 
-                self._logger.debug('Все данные успешно загружены')
+        # Все прочитанные сообщения обработаны или переданы в retry/dead-letter топики.
+        consumer.commit()
 
-            except Exception as e:
-                self._logger.error(f'Ошибка при обработке сообщения: {e}')
+        # Обновляем метрики батча: длительность обработки и отставание консьюмера по каждой партиции.
+        BATCH_DURATION.observe(stats.duration())
+        for partition, lag in consumer.lag().items():
+            CONSUMER_LAG.labels(consumer.topic, partition).set(lag)
+
+        # Пишем в лог итоговую строку по батчу.
+        self._logger.batch_summary(stats)
+
+    # Обработка одного сообщения без чтения из Kafka: так предыдущий слой передает заказ
+    # в совмещенном режиме (service_pipeline). Ошибки пробрасываются вызывающему.
+    def process(self, message: KafkaMessage) -> None:
+        with self._batch_lock:
+            self._process(message)
+
+    # Запись агрегатов, накопленных за батч. В совмещенном режиме вызывается предыдущим слоем в конце его батча.
+    def flush(self) -> None:
+        with self._batch_lock:
+            if len(self._sketches):
+                self._cdm_repository.merge_distinct_user_sketches(self._sketches.drain())
+            if len(self._rollups):
+                self._cdm_repository.merge_sales_rollups(self._rollups.drain())
+
+    def _process(self, message: KafkaMessage) -> None:
+        msg = message.value
+        trace = TraceContext.from_message(message)
+
+        if self._stream_counters:
+            try:
+                # Инкременты сообщения записываются одной транзакцией в режиме pipeline.
+                with self._cdm_repository.pipeline():
+                    self._cdm_repository.insert_to_user_category_counters(msg)
+                    self._cdm_repository.insert_to_user_product_counters(msg)
+            except Exception:
+                # Часть инкрементов могла записаться: пользователь перечитается из витрин при следующем запросе.
+                if self._topk_index:
+                    self._topk_index.discard(msg['user']['id'])
+                raise
+            if self._topk_index:
+                self._topk_index.apply_order(msg)
+        self._sketches.add(msg)
+        self._rollups.add(msg)
+        self._logger.debug('Данные загружены в витрины', object_id=msg.get('object_id'))
 
-        # Пишем в лог, что джоб успешно завершен.
-        self._logger.info(f"{datetime.utcnow()}: FINISH")
+        # Заказ дошел до витрин - фиксируем задержку последнего шага и сквозную задержку.
+        trace.record('cdm')
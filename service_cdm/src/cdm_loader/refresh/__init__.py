@@ -0,0 +1 @@
+from .counters_refresh import CdmCountersRefresh  # noqa
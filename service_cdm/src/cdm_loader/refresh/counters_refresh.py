@@ -0,0 +1,223 @@
+from datetime import datetime, timedelta
+from logging import Logger
+from typing import Callable, Dict, Optional
+
+from psycopg import Connection, IsolationLevel
+
+from lib.metrics import DB_UPSERT_LATENCY
+from lib.pg import PgConnect
+
+# Источники счетчиков в DDS. CTE общие для полного и инкрементального пересчета.
+# Текущие версии сателлитов берутся через PIT-таблицы, позиции заказа с категорией и количеством - через bridge,
+# поэтому сателлиты не сканируются целиком. scope_orders ограничивает заказы пользователями при инкременте.
+_SOURCE_CTES = """
+    scope_orders AS (
+        SELECT ou.h_order_pk, ou.h_user_pk
+        FROM dds.l_order_user ou
+        {user_filter}
+    ),
+    closed_orders AS (
+        SELECT o.h_order_pk, o.h_user_pk
+        FROM scope_orders o
+        JOIN LATERAL (
+            SELECT p.hk_order_status_hashdiff
+            FROM dds.pit_order p
+            WHERE p.h_order_pk = o.h_order_pk
+            ORDER BY p.snapshot_dt DESC
+            LIMIT 1
+        ) pit ON TRUE
+        JOIN dds.s_order_status s ON s.hk_order_status_hashdiff = pit.hk_order_status_hashdiff
+        WHERE lower(s.status) = 'closed'
+    ),
+    order_items AS (
+        SELECT o.h_user_pk, b.h_product_pk, b.h_category_pk, q.quantity
+        FROM closed_orders o
+        JOIN dds.bridge_order_product_category b ON b.h_order_pk = o.h_order_pk
+        JOIN dds.s_order_product_quantity q
+            ON q.hk_order_product_quantity_hashdiff = b.hk_order_product_quantity_hashdiff
+    )
+"""
+
+_PRODUCT_COUNTERS_SQL = """
+    WITH {ctes},
+    product_names AS (
+        SELECT DISTINCT ON (p.h_product_pk) p.h_product_pk, s.name
+        FROM dds.pit_product p
+        JOIN dds.s_product_names s ON s.hk_product_names_hashdiff = p.hk_product_names_hashdiff
+        ORDER BY p.h_product_pk, p.snapshot_dt DESC
+    )
+    INSERT INTO {target} (user_id, product_id, product_name, order_cnt)
+    SELECT i.h_user_pk, i.h_product_pk, pn.name, SUM(i.quantity)
+    FROM order_items i
+    JOIN product_names pn ON pn.h_product_pk = i.h_product_pk
+    GROUP BY i.h_user_pk, i.h_product_pk, pn.name
+"""
+
+_CATEGORY_COUNTERS_SQL = """
+    WITH {ctes}
+    INSERT INTO {target} (user_id, category_id, category_name, order_cnt)
+    SELECT i.h_user_pk, c.h_category_pk, c.category_name, SUM(i.quantity)
+    FROM order_items i
+    JOIN dds.h_category c ON c.h_category_pk = i.h_category_pk
+    GROUP BY i.h_user_pk, c.h_category_pk, c.category_name
+"""
+
+# Пользователи, у которых после watermark появились или изменились заказы, позиции или статусы.
+_AFFECTED_USERS_SQL = """
+    CREATE TEMP TABLE refresh_users ON COMMIT DROP AS
+    SELECT DISTINCT ou.h_user_pk
+    FROM dds.l_order_user ou
+    WHERE ou.h_order_pk IN (
+        SELECT h_order_pk FROM dds.pit_order WHERE load_dt > %(since)s
+        UNION
+        SELECT h_order_pk FROM dds.bridge_order_product_category WHERE load_dt > %(since)s
+    )
+"""
+
+_SOURCE_WATERMARK_SQL = """
+    SELECT GREATEST(
+        (SELECT MAX(load_dt) FROM dds.pit_order),
+        (SELECT MAX(load_dt) FROM dds.bridge_order_product_category)
+    )
+"""
+
+# Витрины: (таблица, SQL пересчета, имя уникального ограничения, колонки ключа)
+_COUNTER_TABLES = [
+    ('user_product_counters', _PRODUCT_COUNTERS_SQL, 'un_user_id_product_id', ['user_id', 'product_id']),
+    ('user_category_counters', _CATEGORY_COUNTERS_SQL, 'un_user_id_category_id', ['user_id', 'category_id']),
+]
+
+
+class CdmCountersRefresh:
+    """
+    Пересчет витрин cdm.user_product_counters и cdm.user_category_counters set-based запросами по DDS.
+
+    full - витрины строятся целиком в новых таблицах и подменяются переименованием в одной транзакции,
+    читатели до коммита видят старые данные.
+    incremental - пересчитываются только пользователи, чьи заказы изменились после watermark:
+    их строки удаляются и вставляются заново в одной транзакции.
+
+    Watermark - максимальный load_dt источников на момент пересчета, хранится в cdm.refresh_watermarks.
+    load_dt проставляет DDS-сервис до коммита, поэтому следующий инкремент читает строки с перекрытием overlap:
+    пересчет идемпотентен, повторно обработанный пользователь получит те же значения.
+    on_refresh вызывается после коммита пересчета - например, чтобы сбросить кэши, построенные по витринам.
+    """
+
+    def __init__(self, db: PgConnect, logger: Logger, name: str = 'user_counters',
+                 overlap: timedelta = timedelta(minutes=5), lock_timeout: str = '10s',
+                 on_refresh: Optional[Callable[[], None]] = None) -> None:
+        self._db = db
+        self._logger = logger
+        self._name = name
+        self._overlap = overlap
+        self._lock_timeout = lock_timeout
+        self._on_refresh = on_refresh
+
+    def ensure_table(self) -> None:
+        with self._db.connection() as conn:
+            conn.execute(
+                """
+                    CREATE TABLE IF NOT EXISTS cdm.refresh_watermarks(
+                        name VARCHAR PRIMARY KEY,
+                        watermark TIMESTAMP NOT NULL,
+                        mode VARCHAR NOT NULL,
+                        refreshed_at TIMESTAMP NOT NULL DEFAULT NOW()
+                    )
+                """
+            )
+
+    def run(self, mode: str = 'incremental') -> Dict:
+        """
+        Запускает пересчет.
+        Args:
+            mode: full или incremental. Инкремент без сохраненного watermark выполняется как full.
+        """
+        if mode not in ('full', 'incremental'):
+            raise ValueError(f'unknown refresh mode: {mode}')
+
+        self.ensure_table()
+        started = datetime.now()
+        with self._db.connection() as conn:
+            # Все запросы пересчета и watermark читают один снимок DDS.
+            conn.isolation_level = IsolationLevel.REPEATABLE_READ
+            conn.execute(f"SET LOCAL lock_timeout = '{self._lock_timeout}'")
+
+            watermark = self._load_watermark(conn)
+            new_watermark = conn.execute(_SOURCE_WATERMARK_SQL).fetchone()[0]
+            if new_watermark is None:
+                self._logger.info('DDS пуст, пересчет витрин пропущен')
+                return {'mode': mode, 'users': 0}
+
+            if mode == 'full' or watermark is None:
+                mode = 'full'
+                users = None
+                for table_name, sql, constraint, keys in _COUNTER_TABLES:
+                    self._rebuild(conn, table_name, sql, constraint, keys)
+            else:
+                users = self._refresh_since(conn, watermark - self._overlap)
+
+            self._save_watermark(conn, new_watermark, mode)
+
+        if self._on_refresh:
+            self._on_refresh()
+        result = {
+            'mode': mode,
+            'users': users,
+            'watermark': new_watermark.isoformat(),
+            'duration': round((datetime.now() - started).total_seconds(), 3),
+        }
+        self._logger.info(f'Витрины пересчитаны: {result}')
+        return result
+
+    def _rebuild(self, conn: Connection, table_name: str, sql: str, constraint: str, keys: list) -> None:
+        staging = f'{table_name}_rebuild'
+        retired = f'{table_name}_retired'
+        key_list = ', '.join(keys)
+
+        with DB_UPSERT_LATENCY.labels(table_name).time():
+            conn.execute(f'DROP TABLE IF EXISTS cdm.{staging}')
+            conn.execute(
+                f'CREATE TABLE cdm.{staging} '
+                f'(LIKE cdm.{table_name} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS)')
+            conn.execute(sql.format(ctes=_SOURCE_CTES.format(user_filter=''), target=f'cdm.{staging}'))
+
+            # Индексы строим после заливки - так быстрее, чем поддерживать их на каждой вставке.
+            conn.execute(f'ALTER TABLE cdm.{staging} ADD CONSTRAINT {staging}_pkey PRIMARY KEY (id)')
+            conn.execute(f'ALTER TABLE cdm.{staging} ADD CONSTRAINT {constraint}_rebuild UNIQUE ({key_list})')
+
+            # Подмена: переименования и удаление старой таблицы видны читателям только после коммита.
+            conn.execute(f'ALTER TABLE cdm.{table_name} RENAME TO {retired}')
+            conn.execute(f'ALTER TABLE cdm.{staging} RENAME TO {table_name}')
+            conn.execute(f'DROP TABLE cdm.{retired}')
+            conn.execute(f'ALTER TABLE cdm.{table_name} RENAME CONSTRAINT {staging}_pkey TO {table_name}_pkey')
+            conn.execute(f'ALTER TABLE cdm.{table_name} RENAME CONSTRAINT {constraint}_rebuild TO {constraint}')
+
+    def _refresh_since(self, conn: Connection, since: datetime) -> int:
+        conn.execute(_AFFECTED_USERS_SQL, {'since': since})
+        users = conn.execute('SELECT COUNT(*) FROM refresh_users').fetchone()[0]
+        if not users:
+            return 0
+
+        user_filter = 'WHERE ou.h_user_pk IN (SELECT h_user_pk FROM refresh_users)'
+        for table_name, sql, _, _ in _COUNTER_TABLES:
+            with DB_UPSERT_LATENCY.labels(table_name).time():
+                conn.execute(f'DELETE FROM cdm.{table_name} WHERE user_id IN (SELECT h_user_pk FROM refresh_users)')
+                conn.execute(sql.format(ctes=_SOURCE_CTES.format(user_filter=user_filter),
+                                        target=f'cdm.{table_name}'))
+        return users
+
+    def _load_watermark(self, conn: Connection) -> Optional[datetime]:
+        row = conn.execute('SELECT watermark FROM cdm.refresh_watermarks WHERE name = %(name)s',
+                           {'name': self._name}).fetchone()
+        return row[0] if row else None
+
+    def _save_watermark(self, conn: Connection, watermark: datetime, mode: str) -> None:
+        conn.execute(
+            """
+                INSERT INTO cdm.refresh_watermarks (name, watermark, mode, refreshed_at)
+                VALUES (%(name)s, %(watermark)s, %(mode)s, NOW())
+                ON CONFLICT (name) DO UPDATE
+                SET watermark = EXCLUDED.watermark, mode = EXCLUDED.mode, refreshed_at = EXCLUDED.refreshed_at
+            """,
+            {'name': self._name, 'watermark': watermark, 'mode': mode}
+        )
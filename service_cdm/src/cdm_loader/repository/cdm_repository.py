@@ -1,11 +1,36 @@
-from typing import Dict
+from contextlib import contextmanager
+from typing import Dict, Generator, List
 
-from lib.pg import PgConnect
+from lib.metrics import DB_UPSERT_LATENCY
+from lib.pg import PgConnect, PgPipeline
+from cdm_loader.rollups import RollupOrder, rollup_rows
+from cdm_loader.sketches import HyperLogLog, SketchRow
 import hashlib
 
 class CdmRepository:
-    def __init__(self, db: PgConnect) -> None:
+    """
+    Args:
+        db: Подключение к хранилищу
+        use_pipeline: Выполнять инкременты счетчиков внутри pipeline() одной транзакцией в режиме pipeline libpq
+    """
+
+    def __init__(self, db: PgConnect, use_pipeline: bool = True) -> None:
         self._db = db
+        self._pipeline = PgPipeline(db, 'cdm') if use_pipeline else None
+
+    @contextmanager
+    def pipeline(self) -> Generator[None, None, None]:
+        """
+        Инкременты счетчиков одного сообщения внутри блока уходят в базу одной транзакцией без ожидания ответа
+        на каждый (PgPipeline). Ошибка любого инкремента откатывает все инкременты сообщения и пробрасывается
+        из блока: повтор сообщения не учтет часть товаров дважды.
+        Без use_pipeline каждый инкремент, как и вне блока, выполняется отдельной транзакцией.
+        """
+        if self._pipeline is None:
+            yield
+            return
+        with self._pipeline.transaction():
+            yield
 
     def _insert(self, *, table_name: str, data: Dict, conflict_fields: list) -> None:
         """
@@ -26,9 +51,15 @@ class CdmRepository:
             SET order_cnt = {table_name}.order_cnt + EXCLUDED.order_cnt;
         """
 
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, data)
+        if self._pipeline is not None and self._pipeline.connection() is not None:
+            # Запрос только ставится в очередь, ответ базы собирается при выходе из pipeline().
+            self._pipeline.execute(sql, data, table=table_name)
+            return
+
+        with DB_UPSERT_LATENCY.labels(table_name).time():
+            with self._db.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(sql, data)
 
     def insert_to_user_category_counters(self, data: Dict) -> None:
         """
@@ -86,3 +117,106 @@ class CdmRepository:
                     data=data,
                     conflict_fields=['user_id', 'product_id']
                 )
+
+    def merge_distinct_user_sketches(self, rows: List[SketchRow]) -> None:
+        """
+        Объединяет скетчи уникальных пользователей за батч с сохраненными в cdm.distinct_user_sketches.
+        Новые строки вставляются сразу со скетчем батча, затем все строки батча блокируются в порядке ключа,
+        объединяются и записываются обратно. Параллельные воркеры не теряют чужие обновления,
+        а повтор батча ничего не меняет: объединение скетчей идемпотентно.
+        """
+        if not rows:
+            return
+        rows = sorted(rows, key=lambda r: (r.dimension, r.dimension_id, r.bucket_date))
+        params = [{
+            'dimension': r.dimension,
+            'dimension_id': r.dimension_id,
+            'dimension_name': r.dimension_name,
+            'bucket_date': r.bucket_date,
+            'sketch': r.sketch.to_bytes(),
+        } for r in rows]
+
+        with DB_UPSERT_LATENCY.labels('distinct_user_sketches').time():
+            with self._db.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.executemany(
+                        """
+                            INSERT INTO cdm.distinct_user_sketches
+                                (dimension, dimension_id, dimension_name, bucket_date, sketch)
+                            VALUES (%(dimension)s, %(dimension_id)s, %(dimension_name)s, %(bucket_date)s, %(sketch)s)
+                            ON CONFLICT (dimension, dimension_id, bucket_date) DO NOTHING
+                        """,
+                        params
+                    )
+                    cur.execute(
+                        """
+                            SELECT s.dimension, replace(s.dimension_id::text, '-', ''), s.bucket_date, s.sketch
+                            FROM cdm.distinct_user_sketches s
+                            JOIN unnest(%(dimensions)s::varchar[], %(ids)s::uuid[], %(dates)s::date[]) AS k(d, i, b)
+                                ON s.dimension = k.d AND s.dimension_id = k.i AND s.bucket_date = k.b
+                            ORDER BY s.dimension, s.dimension_id, s.bucket_date
+                            FOR UPDATE OF s
+                        """,
+                        {'dimensions': [r.dimension for r in rows],
+                         'ids': [r.dimension_id for r in rows],
+                         'dates': [r.bucket_date for r in rows]}
+                    )
+                    stored = {(d, i, b): HyperLogLog.from_bytes(sketch) for d, i, b, sketch in cur.fetchall()}
+
+                    for param, row in zip(params, rows):
+                        sketch = stored[(row.dimension, row.dimension_id, row.bucket_date)]
+                        sketch.merge(row.sketch)
+                        param['sketch'] = sketch.to_bytes()
+                    cur.executemany(
+                        """
+                            UPDATE cdm.distinct_user_sketches
+                            SET sketch = %(sketch)s, dimension_name = %(dimension_name)s, updated_at = NOW()
+                            WHERE dimension = %(dimension)s
+                              AND dimension_id = %(dimension_id)s
+                              AND bucket_date = %(bucket_date)s
+                        """,
+                        params
+                    )
+
+    def merge_sales_rollups(self, orders: List[RollupOrder]) -> None:
+        """
+        Добавляет закрытые заказы батча в почасовые и дневные агрегаты cdm.sales_rollups.
+        Каждый заказ учитывается один раз: номер заказа записывается в cdm.rollup_orders в той же транзакции,
+        и в агрегаты попадают только заказы, которых там еще не было. Повторная доставка сообщения
+        или повтор батча агрегаты не меняет.
+        """
+        if not orders:
+            return
+
+        with DB_UPSERT_LATENCY.labels('sales_rollups').time():
+            with self._db.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                            INSERT INTO cdm.rollup_orders (order_id, order_dttm)
+                            SELECT * FROM unnest(%(ids)s::int[], %(dttms)s::timestamp[])
+                            ON CONFLICT (order_id) DO NOTHING
+                            RETURNING order_id
+                        """,
+                        {'ids': [o.order_id for o in orders], 'dttms': [o.order_dttm for o in orders]}
+                    )
+                    new_ids = {row[0] for row in cur.fetchall()}
+                    rows = rollup_rows([o for o in orders if o.order_id in new_ids])
+                    if not rows:
+                        return
+                    # Строки отсортированы по ключу: параллельные воркеры блокируют общие бакеты в одном порядке.
+                    cur.executemany(
+                        """
+                            INSERT INTO cdm.sales_rollups (granularity, bucket_start, dimension, dimension_id,
+                                                           dimension_name, order_cnt, item_cnt, revenue)
+                            VALUES (%(granularity)s, %(bucket_start)s, %(dimension)s, %(dimension_id)s,
+                                    %(dimension_name)s, %(order_cnt)s, %(item_cnt)s, %(revenue)s)
+                            ON CONFLICT (granularity, dimension, dimension_id, bucket_start) DO UPDATE
+                            SET order_cnt = sales_rollups.order_cnt + EXCLUDED.order_cnt,
+                                item_cnt = sales_rollups.item_cnt + EXCLUDED.item_cnt,
+                                revenue = sales_rollups.revenue + EXCLUDED.revenue,
+                                dimension_name = EXCLUDED.dimension_name,
+                                updated_at = NOW()
+                        """,
+                        [row._asdict() for row in rows]
+                    )
@@ -0,0 +1 @@
+from .sales_rollups import GRANULARITIES, RollupOrder, RollupRow, SalesRollups, rollup_rows  # noqa
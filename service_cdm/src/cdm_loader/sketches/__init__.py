@@ -0,0 +1,2 @@
+from .hyperloglog import HyperLogLog  # noqa
+from .distinct_users import DistinctUserSketches, DistinctUsersQuery, SketchRow  # noqa
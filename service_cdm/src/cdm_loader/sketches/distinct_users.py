@@ -0,0 +1,110 @@
+import hashlib
+from datetime import date, datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from lib.pg import PgConnect
+from cdm_loader.sketches.hyperloglog import HyperLogLog
+
+DIMENSIONS = ('product', 'category')
+
+
+class SketchRow(NamedTuple):
+    dimension: str
+    dimension_id: str
+    dimension_name: str
+    bucket_date: date
+    sketch: HyperLogLog
+
+
+class DistinctUserSketches:
+    """
+    Накопитель скетчей уникальных пользователей за батч: по товару и категории на каждый день заказа.
+    Учитываются только закрытые заказы, как и в счетчиках. День берется из даты заказа,
+    поэтому опоздавшее событие попадает в свой день.
+    """
+
+    def __init__(self, precision: int = 12) -> None:
+        self._precision = precision
+        self._sketches: Dict[Tuple[str, str, date], Tuple[str, HyperLogLog]] = {}
+
+    def __len__(self) -> int:
+        return len(self._sketches)
+
+    def add(self, msg: Dict) -> None:
+        if str(msg['status']).lower() != 'closed':
+            return
+        user_id = msg['user']['id']
+        bucket_date = datetime.strptime(msg['date'], '%Y-%m-%d %H:%M:%S').date()
+        for item in msg['products']:
+            self._sketch('product', item['id'], item['name'], bucket_date).add(user_id)
+            self._sketch('category', item['category'], item['category'], bucket_date).add(user_id)
+
+    def drain(self) -> List[SketchRow]:
+        rows = [SketchRow(dimension, dimension_id, name, bucket_date, sketch)
+                for (dimension, dimension_id, bucket_date), (name, sketch) in self._sketches.items()]
+        self._sketches = {}
+        return rows
+
+    def _sketch(self, dimension: str, key: str, name: str, bucket_date: date) -> HyperLogLog:
+        # Ключи измерений - те же md5, что product_id и category_id в счетчиках.
+        dimension_id = hashlib.md5(key.encode('utf-8')).hexdigest()
+        entry = self._sketches.get((dimension, dimension_id, bucket_date))
+        if entry is None:
+            entry = self._sketches[(dimension, dimension_id, bucket_date)] = (name, HyperLogLog(self._precision))
+        return entry[1]
+
+
+class DistinctUsersQuery:
+    """
+    Оценка числа уникальных пользователей за период: дневные скетчи периода объединяются в один.
+    Память и время не зависят от числа пользователей - только от числа дней.
+    """
+
+    def __init__(self, db: PgConnect) -> None:
+        self._db = db
+
+    def distinct_users(self, dimension: str, dimension_id: str, date_from: date, date_to: date) -> int:
+        """
+        Уникальные пользователи одного товара или категории с date_from по date_to включительно.
+        """
+        merged = self._merge(dimension, date_from, date_to, dimension_id)
+        return merged[dimension_id]['distinct_users'] if merged else 0
+
+    def distinct_users_all(self, dimension: str, date_from: date, date_to: date) -> List[Dict]:
+        """
+        Уникальные пользователи за период по всем товарам или категориям, по убыванию.
+        """
+        rows = self._merge(dimension, date_from, date_to)
+        return sorted(rows.values(), key=lambda r: r['distinct_users'], reverse=True)
+
+    def _merge(self, dimension: str, date_from: date, date_to: date,
+               dimension_id: Optional[str] = None) -> Dict[str, Dict]:
+        if dimension not in DIMENSIONS:
+            raise ValueError(f'unknown dimension: {dimension}')
+        id_filter = 'AND dimension_id = %(dimension_id)s' if dimension_id else ''
+        merged: Dict[str, Tuple[str, HyperLogLog]] = {}
+        with self._db.connection() as conn:
+            with conn.cursor() as cur:
+                # Идентификаторы возвращаются в виде md5 без дефисов, как их считает сервис.
+                cur.execute(
+                    f"""
+                        SELECT replace(dimension_id::text, '-', ''), dimension_name, sketch
+                        FROM cdm.distinct_user_sketches
+                        WHERE dimension = %(dimension)s
+                          AND bucket_date BETWEEN %(date_from)s AND %(date_to)s
+                          {id_filter}
+                    """,
+                    {'dimension': dimension, 'date_from': date_from, 'date_to': date_to,
+                     'dimension_id': dimension_id}
+                )
+                for key, name, data in cur:
+                    sketch = HyperLogLog.from_bytes(data)
+                    if key in merged:
+                        merged[key][1].merge(sketch)
+                    else:
+                        merged[key] = (name, sketch)
+
+        return {
+            key: {'dimension_id': key, 'name': name, 'distinct_users': sketch.count()}
+            for key, (name, sketch) in merged.items()
+        }
@@ -0,0 +1,84 @@
+import hashlib
+import math
+import struct
+from typing import Iterable, Optional
+
+FORMAT_VERSION = 1
+_DENSE = 0
+_SPARSE = 1
+
+
+def hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """
+    Скетч HyperLogLog для приблизительного подсчета уникальных значений.
+    Регистров 2^precision, по байту на регистр. При precision=12 (4096 регистров) ошибка оценки около 1.6%.
+    Скетчи с одной точностью объединяются поэлементным максимумом регистров, объединение
+    идемпотентно: повторное добавление того же скетча или значения оценку не меняет.
+    Args:
+        precision: Число бит хэша на номер регистра (4..16)
+        registers: Готовые регистры (при загрузке из базы)
+    """
+
+    def __init__(self, precision: int = 12, registers: Optional[bytearray] = None) -> None:
+        if not 4 <= precision <= 16:
+            raise ValueError(f'unsupported precision: {precision}')
+        self.precision = precision
+        self._m = 1 << precision
+        self._registers = registers if registers is not None else bytearray(self._m)
+        if len(self._registers) != self._m:
+            raise ValueError('register count does not match precision')
+
+    def add(self, value: str) -> None:
+        x = hash64(value)
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def update(self, values: Iterable[str]) -> None:
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        if other.precision != self.precision:
+            raise ValueError('cannot merge sketches with different precision')
+        self._registers = bytearray(map(max, self._registers, other._registers))
+
+    def count(self) -> int:
+        m = self._m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self._registers)
+        zeros = self._registers.count(0)
+        # Для небольших множеств точнее линейный подсчет по пустым регистрам.
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        """
+        Компактное представление для bytea: пока заполнено мало регистров, хранятся только они
+        (номер и значение, 3 байта на регистр), иначе все регистры подряд.
+        """
+        filled = [(i, r) for i, r in enumerate(self._registers) if r]
+        if len(filled) * 3 < self._m:
+            body = b''.join(struct.pack('>HB', i, r) for i, r in filled)
+            return bytes([FORMAT_VERSION, self.precision, _SPARSE]) + body
+        return bytes([FORMAT_VERSION, self.precision, _DENSE]) + bytes(self._registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'HyperLogLog':
+        data = bytes(data)
+        if data[0] != FORMAT_VERSION:
+            raise ValueError(f'unsupported sketch format: {data[0]}')
+        precision, kind = data[1], data[2]
+        if kind == _DENSE:
+            return cls(precision, bytearray(data[3:]))
+        registers = bytearray(1 << precision)
+        for i, r in struct.iter_unpack('>HB', data[3:]):
+            registers[i] = r
+        return cls(precision, registers)
@@ -0,0 +1 @@
+from .user_topk_index import UserTopKIndex, user_key  # noqa
@@ -0,0 +1,233 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from logging import Logger
+from typing import Dict, List, Optional, Tuple
+
+from lib.metrics import TOPK_ENTRIES, TOPK_LOOKUPS
+from lib.pg import PgConnect
+
+DIMENSIONS = ('product', 'category')
+_HASHED_ID = re.compile(r'^[0-9a-f]{32}$')
+
+# Таблица счетчиков и колонки измерения
+_TABLES = {
+    'product': ('user_product_counters', 'product_id', 'product_name'),
+    'category': ('user_category_counters', 'category_id', 'category_name'),
+}
+
+# Число записей счетчиков каждого пользователя, самые активные первыми.
+_USER_SIZES_SQL = """
+    SELECT replace(user_id::text, '-', ''), COUNT(*)
+    FROM (
+        SELECT user_id, order_cnt FROM cdm.user_product_counters
+        UNION ALL
+        SELECT user_id, order_cnt FROM cdm.user_category_counters
+    ) c
+    GROUP BY user_id
+    ORDER BY SUM(order_cnt) DESC
+"""
+
+
+def user_key(user_id: str) -> str:
+    """
+    Ключ пользователя в витринах - md5 от id исходной системы. Уже посчитанный ключ (32 hex-символа
+    или UUID из таблицы) возвращается как есть.
+    """
+    key = user_id.replace('-', '').lower()
+    if _HASHED_ID.match(key):
+        return key
+    return hashlib.md5(user_id.encode('utf-8')).hexdigest()
+
+
+class _UserCounters:
+    __slots__ = ('counters', 'top')
+
+    def __init__(self) -> None:
+        # измерение -> {id: [имя, счетчик]}; top - отсортированный список, сбрасывается при изменении
+        self.counters: Dict[str, Dict[str, list]] = {d: {} for d in DIMENSIONS}
+        self.top: Dict[str, Optional[List[Tuple[str, str, int]]]] = {d: None for d in DIMENSIONS}
+
+    def size(self) -> int:
+        return sum(len(c) for c in self.counters.values())
+
+
+class UserTopKIndex:
+    """
+    Индекс счетчиков пользователей в памяти для ответа "топ N товаров или категорий пользователя".
+    Пользователь загружается из cdm.user_product_counters и cdm.user_category_counters при первом
+    обращении, затем процессор применяет к нему те же инкременты, что и к таблицам. Отсортированный
+    список кэшируется до следующего изменения, поэтому повторный запрос - это поиск в словаре.
+
+    Память ограничена числом записей счетчиков (max_entries): при превышении вытесняются пользователи,
+    к которым дольше всего не обращались. Инкремент вытесненного пользователя не применяется - при
+    следующем чтении он загрузится из таблицы. Если инкремент пришел, пока пользователь загружался,
+    результат загрузки в индекс не попадает.
+    Args:
+        db: Подключение к хранилищу
+        logger: Логгер
+        max_entries: Бюджет памяти - число записей счетчиков всех пользователей
+    """
+
+    def __init__(self, db: PgConnect, logger: Logger, max_entries: int = 1000000) -> None:
+        self._db = db
+        self._logger = logger
+        self._max_entries = max_entries
+        self._users: 'OrderedDict[str, _UserCounters]' = OrderedDict()
+        self._entries = 0
+        # Пользователи, которые сейчас загружаются из витрин: [число загрузок, число изменений].
+        # Загрузка, во время которой пользователь изменился, в индекс не попадает.
+        self._loading: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def top(self, user_id: str, dimension: str = 'product', limit: int = 10) -> List[Dict]:
+        if dimension not in DIMENSIONS:
+            raise ValueError(f'unknown dimension: {dimension}')
+        key = user_key(user_id)
+        with self._lock:
+            user = self._users.get(key)
+            if user is not None:
+                self._users.move_to_end(key)
+                TOPK_LOOKUPS.labels('memory').inc()
+                return self._top(user, dimension, limit)
+            loading = self._loading.setdefault(key, [0, 0])
+            loading[0] += 1
+            seen = loading[1]
+
+        TOPK_LOOKUPS.labels('table').inc()
+        try:
+            user = self._load(key)
+        finally:
+            with self._lock:
+                loading[0] -= 1
+                dirty = loading[1] != seen
+                if not loading[0]:
+                    del self._loading[key]
+        with self._lock:
+            if not dirty and key not in self._users:
+                self._put(key, user)
+            return self._top(user, dimension, limit)
+
+    def apply_order(self, msg: Dict) -> None:
+        """
+        Применяет к индексу инкременты закрытого заказа - те же, что CdmRepository записывает в таблицы.
+        """
+        if str(msg['status']).lower() != 'closed':
+            return
+        key = user_key(msg['user']['id'])
+        with self._lock:
+            self._touch_loading(key)
+            user = self._users.get(key)
+            if user is None:
+                return
+            before = user.size()
+            for item in msg['products']:
+                self._increment(user, 'product', hashlib.md5(item['id'].encode('utf-8')).hexdigest(),
+                                item['name'], int(item['quantity']))
+                self._increment(user, 'category', hashlib.md5(item['category'].encode('utf-8')).hexdigest(),
+                                item['category'], int(item['quantity']))
+            self._entries += user.size() - before
+            self._evict()
+
+    def rebuild(self) -> int:
+        """
+        Заполняет индекс из таблиц счетчиков: пользователи с наибольшим числом заказанных единиц загружаются первыми,
+        пока не исчерпан бюджет. Возвращает число пользователей.
+        Вызывается при старте до запуска процессора: инкременты, примененные во время загрузки, были бы потеряны.
+        """
+        users: Dict[str, _UserCounters] = {}
+        entries = 0
+        with self._db.connection() as conn:
+            rows = conn.execute(_USER_SIZES_SQL).fetchall()
+            for key, size in rows:
+                if entries + size > self._max_entries:
+                    break
+                users[key] = _UserCounters()
+                entries += size
+
+            for dimension, (table, id_column, name_column) in _TABLES.items():
+                with conn.cursor(name=f'topk_{dimension}') as cur:
+                    cur.execute(f"SELECT replace(user_id::text, '-', ''), replace({id_column}::text, '-', ''), "
+                                f"{name_column}, order_cnt FROM cdm.{table} WHERE user_id = ANY(%(users)s::uuid[])",
+                                {'users': list(users)})
+                    for key, item_id, name, cnt in cur:
+                        users[key].counters[dimension][item_id] = [name, cnt]
+
+        with self._lock:
+            self._clear()
+            for key, user in users.items():
+                self._put(key, user)
+        self._logger.info(f'Индекс топов пользователей загружен: пользователей {len(users)}, записей {entries}')
+        return len(users)
+
+    def discard(self, user_id: str) -> None:
+        """
+        Убирает пользователя из индекса, например если инкременты заказа записались в витрины не полностью.
+        """
+        key = user_key(user_id)
+        with self._lock:
+            self._touch_loading(key)
+            user = self._users.pop(key, None)
+            if user is not None:
+                self._entries -= user.size()
+                TOPK_ENTRIES.set(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def _clear(self) -> None:
+        self._users.clear()
+        self._entries = 0
+        # Загрузки, начатые до очистки, могли прочитать старые значения.
+        for loading in self._loading.values():
+            loading[1] += 1
+        TOPK_ENTRIES.set(0)
+
+    def _touch_loading(self, key: str) -> None:
+        loading = self._loading.get(key)
+        if loading is not None:
+            loading[1] += 1
+
+    def _load(self, key: str) -> _UserCounters:
+        user = _UserCounters()
+        with self._db.connection() as conn:
+            for dimension, (table, id_column, name_column) in _TABLES.items():
+                rows = conn.execute(
+                    f"SELECT replace({id_column}::text, '-', ''), {name_column}, order_cnt "
+                    f"FROM cdm.{table} WHERE user_id = %(user_id)s",
+                    {'user_id': key}
+                ).fetchall()
+                user.counters[dimension] = {item_id: [name, cnt] for item_id, name, cnt in rows}
+        return user
+
+    def _put(self, key: str, user: _UserCounters) -> None:
+        self._users[key] = user
+        self._entries += user.size()
+        self._evict()
+
+    def _evict(self) -> None:
+        # Последний добавленный или прочитанный пользователь не вытесняется, даже если один превышает бюджет.
+        while self._entries > self._max_entries and len(self._users) > 1:
+            _, user = self._users.popitem(last=False)
+            self._entries -= user.size()
+        TOPK_ENTRIES.set(self._entries)
+
+    @staticmethod
+    def _increment(user: _UserCounters, dimension: str, item_id: str, name: str, quantity: int) -> None:
+        entry = user.counters[dimension].get(item_id)
+        if entry is None:
+            user.counters[dimension][item_id] = [name, quantity]
+        else:
+            entry[1] += quantity
+        user.top[dimension] = None
+
+    @staticmethod
+    def _top(user: _UserCounters, dimension: str, limit: int) -> List[Dict]:
+        top = user.top[dimension]
+        if top is None:
+            top = user.top[dimension] = sorted(
+                ((item_id, name, cnt) for item_id, (name, cnt) in user.counters[dimension].items()),
+                key=lambda row: (-row[2], row[1]))
+        return [{'id': item_id, 'name': name, 'order_cnt': cnt} for item_id, name, cnt in top[:limit]]
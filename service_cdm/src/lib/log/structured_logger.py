@@ -0,0 +1,107 @@
+import json
+import logging
+import random
+import time
+from logging import Logger
+from typing import Any, Dict
+
+
+class _Record:
+    """
+    Строка лога, которая форматируется только в момент записи обработчиком.
+    Если уровень отключен, __str__ не вызывается и поля сообщения не сериализуются.
+    """
+    __slots__ = ('event', 'fields')
+
+    def __init__(self, event: str, fields: Dict[str, Any]) -> None:
+        self.event = event
+        self.fields = fields
+
+    def __str__(self) -> str:
+        if not self.fields:
+            return self.event
+        parts = ' '.join(f'{key}={value}' for key, value in self.fields.items())
+        return f'{self.event} {parts}'
+
+
+class _Payload:
+    """
+    Ленивое представление тела сообщения для выборочного логирования.
+    """
+    __slots__ = ('payload',)
+
+    def __init__(self, payload: Any) -> None:
+        self.payload = payload
+
+    def __str__(self) -> str:
+        return json.dumps(self.payload, ensure_ascii=False, default=str)
+
+
+class BatchStats:
+    """
+    Счетчики одного батча. Вместо строки лога на каждое сообщение процессор
+    пишет одну итоговую строку по батчу.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.consumed = 0
+        self.produced = 0
+        self.failed = 0
+        self.bytes = 0
+
+    def duration(self) -> float:
+        return time.perf_counter() - self.started
+
+    def fields(self) -> Dict[str, Any]:
+        duration = self.duration()
+        return {
+            'consumed': self.consumed,
+            'produced': self.produced,
+            'failed': self.failed,
+            'bytes': self.bytes,
+            'duration_ms': round(duration * 1000, 1),
+            'rate': round(self.consumed / duration, 1) if duration > 0 else 0.0
+        }
+
+
+class StructuredLogger:
+    """
+    Обертка над стандартным логгером для горячего пути обработки сообщений.
+    Args:
+        logger: Логгер приложения
+        payload_sample_rate: Доля сообщений (от 0 до 1), тело которых попадет в DEBUG-лог
+    """
+
+    def __init__(self, logger: Logger, payload_sample_rate: float = 0.0) -> None:
+        self._logger = logger
+        self._payload_sample_rate = payload_sample_rate
+
+    def _log(self, level: int, event: str, fields: Dict[str, Any]) -> None:
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, '%s', _Record(event, fields))
+
+    def debug(self, event: str, **fields) -> None:
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields) -> None:
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields) -> None:
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields) -> None:
+        self._log(logging.ERROR, event, fields)
+
+    def payload(self, event: str, payload: Any, **fields) -> None:
+        """
+        Пишет тело сообщения в DEBUG-лог только для выбранной доли сообщений.
+        """
+        if self._payload_sample_rate <= 0 or not self._logger.isEnabledFor(logging.DEBUG):
+            return
+        if self._payload_sample_rate < 1 and random.random() >= self._payload_sample_rate:
+            return
+        self._log(logging.DEBUG, event, dict(fields, payload=_Payload(payload)))
+
+    def batch_summary(self, stats: BatchStats) -> None:
+        self._log(logging.INFO, 'Батч обработан', stats.fields())
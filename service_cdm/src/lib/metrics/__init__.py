@@ -0,0 +1,29 @@
+from .metrics import (  # noqa
+    BATCH_DURATION,
+    CONSUMER_LAG,
+    DB_PIPELINE_LATENCY,
+    DB_PIPELINE_STATEMENTS,
+    DB_PIPELINE_TABLE_LATENCY,
+    DB_UPSERT_LATENCY,
+    DIMENSION_DOCUMENTS,
+    DIMENSION_INVALIDATIONS,
+    DIMENSION_LOOKUPS,
+    KAFKA_BACKPRESSURE_PAUSES,
+    KAFKA_INFLIGHT_BYTES,
+    KAFKA_REBALANCES,
+    KAFKA_TRANSACTIONS,
+    KNOWN_KEYS_LOOKUPS,
+    MESSAGES_CONSUMED,
+    MESSAGES_DEAD_LETTERED,
+    MESSAGES_FAILED,
+    MESSAGES_PRODUCED,
+    MESSAGES_RETRIED,
+    PIPELINE_E2E_LATENCY,
+    PIPELINE_HOP_LATENCY,
+    REDIS_LATENCY,
+    REDIS_LOOKUPS,
+    SNAPSHOT_LOADS,
+    TOPK_ENTRIES,
+    TOPK_LOOKUPS,
+    render_metrics,
+)
@@ -1 +1,2 @@
 from .pg_connect import PgConnect  # noqa
+from .pg_pipeline import PgPipeline  # noqa
@@ -0,0 +1 @@
+from .batch_profiler import BatchProfiler  # noqa
@@ -0,0 +1,28 @@
+import argparse
+import logging
+from datetime import timedelta
+
+from app_config import AppConfig
+from cdm_loader.refresh import CdmCountersRefresh
+
+# Пересчет витрин счетчиков из DDS set-based запросами, без переигрывания Kafka.
+# Пример запуска в контейнере CDM-сервиса:
+#   python refresh.py --mode full
+#   python refresh.py --mode incremental --overlap-minutes 10
+# Полный пересчет стоит запускать, когда потоковое обновление счетчиков остановлено
+# или выключено (CDM_REFRESH_INTERVAL > 0), иначе заказы, еще не прочитанные из Kafka, будут учтены дважды.
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Пересчет витрин CDM из DDS')
+    parser.add_argument('--mode', choices=['full', 'incremental'], default='incremental',
+                        help='full - пересобрать витрины целиком, incremental - от сохраненного watermark')
+    parser.add_argument('--overlap-minutes', type=float, default=5,
+                        help='Перекрытие инкремента с предыдущим watermark')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger('cdm_refresh')
+
+    config = AppConfig()
+    CdmCountersRefresh(config.pg_warehouse_db(), logger,
+                       overlap=timedelta(minutes=args.overlap_minutes)).run(args.mode)
@@ -0,0 +1,35 @@
+import argparse
+import logging
+
+from app_config import AppConfig
+from lib.kafka_connect import add_replay_arguments, replay_from_args
+from cdm_loader.cdm_message_processor_job import CdmMessageProcessor
+from cdm_loader.repository.cdm_repository import CdmRepository
+
+# Переигрывание топика DDS через CDM-процессор без сброса offset консьюмер-группы.
+# Пример запуска в контейнере CDM-сервиса:
+#   python replay.py --from-timestamp 2024-05-01T10:00:00 --to-timestamp 2024-05-01T12:00:00 --rate 200
+#   python replay.py --partition 3 --from-offset 1500 --to-offset 1999 --no-counters
+# Скетчи и агрегаты продаж повторную доставку не учитывают, а счетчики пользователей инкрементные:
+# переигранный заказ будет учтен в них второй раз. Поэтому с --no-counters счетчики не трогаются,
+# и после переигрывания их пересобирают из DDS: python refresh.py --mode full.
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Переигрывание топика через CDM-процессор')
+    add_replay_arguments(parser)
+    parser.add_argument('--no-counters', action='store_true',
+                        help='Не инкрементировать счетчики пользователей (пересобрать их после refresh.py)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger('cdm_replay')
+
+    config = AppConfig()
+    consumer = config.kafka_replay_consumer(args.topic)
+    proc = CdmMessageProcessor(
+        consumer,
+        CdmRepository(config.pg_warehouse_db(), bool(config.pg_pipeline)),
+        args.batch_size,
+        logger,
+        stream_counters=not (args.no_counters or config.cdm_refresh_interval))
+    replay_from_args(args, consumer, proc, logger, config.failure_handler())
@@ -0,0 +1,72 @@
+import pytest
+
+from cdm_loader.sketches import HyperLogLog
+
+
+def sketch(values, precision=12):
+    hll = HyperLogLog(precision)
+    hll.update(values)
+    return hll
+
+
+def users(start, stop):
+    return [f'user-{i}' for i in range(start, stop)]
+
+
+def test_sparse_round_trip():
+    hll = sketch(users(0, 100))
+    data = hll.to_bytes()
+    # 100 значений заполняют меньше трети регистров: хранится разреженное представление.
+    assert len(data) < 1 << 12
+    restored = HyperLogLog.from_bytes(data)
+    assert restored.to_bytes() == data
+    assert restored.count() == hll.count()
+
+
+def test_dense_round_trip():
+    hll = sketch(users(0, 20000))
+    data = hll.to_bytes()
+    assert len(data) == 3 + (1 << 12)
+    restored = HyperLogLog.from_bytes(memoryview(data))
+    assert restored.to_bytes() == data
+    assert restored.count() == hll.count()
+
+
+def test_empty_round_trip():
+    restored = HyperLogLog.from_bytes(HyperLogLog().to_bytes())
+    assert restored.count() == 0
+
+
+@pytest.mark.parametrize('count', [1000, 50000])
+def test_estimate_error(count):
+    assert abs(sketch(users(0, count)).count() - count) / count < 0.05
+
+
+def test_merge_equals_union():
+    left = sketch(users(0, 3000))
+    right = sketch(users(2000, 6000))
+    left.merge(right)
+    assert left.to_bytes() == sketch(users(0, 6000)).to_bytes()
+
+
+def test_merge_is_idempotent_across_encodings():
+    sparse = sketch(users(0, 50))
+    dense = sketch(users(0, 20000))
+    merged = HyperLogLog.from_bytes(dense.to_bytes())
+    merged.merge(HyperLogLog.from_bytes(sparse.to_bytes()))
+    merged.merge(HyperLogLog.from_bytes(sparse.to_bytes()))
+    expected = sketch(users(0, 20000))
+    expected.merge(sparse)
+    assert merged.to_bytes() == expected.to_bytes()
+
+
+def test_merge_requires_same_precision():
+    with pytest.raises(ValueError):
+        sketch(users(0, 10), precision=12).merge(sketch(users(0, 10), precision=10))
+
+
+def test_unsupported_format_version():
+    data = bytearray(HyperLogLog().to_bytes())
+    data[0] = 99
+    with pytest.raises(ValueError):
+        HyperLogLog.from_bytes(bytes(data))
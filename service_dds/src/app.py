@@ -1,14 +1,20 @@
 import logging
 
 from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask
+from flask import Flask, Response, jsonify, request
 
 from app_config import AppConfig
+from lib.metrics import render_metrics
+from lib.snapshot import save_on_shutdown
+from lib.profiling import BatchProfiler
 from dds_loader.dds_message_processor_job import DdsMessageProcessor
 from dds_loader.repository.dds_repository import DdsRepository
 
 app = Flask(__name__)
 
+# Профайлер оборачивает функции run и run_retries процессора и включается по запросу к /admin/profile.
+profiler = BatchProfiler()
+
 
 # Заводим endpoint для проверки, поднялся ли сервис.
 # Обратиться к нему можно будет GET-запросом по адресу localhost:5000/health.
@@ -18,18 +24,61 @@ def health():
     return 'healthy'
 
 
-if __name__ == '__main__':
-    # Устанавливаем уровень логгирования в Debug, чтобы иметь возможность просматривать отладочные логи.
-    app.logger.setLevel(logging.DEBUG)
+# Endpoint для сбора метрик Prometheus: счетчики сообщений, длительность батчей,
+# задержки вставки в таблицы и отставание консьюмера.
+# Обратиться к нему можно будет GET-запросом по адресу localhost:5000/metrics.
+@app.get('/metrics')
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
+# Включение профилирования следующих N батчей:
+# POST localhost:5000/admin/profile?batches=5&mode=sampling (или mode=cprofile).
+# GET того же адреса вернет статус и агрегированный профиль,
+# а GET /admin/profile/collapsed - стеки в формате collapsed для построения flamegraph.
+@app.post('/admin/profile')
+def start_profile():
+    try:
+        profiler.start(
+            batches=int(request.args.get('batches', 1)),
+            mode=request.args.get('mode', 'sampling'),
+            interval=float(request.args.get('interval', 0.005)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(profiler.status())
+
+
+@app.get('/admin/profile')
+def get_profile():
+    return jsonify(dict(profiler.status(), report=profiler.report(int(request.args.get('top', 50)))))
 
+
+@app.get('/admin/profile/collapsed')
+def get_profile_collapsed():
+    return Response(profiler.collapsed(), content_type='text/plain; charset=utf-8')
+
+
+if __name__ == '__main__':
     # Инициализируем конфиг. Для удобства, вынесли логику получения значений переменных окружения в отдельный класс.
     config = AppConfig()
 
+    # Уровень логгирования задается через LOG_LEVEL (по умолчанию INFO).
+    # Для просмотра отладочных логов достаточно выставить LOG_LEVEL=DEBUG.
+    app.logger.setLevel(logging.getLevelName(config.log_level))
+
     # Инициализируем параметры подключения к сервисам
     kafka_consumer = config.kafka_consumer()
-    kafka_producer = config.kafka_producer()
-    dds_repository = DdsRepository(config.pg_warehouse_db())
-    batch_size = 100
+    # В транзакционном режиме сообщения батча и offset консьюмера фиксируются вместе (KAFKA_TRANSACTIONAL=1).
+    kafka_producer = config.kafka_producer(bool(config.kafka_transactional))
+    # Ключи уже загруженных справочных строк читаются из файла снимка, если он есть и совпадает с базой.
+    known_keys = config.known_keys(app.logger)
+    if known_keys:
+        known_keys.load()
+        if config.dds_known_keys_path:
+            save_on_shutdown(known_keys.save_snapshot)
+    dds_repository = DdsRepository(config.pg_warehouse_db(), known_keys, bool(config.pg_pipeline))
+    batch_size = config.batch_size
 
     # Инициализируем процессор сообщений.
     # Пока он пустой. Нужен для того, чтобы потом в нем писать логику обработки сообщений из Kafka.
@@ -38,12 +87,22 @@ if __name__ == '__main__':
         kafka_producer,
         dds_repository,
         batch_size,
-        app.logger)
+        app.logger,
+        config.log_payload_sample_rate,
+        config.failure_handler(kafka_producer),
+        config.kafka_retry_consumer(),
+        config.batch_max_bytes)
 
     # Запускаем процессор в бэкграунде.
     # BackgroundScheduler будет по расписанию вызывать функцию run нашего обработчика(StgMessageProcessor).
     scheduler = BackgroundScheduler()
-    scheduler.add_job(func=proc.run, trigger="interval", seconds=config.DEFAULT_JOB_INTERVAL)
+    scheduler.add_job(func=profiler.wrap(proc.run), trigger="interval", seconds=config.DEFAULT_JOB_INTERVAL)
+    # Сообщения из retry-топика обрабатываются отдельным джобом и не задерживают основной поток.
+    if config.kafka_retry_topic:
+        scheduler.add_job(func=profiler.wrap(proc.run_retries), trigger="interval", seconds=config.DEFAULT_JOB_INTERVAL)
+    if known_keys and config.dds_known_keys_path:
+        scheduler.add_job(func=known_keys.save_snapshot, trigger="interval", seconds=config.snapshot_interval,
+                          max_instances=1)
     scheduler.start()
 
     # стартуем Flask-приложение.
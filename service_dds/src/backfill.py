@@ -0,0 +1,30 @@
+import argparse
+import logging
+
+from app_config import AppConfig
+from dds_loader.backfill import DdsBackfill
+
+# Загрузка истории в слой DDS напрямую из stg.order_events, без Kafka.
+# Пример запуска в контейнере DDS-сервиса:
+#   python backfill.py --job-name rebuild-2024-05 --workers 8 --chunk-size 5000
+# Повторный запуск с тем же --job-name продолжит загрузку с сохраненных чекпоинтов.
+# С --archive-dir события читаются из архива Parquet, выгруженного STG-сервисом (service_stg/src/archive.py).
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Загрузка истории в DDS из stg.order_events')
+    parser.add_argument('--job-name', default='dds-backfill', help='Имя загрузки для чекпоинтов')
+    parser.add_argument('--workers', type=int, default=4, help='Количество процессов-воркеров')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='Количество событий в одной транзакции')
+    parser.add_argument('--from-id', type=int, help='Первый object_id (по умолчанию минимальный в таблице)')
+    parser.add_argument('--to-id', type=int, help='Последний object_id (по умолчанию максимальный в таблице)')
+    parser.add_argument('--archive-dir', help='Читать события из архива Parquet вместо stg.order_events')
+    parser.add_argument('--restart', action='store_true', help='Начать заново, игнорируя чекпоинты')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger('dds_backfill')
+
+    config = AppConfig()
+    DdsBackfill(config, args.job_name, args.workers, args.chunk_size, logger,
+                archive_dir=args.archive_dir).run(
+        restart=args.restart, from_id=args.from_id, to_id=args.to_id)
@@ -0,0 +1 @@
+from .backfill_job import DdsBackfill  # noqa
@@ -0,0 +1,181 @@
+import math
+import multiprocessing
+import queue
+import time
+from logging import Logger
+from typing import Dict, List, Optional, Tuple
+
+from lib.kafka_connect import is_transient
+from dds_loader.backfill.bulk_loader import DdsBulkLoader
+from dds_loader.backfill.checkpoints import BackfillCheckpoints, BackfillRange
+from dds_loader.backfill.enrichment import OrderEnricher
+from dds_loader.backfill.sources import ParquetOrderEventSource, PgOrderEventSource
+
+
+def split_ranges(min_id: int, max_id: int, parts: int) -> List[Tuple[int, int]]:
+    """
+    Делит [min_id, max_id] на parts диапазонов вида (start, end]: start не включается, end включается.
+    """
+    start = min_id - 1
+    step = max(math.ceil((max_id - start) / max(parts, 1)), 1)
+    ranges = []
+    while start < max_id:
+        end = min(start + step, max_id)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+MAX_CHUNK_ATTEMPTS = 5
+
+
+def open_source(config, archive_dir: Optional[str], chunk_size: int = 5000):
+    """
+    Источник событий: архив Parquet, если задан archive_dir, иначе stg.order_events.
+    """
+    if archive_dir:
+        return ParquetOrderEventSource(archive_dir)
+    return PgOrderEventSource(config.pg_warehouse_db(), itersize=chunk_size)
+
+
+def backfill_worker(config, job_name: str, backfill_range: BackfillRange, chunk_size: int,
+                    progress: multiprocessing.Queue, archive_dir: Optional[str] = None) -> None:
+    """
+    Загружает один диапазон object_id. Выполняется в отдельном процессе: у каждого воркера
+    свои соединения с Postgres и Redis и свой кэш документов Redis.
+    """
+    range_start, range_end, last_id = backfill_range
+    db = config.pg_warehouse_db()
+    source = open_source(config, archive_dir, chunk_size)
+    enricher = OrderEnricher(config.redis_client())
+    checkpoints = BackfillCheckpoints(db, job_name)
+
+    with db.connection() as conn:
+        loader = DdsBulkLoader(conn)
+        chunk = []
+        rows = skipped = 0
+
+        def flush() -> None:
+            nonlocal chunk, rows, skipped
+            for attempt in range(1, MAX_CHUNK_ATTEMPTS + 1):
+                try:
+                    loader.load(chunk)
+                    checkpoints.save(conn, range_start, last_id, rows)
+                    conn.commit()
+                    break
+                except Exception as e:
+                    conn.rollback()
+                    if not is_transient(e) or attempt == MAX_CHUNK_ATTEMPTS:
+                        raise
+                    time.sleep(attempt)
+            progress.put(('progress', range_start, last_id, rows, skipped))
+            chunk, rows, skipped = [], 0, 0
+
+        for object_id, object_type, payload in source.rows(last_id, range_end):
+            rows += 1
+            last_id = object_id
+            try:
+                chunk.append(enricher.to_dds_message(object_id, object_type, payload))
+            except Exception:
+                # Событие, которое не удалось обогатить (например, ресторана уже нет в Redis),
+                # пропускаем: STG-сервис в этом случае тоже не передал бы его в DDS.
+                skipped += 1
+            if rows >= chunk_size:
+                flush()
+
+        # Диапазон прочитан целиком: чекпоинт ставится на его конец, даже если у последних id нет строк,
+        # иначе при продолжении загрузки диапазон считался бы незавершенным.
+        if rows or last_id < range_end:
+            last_id = range_end
+            flush()
+
+    progress.put(('done', range_start, range_end, 0, 0))
+
+
+class DdsBackfill:
+    """
+    Загрузка истории в Data Vault напрямую из stg.order_events или из его архива в Parquet, минуя Kafka.
+    Диапазон object_id делится между процессами-воркерами, прогресс каждого диапазона
+    сохраняется в dds.backfill_checkpoints, поэтому прерванную загрузку можно продолжить.
+    Args:
+        config: AppConfig сервиса; воркеры создают по нему свои подключения
+        job_name: Имя загрузки, по нему ищутся чекпоинты
+        workers: Количество процессов для нового запуска
+        chunk_size: Количество событий в одной транзакции
+        logger: Логгер для сообщений о прогрессе
+        report_interval: Как часто писать прогресс в лог, секунды
+        archive_dir: Каталог архива Parquet; если задан, события читаются из него, а не из stg.order_events
+    """
+
+    def __init__(self, config, job_name: str, workers: int, chunk_size: int, logger: Logger,
+                 report_interval: float = 10.0, archive_dir: Optional[str] = None) -> None:
+        self._config = config
+        self._job_name = job_name
+        self._workers = workers
+        self._chunk_size = chunk_size
+        self._logger = logger
+        self._report_interval = report_interval
+        self._archive_dir = archive_dir
+        self._checkpoints = BackfillCheckpoints(config.pg_warehouse_db(), job_name)
+
+    def _plan(self, restart: bool, from_id: Optional[int], to_id: Optional[int]) -> List[BackfillRange]:
+        self._checkpoints.ensure_table()
+        ranges = [] if restart else self._checkpoints.load_ranges()
+        if ranges:
+            self._logger.info('Продолжаем загрузку %s с сохраненных чекпоинтов', self._job_name)
+            return ranges
+
+        min_id, max_id = open_source(self._config, self._archive_dir).id_bounds()
+        min_id = from_id if from_id is not None else min_id
+        max_id = to_id if to_id is not None else max_id
+        return self._checkpoints.create_ranges(split_ranges(min_id, max_id, self._workers))
+
+    def run(self, restart: bool = False, from_id: Optional[int] = None, to_id: Optional[int] = None) -> None:
+        ranges = self._plan(restart, from_id, to_id)
+        pending = [r for r in ranges if r[2] < r[1]]
+        total_ids = sum(end - start for start, end, _ in ranges) or 1
+        positions: Dict[int, int] = {start: last for start, _, last in ranges}
+        self._logger.info('Загрузка %s: диапазонов %d, осталось %d', self._job_name, len(ranges), len(pending))
+
+        progress = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=backfill_worker,
+                                    args=(self._config, self._job_name, r, self._chunk_size, progress,
+                                          self._archive_dir),
+                                    daemon=True)
+            for r in pending
+        ]
+        for p in processes:
+            p.start()
+
+        started = time.monotonic()
+        last_report = started
+        loaded = skipped = 0
+        running = len(processes)
+        while running:
+            try:
+                kind, range_start, last_id, rows, skipped_rows = progress.get(timeout=1)
+                positions[range_start] = last_id
+                loaded += rows
+                skipped += skipped_rows
+                if kind == 'done':
+                    running -= 1
+            except queue.Empty:
+                if not any(p.is_alive() for p in processes):
+                    break
+
+            now = time.monotonic()
+            if now - last_report >= self._report_interval or not running:
+                last_report = now
+                done_ids = sum(positions[start] - start for start, _, _ in ranges)
+                rate = loaded / (now - started) if now > started else 0.0
+                self._logger.info('Прогресс %s: %.1f%%, загружено %d, пропущено %d, %.0f событий/с',
+                                  self._job_name, 100 * done_ids / total_ids, loaded, skipped, rate)
+
+        for p in processes:
+            p.join()
+        failed = [p for p in processes if p.exitcode != 0]
+        if failed:
+            raise RuntimeError(f'Воркеров завершилось с ошибкой: {len(failed)}. '
+                               f'Повторный запуск продолжит загрузку с чекпоинтов')
+        self._logger.info('Загрузка %s завершена за %.0f с', self._job_name, time.monotonic() - started)
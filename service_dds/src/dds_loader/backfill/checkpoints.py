@@ -0,0 +1,82 @@
+from typing import List, Tuple
+
+from psycopg import Connection
+
+from lib.pg import PgConnect
+
+# Диапазон воркера: (range_start, range_end, last_object_id)
+BackfillRange = Tuple[int, int, int]
+
+
+class BackfillCheckpoints:
+    """
+    Прогресс загрузки истории по диапазонам object_id в таблице dds.backfill_checkpoints.
+    Чекпоинт обновляется в той же транзакции, что и загруженные данные,
+    поэтому после перезапуска загрузка продолжается ровно с места остановки.
+    """
+
+    def __init__(self, db: PgConnect, job_name: str) -> None:
+        self._db = db
+        self._job_name = job_name
+
+    def ensure_table(self) -> None:
+        with self._db.connection() as conn:
+            conn.execute(
+                """
+                    CREATE TABLE IF NOT EXISTS dds.backfill_checkpoints(
+                        job_name VARCHAR NOT NULL,
+                        range_start BIGINT NOT NULL,
+                        range_end BIGINT NOT NULL,
+                        last_object_id BIGINT NOT NULL,
+                        rows_loaded BIGINT NOT NULL DEFAULT 0,
+                        updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                        CONSTRAINT pk_backfill_checkpoints PRIMARY KEY (job_name, range_start)
+                    )
+                """
+            )
+
+    def load_ranges(self) -> List[BackfillRange]:
+        with self._db.connection() as conn:
+            rows = conn.execute(
+                """
+                    SELECT range_start, range_end, last_object_id
+                    FROM dds.backfill_checkpoints
+                    WHERE job_name = %(job_name)s
+                    ORDER BY range_start
+                """,
+                {'job_name': self._job_name}
+            ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def create_ranges(self, ranges: List[Tuple[int, int]]) -> List[BackfillRange]:
+        """
+        Регистрирует диапазоны нового запуска. Первая обработанная строка диапазона - range_start + 1.
+        """
+        with self._db.connection() as conn:
+            conn.execute('DELETE FROM dds.backfill_checkpoints WHERE job_name = %(job_name)s',
+                         {'job_name': self._job_name})
+            with conn.cursor() as cur:
+                cur.executemany(
+                    """
+                        INSERT INTO dds.backfill_checkpoints(job_name, range_start, range_end, last_object_id)
+                        VALUES (%(job_name)s, %(range_start)s, %(range_end)s, %(range_start)s)
+                    """,
+                    [{'job_name': self._job_name, 'range_start': start, 'range_end': end} for start, end in ranges]
+                )
+        return [(start, end, start) for start, end in ranges]
+
+    def save(self, conn: Connection, range_start: int, last_object_id: int, rows: int) -> None:
+        """
+        Сдвигает чекпоинт диапазона в текущей транзакции conn. Фиксирует транзакцию вызывающий код.
+        """
+        conn.execute(
+            """
+                UPDATE dds.backfill_checkpoints
+                SET last_object_id = %(last_object_id)s,
+                    rows_loaded = rows_loaded + %(rows)s,
+                    updated_at = NOW()
+                WHERE job_name = %(job_name)s AND range_start = %(range_start)s
+            """,
+            {'job_name': self._job_name, 'range_start': range_start,
+             'last_object_id': last_object_id, 'rows': rows}
+        )
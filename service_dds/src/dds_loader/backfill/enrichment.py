@@ -0,0 +1,36 @@
+from typing import Dict
+
+from lib.redis import RedisClient, enrich_order, menu_index
+
+
+class OrderEnricher:
+    """
+    Превращает сырое событие заказа из stg.order_events в сообщение того же вида,
+    которое STG-сервис отправляет в топик для DDS (enrich_order): с именами пользователя, ресторана и блюд из Redis.
+    Документы Redis кэшируются на время загрузки, меню ресторана индексируется по id блюда.
+    """
+
+    def __init__(self, redis_client: RedisClient) -> None:
+        self._redis = redis_client
+        self._users: Dict[str, Dict] = {}
+        self._restaurants: Dict[str, Dict] = {}
+        self._menus: Dict[str, Dict[str, Dict]] = {}
+
+    def _user(self, user_id: str) -> Dict:
+        user = self._users.get(user_id)
+        if user is None:
+            user = self._users[user_id] = self._redis.get(user_id)
+        return user
+
+    def _menu(self, restaurant_id: str) -> Dict[str, Dict]:
+        menu = self._menus.get(restaurant_id)
+        if menu is None:
+            restaurant = self._restaurants[restaurant_id] = self._redis.get(restaurant_id)
+            menu = self._menus[restaurant_id] = menu_index(restaurant)
+        return menu
+
+    def to_dds_message(self, object_id: int, object_type: str, payload: Dict) -> Dict:
+        rest_id = payload['restaurant']['id']
+        menu = self._menu(rest_id)
+        return enrich_order(object_id, object_type, payload, self._user(payload['user']['id']),
+                            self._restaurants[rest_id], menu)
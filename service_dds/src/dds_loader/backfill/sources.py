@@ -0,0 +1,89 @@
+from typing import Dict, Iterator, Optional, Tuple
+
+import pyarrow.dataset as ds
+
+from lib.archive import ArchiveManifest, ORDER_EVENTS_SCHEMA, unflatten_event
+from lib.pg import PgConnect
+
+# Строка источника: (object_id, object_type, payload)
+OrderEventRow = Tuple[int, str, Dict]
+
+
+class PgOrderEventSource:
+    """
+    Читает stg.order_events в диапазоне object_id серверным курсором,
+    поэтому в памяти процесса одновременно находится не больше itersize строк.
+    """
+
+    def __init__(self, db: PgConnect, itersize: int = 5000) -> None:
+        self._db = db
+        self._itersize = itersize
+
+    def id_bounds(self) -> Tuple[int, int]:
+        with self._db.connection() as conn:
+            row = conn.execute('SELECT MIN(object_id), MAX(object_id) FROM stg.order_events').fetchone()
+        return row[0] or 0, row[1] or 0
+
+    def rows(self, after_id: int, last_id: int) -> Iterator[OrderEventRow]:
+        """
+        Строки с after_id < object_id <= last_id по возрастанию object_id.
+        Если заказ приходил несколько раз с разным sent_dttm, берется последняя версия.
+        """
+        with self._db.connection() as conn:
+            with conn.cursor(name='dds_backfill') as cur:
+                cur.itersize = self._itersize
+                cur.execute(
+                    """
+                        SELECT DISTINCT ON (object_id) object_id, object_type, payload
+                        FROM stg.order_events
+                        WHERE object_id > %(after_id)s AND object_id <= %(last_id)s
+                        ORDER BY object_id, sent_dttm DESC
+                    """,
+                    {'after_id': after_id, 'last_id': last_id}
+                )
+                for object_id, object_type, payload in cur:
+                    yield object_id, object_type, payload
+
+
+class ParquetOrderEventSource:
+    """
+    Читает события из архива Parquet, который выгружает STG-сервис (archive.py), в том же виде,
+    что и PgOrderEventSource: по возрастанию object_id, последняя по sent_dttm версия заказа.
+    Версии заказа могут лежать в разных файлах, поэтому диапазон читается окнами по window_size
+    идентификаторов: в окне строки из всех подходящих файлов сортируются и схлопываются в памяти.
+    Фильтр по object_id пропускает файлы по манифесту и row group по статистике.
+    """
+
+    def __init__(self, archive_dir: str, window_size: int = 50000) -> None:
+        self._manifest = ArchiveManifest(archive_dir)
+        self._window_size = window_size
+
+    def id_bounds(self) -> Tuple[int, int]:
+        files = [f for f in self._manifest.files() if f['rows']]
+        if not files:
+            return 0, 0
+        return min(f['min_object_id'] for f in files), max(f['max_object_id'] for f in files)
+
+    def rows(self, after_id: int, last_id: int) -> Iterator[OrderEventRow]:
+        files = self._manifest.files()
+        window_start = after_id
+        while window_start < last_id:
+            window_end = min(window_start + self._window_size, last_id)
+            paths = [self._manifest.path(f) for f in files
+                     if f['rows'] and f['min_object_id'] <= window_end and f['max_object_id'] > window_start]
+            if paths:
+                yield from self._window(paths, window_start, window_end)
+            window_start = window_end
+
+    def _window(self, paths, window_start: int, window_end: int) -> Iterator[OrderEventRow]:
+        dataset = ds.dataset(paths, schema=ORDER_EVENTS_SCHEMA, format='parquet')
+        table = dataset.to_table(
+            filter=(ds.field('object_id') > window_start) & (ds.field('object_id') <= window_end))
+        table = table.sort_by([('object_id', 'ascending'), ('sent_dttm', 'descending')])
+
+        previous: Optional[int] = None
+        for record in table.to_pylist():
+            if record['object_id'] == previous:
+                continue
+            previous = record['object_id']
+            yield unflatten_event(record)
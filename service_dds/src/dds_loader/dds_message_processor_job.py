@@ -1,10 +1,11 @@
-import time
-import json
-from datetime import datetime
+import threading
 from logging import Logger
-from typing  import List, Dict
+from typing import Optional
 
-from lib.kafka_connect.kafka_connectors import KafkaConsumer, KafkaProducer
+from lib.kafka_connect import FailureHandler, KafkaConsumer, KafkaMessage, KafkaProducer
+from lib.log import BatchStats, StructuredLogger
+from lib.metrics import BATCH_DURATION, CONSUMER_LAG, MESSAGES_CONSUMED, MESSAGES_FAILED
+from lib.tracing import TraceContext
 from dds_loader.repository.dds_repository import DdsRepository
 
 
@@ -14,104 +15,180 @@ class DdsMessageProcessor:
                  producer: KafkaProducer,
                  dds_repository: DdsRepository,
                  batch_size: int = 100,
-                 logger: Logger = None) -> None:
+                 logger: Logger = None,
+                 log_sample_rate: float = 0.0,
+                 failure_handler: FailureHandler = None,
+                 retry_consumer: KafkaConsumer = None,
+                 batch_max_bytes: int = 0) -> None:
         self._consumer = consumer
         self._producer = producer
         self._dds_repository = dds_repository
         self._batch_size = batch_size
-        self._logger = logger
+        # Батч ограничен и по объему: пачка крупных заказов не раздувает память процесса (0 - только по числу).
+        self._batch_max_bytes = batch_max_bytes
+        self._logger = StructuredLogger(logger, log_sample_rate)
+        self._failures = failure_handler or FailureHandler()
+        self._retry_consumer = retry_consumer
+        # Транзакционный продюсер (KAFKA_TRANSACTIONAL=1): отправленные за батч сообщения и offset прочитанных
+        # фиксируются одной транзакцией. Транзакция у продюсера одна, поэтому основной и retry-батчи идут по очереди.
+        self._transaction = producer if getattr(producer, 'transactional', False) else None
+        self._transaction_lock = threading.Lock()
+        self._revoke_error: Optional[Exception] = None
+        # Перед отзывом партиций при ребалансировке дописываем накопленное за батч, после чего консьюмер
+        # фиксирует offset отзываемых партиций.
+        for c in (consumer, retry_consumer):
+            if c:
+                c.on_revoke(lambda c=c: self._on_revoke(c))
 
     # функция, которая будет вызываться по расписанию.
     def run(self) -> None:
+        self._run_batch(self._consumer)
+
+    # функция, которая по расписанию обрабатывает сообщения из retry-топика.
+    def run_retries(self) -> None:
+        if self._retry_consumer:
+            self._run_batch(self._retry_consumer, delayed=True)
+
+    def _run_batch(self, consumer: KafkaConsumer, delayed: bool = False) -> None:
+        if not self._transaction:
+            self._consume_batch(consumer, delayed)
+            return
+        with self._transaction_lock:
+            self._revoke_error = None
+            self._transaction.begin_transaction()
+            try:
+                self._consume_batch(consumer, delayed)
+            except Exception:
+                # Сообщения батча не видны консьюмерам read_committed, offset не сдвинулись:
+                # батч будет прочитан и обработан снова.
+                try:
+                    self._transaction.abort_transaction()
+                finally:
+                    consumer.rewind()
+                raise
+
+    def _consume_batch(self, consumer: KafkaConsumer, delayed: bool = False) -> None:
         # Пишем в лог, что джоб был запущен.
-        self._logger.info(f"{datetime.utcnow()}: START")
+        self._logger.debug('START', topic=consumer.topic)
+        stats = BatchStats()
 
-        # Имитация работы. Здесь будет реализована обработка сообщений.
         for _ in range(self._batch_size):
-            msg = self._consumer.consume()
-            if not msg:
+            message = consumer.consume_message()
+            if self._revoke_error is not None:
+                # Транзакция при отзыве партиций не закоммичена: прочитанное до отзыва нужно прочитать заново.
+                raise self._revoke_error
+            if not message:
                 self._logger.debug('Сообщений из кафки нет')
                 break
-            self._logger.debug(f'Получено сообщение из кафки: {msg}')
+            if delayed and self._failures.due_in(message) > 0:
+                # Время повтора еще не наступило: возвращаем сообщение в очередь до следующего запуска.
+                consumer.seek(message)
+                break
+            stats.consumed += 1
+            stats.bytes += message.size
+            MESSAGES_CONSUMED.labels(consumer.topic).inc()
+            self._logger.payload('Получено сообщение из кафки', message.value, offset=message.offset)
             try:
-
-                # Вставляем сообщениие в postgr
-                self._logger.info('Вставляем сообщение в postgr')
-
-                self._logger.debug('Начинаем вставлять данные в h_user')
-                self._dds_repository.insert_h_user(msg=msg)
-                self._logger.debug('Данные загружены в h_user')
-
-                self._logger.debug('Начинаем вставлять данные в h_product')
-                self._dds_repository.insert_h_product(msg=msg)
-                self._logger.debug('Данные загружены в h_product')
-
-                self._logger.debug('Начинаем вставлять данные в h_category')
-                self._dds_repository.insert_h_category(msg=msg)
-                self._logger.debug('Данные загружены в h_category')
-
-                self._logger.debug('Начинаем вставлять данные в h_restaurant')
-                self._dds_repository.insert_h_restaurant(msg=msg)
-                self._logger.debug('Данные загружены в h_restaurant')
-
-                self._logger.debug('Начинаем вставлять данные в h_order')
-                self._dds_repository.insert_h_order(msg=msg)
-                self._logger.debug('Данные загружены в h_order')
-
-                self._logger.debug('Начинаем вставлять данные в l_order_product')
-                self._dds_repository.insert_l_order_product(msg=msg)
-                self._logger.debug('Данные загружены в l_order_product')
-
-                self._logger.debug('Начинаем вставлять данные в l_product_restaurant')
-                self._dds_repository.insert_l_product_restaurant(msg=msg)
-                self._logger.debug('Данные загружены в l_product_restaurant')
-
-                self._logger.debug('Начинаем вставлять данные в l_product_category')
-                self._dds_repository.insert_l_product_category(msg=msg)
-                self._logger.debug('Данные загружены в l_product_category')
-
-                self._logger.debug('Начинаем вставлять данные в l_order_user')
-                self._dds_repository.insert_l_order_user(msg=msg)
-                self._logger.debug('Данные загружены в l_order_user')
-
-                self._logger.debug('Начинаем вставлять данные в s_user_names')
-                self._dds_repository.insert_s_user_names(msg=msg)
-                self._logger.debug('Данные загружены в s_user_names')
-
-                self._logger.debug('Начинаем вставлять данные в s_product_names')
-                self._dds_repository.insert_s_product_names(msg=msg)
-                self._logger.debug('Данные загружены в s_product_names')
-
-                self._logger.debug('Начинаем вставлять данные в s_restaurant_names')
-                self._dds_repository.insert_s_restaurant_names(msg=msg)
-                self._logger.debug('Данные загружены в s_restaurant_names')
-
-                self._logger.debug('Начинаем вставлять данные в s_order_cost')
-                self._dds_repository.insert_s_order_cost(msg=msg)
-                self._logger.debug('Данные загружены в s_order_cost')
-
-                self._logger.debug('Начинаем вставлять данные в s_order_status')
-                self._dds_repository.insert_s_order_status(msg=msg)
-                self._logger.debug('Данные загружены в s_order_status')
-
-                self._logger.info('Все данные загружены в таблицы')
-                # ----------------------------------------------------------------------------
-
-                # Готовим сообщения для отправки в кафку
-                result = {
-                    'object_id': msg['object_id'],
-                    'object_type': msg['object_type'],
-                    'status': msg['payload']['status'],
-                    'date': msg['payload']['date'],
-                    'user': msg['payload']['user'],
-                    'products': msg['payload']['products'],
-
-                }
-                self._producer.produce(result)
-                self._logger.info(f'DDS Сообщение отправлено продюсеру: {result}')
-
+                self._process(message)
+                stats.produced += 1
             except Exception as e:
-                self._logger.error(f'Ошибка при обработке сообщения: {e}')
+                # Ошибочное сообщение уходит в retry- или dead-letter топик, батч продолжается.
+                stats.failed += 1
+                MESSAGES_FAILED.labels(consumer.topic).inc()
+                route = self._failures.handle(message, e)
+                self._logger.error('Ошибка при обработке сообщения',
+                                   offset=message.offset, error=repr(e), route=route)
+            if self._batch_max_bytes and stats.bytes >= self._batch_max_bytes:
+                break
 
-        # Пишем в лог, что джоб успешно завершен.
-        self._logger.info(f"{datetime.utcnow()}: FINISH")
+        # Отправленные сообщения доставлены до фиксации offset. В совмещенном режиме здесь же
+        # следующие слои записывают агрегаты, накопленные за батч.
+        self.flush()
+
+        # Все прочитанные сообщения обработаны или переданы в retry/dead-letter топики.
+        # В транзакционном режиме offset фиксируются вместе с отправленными сообщениями.
+        consumer.commit(self._transaction)
+
+        # Обновляем метрики батча: длительность обработки и отставание консьюмера по каждой партиции.
+        BATCH_DURATION.observe(stats.duration())
+        for partition, lag in consumer.lag().items():
+            CONSUMER_LAG.labels(consumer.topic, partition).set(lag)
+
+        # Пишем в лог итоговую строку по батчу.
+        self._logger.batch_summary(stats)
+
+    # Обработка одного сообщения без чтения из Kafka: так предыдущий слой передает заказ
+    # в совмещенном режиме (service_pipeline). Ошибки пробрасываются вызывающему.
+    def process(self, message: KafkaMessage) -> None:
+        self._process(message)
+
+    def flush(self) -> None:
+        self._producer.flush()
+
+    def _on_revoke(self, consumer: KafkaConsumer) -> None:
+        if not self._transaction:
+            self.flush()
+            return
+        # Отзыв партиций приходит внутри poll, то есть во время батча этого консьюмера: прочитанное до него
+        # фиксируем открытой транзакцией, остаток батча пойдет в новой.
+        try:
+            self.flush()
+            if self._transaction.in_transaction:
+                consumer.commit(self._transaction)
+                self._transaction.begin_transaction()
+        except Exception as e:
+            # Консьюмер ошибку обработчика только пишет в лог и не фиксирует offset. Батч прерывается сразу
+            # после poll: транзакция отменяется, консьюмер возвращается на зафиксированные offset.
+            self._revoke_error = e
+            raise
+
+    def _process(self, message: KafkaMessage) -> None:
+        msg = message.value
+        trace = TraceContext.from_message(message)
+
+        # Вставки сообщения уходят в базу одной транзакцией в режиме pipeline: ошибка любой из них
+        # откатывает все вставки и относится к этому сообщению.
+        with self._dds_repository.pipeline():
+            # Вставляем сообщениие в postgr: сначала хабы, затем линки и сателлиты.
+            self._dds_repository.insert_h_user(msg=msg)
+            self._dds_repository.insert_h_product(msg=msg)
+            self._dds_repository.insert_h_category(msg=msg)
+            self._dds_repository.insert_h_restaurant(msg=msg)
+            self._dds_repository.insert_h_order(msg=msg)
+
+            self._dds_repository.insert_l_order_product(msg=msg)
+            self._dds_repository.insert_l_product_restaurant(msg=msg)
+            self._dds_repository.insert_l_product_category(msg=msg)
+            self._dds_repository.insert_l_order_user(msg=msg)
+
+            self._dds_repository.insert_s_user_names(msg=msg)
+            self._dds_repository.insert_s_product_names(msg=msg)
+            self._dds_repository.insert_s_restaurant_names(msg=msg)
+            self._dds_repository.insert_s_order_cost(msg=msg)
+            self._dds_repository.insert_s_order_status(msg=msg)
+            self._dds_repository.insert_s_order_product_quantity(msg=msg)
+
+            # PIT-таблицы и bridge обновляются вместе с сателлитами: в них ключи только что вставленных версий.
+            self._dds_repository.insert_pit_order(msg=msg)
+            self._dds_repository.insert_pit_user(msg=msg)
+            self._dds_repository.insert_pit_product(msg=msg)
+            self._dds_repository.insert_pit_restaurant(msg=msg)
+            self._dds_repository.insert_bridge_order_product_category(msg=msg)
+
+        self._logger.debug('Все данные загружены в таблицы', object_id=msg['object_id'])
+        # ----------------------------------------------------------------------------
+
+        # Готовим сообщения для отправки в кафку
+        result = {
+            'object_id': msg['object_id'],
+            'object_type': msg['object_type'],
+            'status': msg['payload']['status'],
+            'date': msg['payload']['date'],
+            'user': msg['payload']['user'],
+            'products': msg['payload']['products'],
+
+        }
+        # Отмечаем время передачи заказа следующему слою и пробрасываем метки дальше в заголовках.
+        trace.record('dds')
+        self._producer.produce(result, headers=trace.to_headers())
+        self._logger.payload('DDS Сообщение отправлено продюсеру', result, object_id=msg['object_id'])
@@ -0,0 +1,379 @@
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional
+
+DEFAULT_LOAD_SRC = 'stg-service-orders'
+
+
+def md5(value: str) -> str:
+    return hashlib.md5(value.encode('utf-8')).hexdigest()
+
+
+# Функции ниже преобразуют сообщение из STG-топика в строки конкретной таблицы Data Vault.
+# Их используют и DdsRepository (построчная вставка), и загрузчик истории (массовая вставка).
+
+def h_user_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    user_id = str(msg['payload']['user']['id'])
+    return [{
+        'h_user_pk': md5(user_id),
+        'user_id': msg['payload']['user']['id'],
+        'load_dt': datetime.now(),
+        'load_src': load_src
+    }]
+
+
+def h_product_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    rows = []
+    for item in msg['payload']['products']:
+        product_id = str(item['id'])
+        rows.append({
+            'h_product_pk': md5(product_id),
+            'product_id': product_id,
+            'load_dt': datetime.now(),
+            'load_src': load_src
+        })
+    return rows
+
+
+def h_category_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    rows = []
+    for item in msg['payload']['products']:
+        category_name = str(item['category'])
+        rows.append({
+            'h_category_pk': md5(category_name),
+            'category_name': category_name,
+            'load_dt': datetime.now(),
+            'load_src': load_src
+        })
+    return rows
+
+
+def h_restaurant_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    restaurant_id = str(msg['payload']['restaurant']['id'])
+    return [{
+        'h_restaurant_pk': md5(restaurant_id),
+        'restaurant_id': restaurant_id,
+        'load_dt': datetime.now(),
+        'load_src': load_src
+    }]
+
+
+def h_order_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    order_id = int(msg['payload']['id'])
+    order_dt = datetime.strptime(msg['payload']['date'], '%Y-%m-%d %H:%M:%S')
+    return [{
+        'h_order_pk': md5(str(order_id)),
+        'order_id': order_id,
+        'order_dt': order_dt,
+        'load_dt': datetime.now(),
+        'load_src': load_src
+    }]
+
+
+def l_order_product_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    order_id = int(msg['payload']['id'])
+    h_order_pk = md5(str(order_id))
+
+    rows = []
+    for item in msg['payload']['products']:
+        product_id = str(item['id'])
+        h_product_pk = md5(product_id)
+        composite_key = h_order_pk + h_product_pk
+        rows.append({
+            'hk_order_product_pk': md5(composite_key),
+            'h_product_pk': h_product_pk,
+            'h_order_pk': h_order_pk,
+            'load_dt': datetime.now(),
+            'load_src': load_src
+        })
+    return rows
+
+
+def l_product_restaurant_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    restaurant_id = str(msg['payload']['restaurant']['id'])
+
+    rows = []
+    for item in msg['payload']['products']:
+        product_id = str(item['id'])
+
+        h_product_pk = md5(product_id)
+        h_restaurant_pk = md5(restaurant_id)
+        composite_key = h_product_pk + h_restaurant_pk
+
+        rows.append({
+            'hk_product_restaurant_pk': md5(composite_key),
+            'h_product_pk': h_product_pk,
+            'h_restaurant_pk': h_restaurant_pk,
+            'load_dt': datetime.now(),
+            'load_src': load_src
+        })
+    return rows
+
+
+def l_product_category_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    rows = []
+    for item in msg['payload']['products']:
+        product_id = str(item['id'])
+        category_name = str(item['category'])
+
+        h_product_pk = md5(product_id)
+        h_category_pk = md5(category_name)
+        composite_key = h_product_pk + h_category_pk
+
+        rows.append({
+            'hk_product_category_pk': md5(composite_key),
+            'h_product_pk': h_product_pk,
+            'h_category_pk': h_category_pk,
+            'load_dt': datetime.now(),
+            'load_src': load_src
+        })
+    return rows
+
+
+def l_order_user_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    user_id = str(msg['payload']['user']['id'])
+    order_id = int(msg['payload']['id'])
+
+    h_user_pk = md5(user_id)
+    h_order_pk = md5(str(order_id))
+    composite_key = h_user_pk + h_order_pk
+
+    return [{
+        'hk_order_user_pk': md5(composite_key),
+        'h_user_pk': h_user_pk,
+        'h_order_pk': h_order_pk,
+        'load_dt': datetime.now(),
+        'load_src': load_src
+    }]
+
+
+def s_user_names_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    user_id = str(msg['payload']['user']['id'])
+    username = str(msg['payload']['user']['name'])
+    userlogin = str(msg['payload']['user']['login'])
+    h_user_pk = md5(user_id)
+
+    composite_key = h_user_pk + username + userlogin
+    return [{
+        'hk_user_names_hashdiff': md5(composite_key),
+        'h_user_pk': h_user_pk,
+        'username': username,
+        'userlogin': userlogin,
+        'load_dt': datetime.now(),
+        'load_src': load_src
+    }]
+
+
+def s_product_names_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    rows = []
+    for item in msg['payload']['products']:
+        product_id = str(item['id'])
+        product_name = str(item['name'])
+        h_product_pk = md5(product_id)
+
+        composite_key = h_product_pk + product_name
+
+        rows.append({
+            'hk_product_names_hashdiff': md5(composite_key),
+            'h_product_pk': h_product_pk,
+            'name': product_name,
+            'load_dt': datetime.now(),
+            'load_src': load_src
+        })
+    return rows
+
+
+def s_restaurant_names_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    restaurant_id = str(msg['payload']['restaurant']['id'])
+    restaurant_name = str(msg['payload']['restaurant']['name'])
+    h_restaurant_pk = md5(restaurant_id)
+
+    composite_key = h_restaurant_pk + restaurant_name
+
+    return [{
+        'hk_restaurant_names_hashdiff': md5(composite_key),
+        'h_restaurant_pk': h_restaurant_pk,
+        'name': restaurant_name,
+        'load_dt': datetime.now(),
+        'load_src': load_src
+    }]
+
+
+def s_order_cost_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    order_id = int(msg['payload']['id'])
+    cost = Decimal(msg['payload']['cost'])
+    payment = Decimal(msg['payload']['payment'])
+
+    h_order_pk = md5(str(order_id))
+
+    composite_key = f'{h_order_pk}|{cost}|{payment}'
+
+    return [{
+        'hk_order_cost_hashdiff': md5(composite_key),
+        'h_order_pk': h_order_pk,
+        'cost': cost,
+        'payment': payment,
+        'load_dt': datetime.now(),
+        'load_src': load_src
+    }]
+
+
+def s_order_status_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    order_id = int(msg['payload']['id'])
+    h_order_pk = md5(str(order_id))
+    status = str(msg['payload']['status'])
+
+    composite_key = h_order_pk + status
+    return [{
+        'hk_order_status_hashdiff': md5(composite_key),
+        'h_order_pk': h_order_pk,
+        'status': status,
+        'load_dt': datetime.now(),
+        'load_src': load_src
+    }]
+
+
+def s_order_product_quantity_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    order_id = int(msg['payload']['id'])
+    h_order_pk = md5(str(order_id))
+
+    rows = []
+    for item in msg['payload']['products']:
+        h_product_pk = md5(str(item['id']))
+        hk_order_product_pk = md5(h_order_pk + h_product_pk)
+        quantity = int(item['quantity'])
+
+        composite_key = f'{hk_order_product_pk}|{quantity}'
+
+        rows.append({
+            'hk_order_product_quantity_hashdiff': md5(composite_key),
+            'hk_order_product_pk': hk_order_product_pk,
+            'quantity': quantity,
+            'load_dt': datetime.now(),
+            'load_src': load_src
+        })
+    return rows
+
+
+# PIT-таблицы: для каждого хаба и дня версии (snapshot_dt) - ключи последних версий его сателлитов.
+# Ключи берутся из тех же функций, что строят строки сателлитов, поэтому всегда совпадают с ними.
+# День и время версии (update_ts) берутся из события, а не из времени загрузки: бэкфилл и переигранные события
+# попадают в свой день, а строка за день перезаписывается только более новой версией (TableMapping.version_field).
+
+def version_dt(msg: dict) -> datetime:
+    """
+    Время версии заказа в источнике: update_ts, у сообщений без него (схема stg-orders до id 3) - дата заказа.
+    """
+    payload = msg['payload']
+    return datetime.strptime(payload.get('update_ts') or payload['date'], '%Y-%m-%d %H:%M:%S')
+
+
+def pit_order_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    update_ts = version_dt(msg)
+    cost = s_order_cost_rows(msg, load_src)[0]
+    status = s_order_status_rows(msg, load_src)[0]
+    return [{
+        'h_order_pk': cost['h_order_pk'],
+        'snapshot_dt': update_ts.date(),
+        'hk_order_cost_hashdiff': cost['hk_order_cost_hashdiff'],
+        'hk_order_status_hashdiff': status['hk_order_status_hashdiff'],
+        'update_ts': update_ts,
+        'load_dt': datetime.now(),
+        'load_src': load_src
+    }]
+
+
+def pit_user_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    update_ts = version_dt(msg)
+    return [{
+        'h_user_pk': row['h_user_pk'],
+        'snapshot_dt': update_ts.date(),
+        'hk_user_names_hashdiff': row['hk_user_names_hashdiff'],
+        'update_ts': update_ts,
+        'load_dt': datetime.now(),
+        'load_src': load_src
+    } for row in s_user_names_rows(msg, load_src)]
+
+
+def pit_product_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    update_ts = version_dt(msg)
+    return [{
+        'h_product_pk': row['h_product_pk'],
+        'snapshot_dt': update_ts.date(),
+        'hk_product_names_hashdiff': row['hk_product_names_hashdiff'],
+        'update_ts': update_ts,
+        'load_dt': datetime.now(),
+        'load_src': load_src
+    } for row in s_product_names_rows(msg, load_src)]
+
+
+def pit_restaurant_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    update_ts = version_dt(msg)
+    return [{
+        'h_restaurant_pk': row['h_restaurant_pk'],
+        'snapshot_dt': update_ts.date(),
+        'hk_restaurant_names_hashdiff': row['hk_restaurant_names_hashdiff'],
+        'update_ts': update_ts,
+        'load_dt': datetime.now(),
+        'load_src': load_src
+    } for row in s_restaurant_names_rows(msg, load_src)]
+
+
+def bridge_order_product_category_rows(msg: dict, load_src: str = DEFAULT_LOAD_SRC) -> List[Dict]:
+    # Одна строка на позицию заказа: заказ, товар, категория товара на момент заказа и ключ количества.
+    rows = []
+    order_products = l_order_product_rows(msg, load_src)
+    product_categories = l_product_category_rows(msg, load_src)
+    quantities = s_order_product_quantity_rows(msg, load_src)
+    for order_product, product_category, quantity in zip(order_products, product_categories, quantities):
+        rows.append({
+            'hk_order_product_pk': order_product['hk_order_product_pk'],
+            'h_order_pk': order_product['h_order_pk'],
+            'h_product_pk': order_product['h_product_pk'],
+            'h_category_pk': product_category['h_category_pk'],
+            'hk_product_category_pk': product_category['hk_product_category_pk'],
+            'hk_order_product_quantity_hashdiff': quantity['hk_order_product_quantity_hashdiff'],
+            'load_dt': datetime.now(),
+            'load_src': load_src
+        })
+    return rows
+
+
+@dataclass(frozen=True)
+class TableMapping:
+    """
+    Описание таблицы Data Vault: имя, ключ для ON CONFLICT и функция построения строк из сообщения.
+    version_field - колонка версии: существующая строка обновляется, только если версия входящей не старше.
+    """
+    table_name: str
+    conflict_fields: List[str]
+    build_rows: Callable[..., List[Dict]]
+    version_field: Optional[str] = None
+
+
+# Порядок важен: хабы, затем линки и сателлиты, которые ссылаются на хабы внешними ключами,
+# и в конце PIT-таблицы и bridge, которые ссылаются на все перечисленное.
+DDS_TABLES = [
+    TableMapping('h_user', ['h_user_pk'], h_user_rows),
+    TableMapping('h_product', ['h_product_pk'], h_product_rows),
+    TableMapping('h_category', ['h_category_pk'], h_category_rows),
+    TableMapping('h_restaurant', ['h_restaurant_pk'], h_restaurant_rows),
+    TableMapping('h_order', ['h_order_pk'], h_order_rows),
+    TableMapping('l_order_product', ['hk_order_product_pk'], l_order_product_rows),
+    TableMapping('l_product_restaurant', ['hk_product_restaurant_pk'], l_product_restaurant_rows),
+    TableMapping('l_product_category', ['hk_product_category_pk'], l_product_category_rows),
+    TableMapping('l_order_user', ['hk_order_user_pk'], l_order_user_rows),
+    TableMapping('s_user_names', ['hk_user_names_hashdiff'], s_user_names_rows),
+    TableMapping('s_product_names', ['hk_product_names_hashdiff'], s_product_names_rows),
+    TableMapping('s_restaurant_names', ['hk_restaurant_names_hashdiff'], s_restaurant_names_rows),
+    TableMapping('s_order_cost', ['hk_order_cost_hashdiff'], s_order_cost_rows),
+    TableMapping('s_order_status', ['hk_order_status_hashdiff'], s_order_status_rows),
+    TableMapping('s_order_product_quantity', ['hk_order_product_quantity_hashdiff'], s_order_product_quantity_rows),
+    TableMapping('pit_order', ['h_order_pk', 'snapshot_dt'], pit_order_rows, 'update_ts'),
+    TableMapping('pit_user', ['h_user_pk', 'snapshot_dt'], pit_user_rows, 'update_ts'),
+    TableMapping('pit_product', ['h_product_pk', 'snapshot_dt'], pit_product_rows, 'update_ts'),
+    TableMapping('pit_restaurant', ['h_restaurant_pk', 'snapshot_dt'], pit_restaurant_rows, 'update_ts'),
+    TableMapping('bridge_order_product_category', ['hk_order_product_pk'], bridge_order_product_category_rows),
+]
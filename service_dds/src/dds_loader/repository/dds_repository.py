@@ -1,22 +1,52 @@
-from datetime import datetime
-from typing import Dict
-from decimal import Decimal
+from contextlib import contextmanager
+from typing import Dict, Generator
 
-from lib.pg import PgConnect
-import hashlib
+from lib.metrics import DB_UPSERT_LATENCY
+from lib.pg import PgConnect, PgPipeline
+from dds_loader.repository import dds_mapping
+from dds_loader.repository.known_keys import CACHED_TABLES, KnownKeys
 
 class DdsRepository:
-    def __init__(self, db: PgConnect) -> None:
+    """
+    Args:
+        db: Подключение к хранилищу
+        known_keys: Ключи справочных строк, которые уже есть в базе: их повторная вставка пропускается
+        use_pipeline: Выполнять вставки внутри pipeline() одной транзакцией в режиме pipeline libpq
+    """
+
+    def __init__(self, db: PgConnect, known_keys: KnownKeys = None, use_pipeline: bool = True) -> None:
         self._db = db
+        self._known_keys = known_keys
+        self._pipeline = PgPipeline(db, 'dds') if use_pipeline else None
 
-    def _insert(self, *, table_name: str, data: Dict, conflict_fields: list) -> None:
+    @contextmanager
+    def pipeline(self) -> Generator[None, None, None]:
+        """
+        Вставки одного сообщения внутри блока уходят в базу одной транзакцией без ожидания ответа на каждую
+        (PgPipeline). Ошибка любой вставки откатывает все вставки сообщения и пробрасывается из блока.
+        Без use_pipeline каждая вставка, как и вне блока, выполняется отдельной транзакцией.
+        """
+        if self._pipeline is None:
+            yield
+            return
+        with self._pipeline.transaction():
+            yield
+
+    def _insert(self, *, table_name: str, data: Dict, conflict_fields: list, version_field: str = None) -> None:
         """
         Универсальный метод для вставки данных в конкретную таблицу.
         Args:
             table_name: Название таблицы
             data: Данные dict, которые нужно вставить
             conflict_fields: Список атрибутов, которые участвуют в конфликте при вставке в sql
+            version_field: Колонка версии: при конфликте строка обновляется, только если версия входящей не старше
         """
+        cache_key = None
+        if self._known_keys is not None and table_name in CACHED_TABLES:
+            cache_key = str(data[CACHED_TABLES[table_name]])
+            if self._known_keys.contains(table_name, cache_key):
+                return
+
         keys = ', '.join(data.keys())
         values = ', '.join([f'%({key})s' for key in data.keys()])
         conflict_values = ', '.join(conflict_fields)
@@ -24,6 +54,8 @@ class DdsRepository:
         # Если при выполнении запроса случится конфликт, нужна будет специальная строчка
         # Формируем её
         update_clause = ', '.join([f'{key} = EXCLUDED.{key}' for key in data.keys() if key not in conflict_fields])
+        if version_field:
+            update_clause += f' WHERE EXCLUDED.{version_field} >= dds.{table_name}.{version_field}'
         sql = f"""
             INSERT INTO dds.{table_name} ({keys})
             VALUES ({values})
@@ -31,328 +63,262 @@ class DdsRepository:
             SET {update_clause};
         """
 
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, data)
+        if self._pipeline is not None and self._pipeline.connection() is not None:
+            # Запрос только ставится в очередь, ответ базы собирается при выходе из pipeline().
+            self._pipeline.execute(sql, data, table=table_name)
+            if cache_key is not None:
+                self._pipeline.after_commit(lambda: self._known_keys.add(table_name, cache_key))
+            return
+
+        with DB_UPSERT_LATENCY.labels(table_name).time():
+            with self._db.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(sql, data)
 
-    def insert_h_user(self, *, msg: dict, load_src: str = 'stg-service-orders'):
+        # Ключ запоминается только после коммита вставки.
+        if cache_key is not None:
+            self._known_keys.add(table_name, cache_key)
+
+    def insert_h_user(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
         """
         Метод готовит данные для вставки в таблицу h_user и передает преобразованные данные
         в универсальный метод _insert.
         """
-        user_id = str(msg['payload']['user']['id'])
-
-        data = {
-            'h_user_pk': hashlib.md5(user_id.encode('utf-8')).hexdigest(),
-            'user_id': msg['payload']['user']['id'],
-            'load_dt': datetime.now(),
-            'load_src': load_src
-        }
-        self._insert(
-            table_name='h_user',
-            data=data,
-            conflict_fields=['h_user_pk']
+        for data in dds_mapping.h_user_rows(msg, load_src):
+            self._insert(
+                table_name='h_user',
+                data=data,
+                conflict_fields=['h_user_pk']
             )
 
-    def insert_h_product(self, *, msg: dict, load_src: str = 'stg-service-orders'):
+    def insert_h_product(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
         """
         Метод готовит данные для вставки в таблицу h_product и передает преобразованные данные
         в универсальный метод _insert.
         """
-        for item in msg['payload']['products']:
-            product_id = str(item['id'])
-            data = {
-                'h_product_pk': hashlib.md5(product_id.encode('utf-8')).hexdigest(),
-                'product_id': product_id,
-                'load_dt': datetime.now(),
-                'load_src': load_src
-            }
+        for data in dds_mapping.h_product_rows(msg, load_src):
             self._insert(
                 table_name='h_product',
                 data=data,
                 conflict_fields=['h_product_pk']
             )
 
-    def insert_h_category(self, *, msg: dict, load_src: str = 'stg-service-orders'):
+    def insert_h_category(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
         """
         Метод готовит данные для вставки в таблицу h_category и передает преобразованные данные
         в универсальный метод _insert.
         """
-        for item in msg['payload']['products']:
-            category_name = str(item['category'])
-            data = {
-                'h_category_pk': hashlib.md5(category_name.encode('utf-8')).hexdigest(),
-                'category_name': category_name,
-                'load_dt': datetime.now(),
-                'load_src': load_src
-            }
+        for data in dds_mapping.h_category_rows(msg, load_src):
             self._insert(
                 table_name='h_category',
                 data=data,
                 conflict_fields=['h_category_pk']
             )
 
-    def insert_h_restaurant(self, *, msg: dict, load_src: str = 'stg-service-orders'):
+    def insert_h_restaurant(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
         """
         Метод готовит данные для вставки в таблицу h_restaurant и передает преобразованные данные
         в универсальный метод _insert.
         """
-        restaurant_id = str(msg['payload']['restaurant']['id'])
-        data = {
-            'h_restaurant_pk': hashlib.md5(restaurant_id.encode('utf-8')).hexdigest(),
-            'restaurant_id': restaurant_id,
-            'load_dt': datetime.now(),
-            'load_src': load_src
-        }
-        self._insert(
+        for data in dds_mapping.h_restaurant_rows(msg, load_src):
+            self._insert(
                 table_name='h_restaurant',
                 data=data,
                 conflict_fields=['h_restaurant_pk']
             )
 
-    def insert_h_order(self, *, msg: dict, load_src: str = 'stg-service-orders'):
+    def insert_h_order(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
         """
         Метод готовит данные для вставки в таблицу h_order и передает преобразованные данные
         в универсальный метод _insert.
         """
-        order_id = int(msg['payload']['id'])
-        order_dt = datetime.strptime(msg['payload']['date'], '%Y-%m-%d %H:%M:%S')
-        data = {
-            'h_order_pk': hashlib.md5(str(order_id).encode('utf-8')).hexdigest(),
-            'order_id': order_id,
-            'order_dt': order_dt,
-            'load_dt': datetime.now(),
-            'load_src': load_src
-        }
-        self._insert(
+        for data in dds_mapping.h_order_rows(msg, load_src):
+            self._insert(
                 table_name='h_order',
                 data=data,
                 conflict_fields=['h_order_pk']
             )
 
-    def insert_l_order_product(self, *, msg: dict, load_src: str = 'stg-service-orders'):
+    def insert_l_order_product(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
         """
         Метод готовит данные для вставки в таблицу l_order_product и передает преобразованные данные
         в универсальный метод _insert.
         """
-        order_id = int(msg['payload']['id'])
-        h_order_pk = hashlib.md5(str(order_id).encode('utf-8')).hexdigest()
-
-        for item in msg['payload']['products']:
-            product_id = str(item['id'])
-            h_product_pk = hashlib.md5(product_id.encode('utf-8')).hexdigest()
-            composite_key = h_order_pk + h_product_pk
-            data = {
-                'hk_order_product_pk': hashlib.md5(composite_key.encode('utf-8')).hexdigest(),
-                'h_product_pk': h_product_pk,
-                'h_order_pk': h_order_pk,
-                'load_dt': datetime.now(),
-                'load_src': load_src
-            }
+        for data in dds_mapping.l_order_product_rows(msg, load_src):
             self._insert(
                 table_name='l_order_product',
                 data=data,
                 conflict_fields=['hk_order_product_pk']
             )
 
-    def insert_l_product_restaurant(self, *, msg: dict, load_src: str = 'stg-service-orders'):
+    def insert_l_product_restaurant(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
         """
         Метод готовит данные для вставки в таблицу l_product_restaurant и передает преобразованные данные
         в универсальный метод _insert.
         """
-        restaurant_id = str(msg['payload']['restaurant']['id'])
-
-        for item in msg['payload']['products']:
-            product_id = str(item['id'])
-
-            h_product_pk = hashlib.md5(product_id.encode('utf-8')).hexdigest()
-            h_restaurant_pk = hashlib.md5(restaurant_id.encode('utf-8')).hexdigest()
-            composite_key = h_product_pk + h_restaurant_pk
-
-            data = {
-                'hk_product_restaurant_pk': hashlib.md5(composite_key.encode('utf-8')).hexdigest(),
-                'h_product_pk': h_product_pk,
-                'h_restaurant_pk': h_restaurant_pk,
-                'load_dt': datetime.now(),
-                'load_src': load_src
-            }
+        for data in dds_mapping.l_product_restaurant_rows(msg, load_src):
             self._insert(
                 table_name='l_product_restaurant',
                 data=data,
                 conflict_fields=['hk_product_restaurant_pk']
             )
 
-    def insert_l_product_category(self, *, msg: dict, load_src: str = 'stg-service-orders'):
+    def insert_l_product_category(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
         """
         Метод готовит данные для вставки в таблицу l_product_category и передает преобразованные данные
         в универсальный метод _insert.
         """
-        for item in msg['payload']['products']:
-            product_id = str(item['id'])
-            category_name = str(item['category'])
-
-            h_product_pk = hashlib.md5(product_id.encode('utf-8')).hexdigest()
-            h_category_pk = hashlib.md5(category_name.encode('utf-8')).hexdigest()
-            composite_key = h_product_pk + h_category_pk
-
-            data = {
-                'hk_product_category_pk': hashlib.md5(composite_key.encode('utf-8')).hexdigest(),
-                'h_product_pk': h_product_pk,
-                'h_category_pk': h_category_pk,
-                'load_dt': datetime.now(),
-                'load_src': load_src
-            }
+        for data in dds_mapping.l_product_category_rows(msg, load_src):
             self._insert(
                 table_name='l_product_category',
                 data=data,
                 conflict_fields=['hk_product_category_pk']
             )
 
-    def insert_l_order_user(self, *, msg: dict, load_src: str = 'stg-service-orders'):
+    def insert_l_order_user(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
         """
         Метод готовит данные для вставки в таблицу l_order_user и передает преобразованные данные
         в универсальный метод _insert.
         """
-        user_id = str(msg['payload']['user']['id'])
-        order_id = int(msg['payload']['id'])
-
-        h_user_pk = hashlib.md5(user_id.encode('utf-8')).hexdigest()
-        h_order_pk = hashlib.md5(str(order_id).encode('utf-8')).hexdigest()
-        composite_key = h_user_pk + h_order_pk
-
-        data = {
-                'hk_order_user_pk': hashlib.md5(composite_key.encode('utf-8')).hexdigest(),
-                'h_user_pk': h_user_pk,
-                'h_order_pk': h_order_pk,
-                'load_dt': datetime.now(),
-                'load_src': load_src
-            }
-        self._insert(
+        for data in dds_mapping.l_order_user_rows(msg, load_src):
+            self._insert(
                 table_name='l_order_user',
                 data=data,
                 conflict_fields=['hk_order_user_pk']
             )
 
-    def insert_s_user_names(self, *, msg: dict, load_src: str = 'stg-service-orders'):
+    def insert_s_user_names(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
         """
         Метод готовит данные для вставки в таблицу s_user_names и передает преобразованные данные
         в универсальный метод _insert.
         """
-        user_id = str(msg['payload']['user']['id'])
-        username = str(msg['payload']['user']['name'])
-        userlogin = str(msg['payload']['user']['login'])
-        h_user_pk = hashlib.md5(user_id.encode('utf-8')).hexdigest()
-
-        composite_key = h_user_pk + username + userlogin
-        data = {
-                'hk_user_names_hashdiff': hashlib.md5(composite_key.encode('utf-8')).hexdigest(),
-                'h_user_pk': h_user_pk,
-                'username': username,
-                'userlogin': userlogin,
-                'load_dt': datetime.now(),
-                'load_src': load_src
-            }
-        self._insert(
+        for data in dds_mapping.s_user_names_rows(msg, load_src):
+            self._insert(
                 table_name='s_user_names',
                 data=data,
                 conflict_fields=['hk_user_names_hashdiff']
             )
 
-    def insert_s_product_names(self, *, msg: dict, load_src: str = 'stg-service-orders'):
+    def insert_s_product_names(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
         """
         Метод готовит данные для вставки в таблицу s_product_names и передает преобразованные данные
         в универсальный метод _insert.
         """
-        for item in msg['payload']['products']:
-            product_id = str(item['id'])
-            product_name = str(item['name'])
-            h_product_pk = hashlib.md5(product_id.encode('utf-8')).hexdigest()
-
-            composite_key = h_product_pk + product_name
-
-            data = {
-                'hk_product_names_hashdiff': hashlib.md5(composite_key.encode('utf-8')).hexdigest(),
-                'h_product_pk': h_product_pk,
-                'name': product_name,
-                'load_dt': datetime.now(),
-                'load_src': load_src
-            }
+        for data in dds_mapping.s_product_names_rows(msg, load_src):
             self._insert(
                 table_name='s_product_names',
                 data=data,
                 conflict_fields=['hk_product_names_hashdiff']
             )
 
-    def insert_s_restaurant_names(self, *, msg: dict, load_src: str = 'stg-service-orders'):
+    def insert_s_restaurant_names(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
         """
         Метод готовит данные для вставки в таблицу s_restaurant_names и передает преобразованные данные
         в универсальный метод _insert.
         """
-        restaurant_id = str(msg['payload']['restaurant']['id'])
-        restaurant_name = str(msg['payload']['restaurant']['name'])
-        h_restaurant_pk = hashlib.md5(restaurant_id.encode('utf-8')).hexdigest()
-
-        composite_key = h_restaurant_pk + restaurant_name
-
-        data = {
-                'hk_restaurant_names_hashdiff': hashlib.md5(composite_key.encode('utf-8')).hexdigest(),
-                'h_restaurant_pk': h_restaurant_pk,
-                'name': restaurant_name,
-                'load_dt': datetime.now(),
-                'load_src': load_src
-            }
-        self._insert(
+        for data in dds_mapping.s_restaurant_names_rows(msg, load_src):
+            self._insert(
                 table_name='s_restaurant_names',
                 data=data,
                 conflict_fields=['hk_restaurant_names_hashdiff']
             )
 
-    def insert_s_order_cost(self, *, msg: dict, load_src: str = 'stg-service-orders'):
+    def insert_s_order_cost(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
         """
         Метод готовит данные для вставки в таблицу s_order_cost и передает преобразованные данные
         в универсальный метод _insert.
         """
-        order_id = int(msg['payload']['id'])
-        cost = Decimal(msg['payload']['cost'])
-        payment = Decimal(msg['payload']['payment'])
-
-        h_order_pk = hashlib.md5(str(order_id).encode('utf-8')).hexdigest()
-
-        composite_key = f'{h_order_pk}|{cost}|{payment}'
-
-        data = {
-                'hk_order_cost_hashdiff': hashlib.md5(composite_key.encode('utf-8')).hexdigest(),
-                'h_order_pk': h_order_pk,
-                'cost': cost,
-                'payment': payment,
-                'load_dt': datetime.now(),
-                'load_src': load_src
-            }
-        self._insert(
+        for data in dds_mapping.s_order_cost_rows(msg, load_src):
+            self._insert(
                 table_name='s_order_cost',
                 data=data,
                 conflict_fields=['hk_order_cost_hashdiff']
             )
 
-    def insert_s_order_status(self, *, msg: dict, load_src: str = 'stg-service-orders'):
+    def insert_s_order_status(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
         """
         Метод готовит данные для вставки в таблицу s_order_status и передает преобразованные данные
         в универсальный метод _insert.
         """
-        order_id = int(msg['payload']['id'])
-        h_order_pk = hashlib.md5(str(order_id).encode('utf-8')).hexdigest()
-        status = str(msg['payload']['status'])
-
-        composite_key = h_order_pk + status
-        data = {
-                'hk_order_status_hashdiff': hashlib.md5(composite_key.encode('utf-8')).hexdigest(),
-                'h_order_pk': h_order_pk,
-                'status': status,
-                'load_dt': datetime.now(),
-                'load_src': load_src
-            }
-        self._insert(
+        for data in dds_mapping.s_order_status_rows(msg, load_src):
+            self._insert(
                 table_name='s_order_status',
                 data=data,
                 conflict_fields=['hk_order_status_hashdiff']
             )
+
+    def insert_s_order_product_quantity(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
+        """
+        Метод готовит данные для вставки в таблицу s_order_product_quantity и передает преобразованные данные
+        в универсальный метод _insert.
+        """
+        for data in dds_mapping.s_order_product_quantity_rows(msg, load_src):
+            self._insert(
+                table_name='s_order_product_quantity',
+                data=data,
+                conflict_fields=['hk_order_product_quantity_hashdiff']
+            )
+
+    def insert_pit_order(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
+        """
+        Метод готовит данные для вставки в таблицу pit_order и передает преобразованные данные
+        в универсальный метод _insert.
+        """
+        for data in dds_mapping.pit_order_rows(msg, load_src):
+            self._insert(
+                table_name='pit_order',
+                data=data,
+                conflict_fields=['h_order_pk', 'snapshot_dt'],
+                version_field='update_ts'
+            )
+
+    def insert_pit_user(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
+        """
+        Метод готовит данные для вставки в таблицу pit_user и передает преобразованные данные
+        в универсальный метод _insert.
+        """
+        for data in dds_mapping.pit_user_rows(msg, load_src):
+            self._insert(
+                table_name='pit_user',
+                data=data,
+                conflict_fields=['h_user_pk', 'snapshot_dt'],
+                version_field='update_ts'
+            )
+
+    def insert_pit_product(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
+        """
+        Метод готовит данные для вставки в таблицу pit_product и передает преобразованные данные
+        в универсальный метод _insert.
+        """
+        for data in dds_mapping.pit_product_rows(msg, load_src):
+            self._insert(
+                table_name='pit_product',
+                data=data,
+                conflict_fields=['h_product_pk', 'snapshot_dt'],
+                version_field='update_ts'
+            )
+
+    def insert_pit_restaurant(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
+        """
+        Метод готовит данные для вставки в таблицу pit_restaurant и передает преобразованные данные
+        в универсальный метод _insert.
+        """
+        for data in dds_mapping.pit_restaurant_rows(msg, load_src):
+            self._insert(
+                table_name='pit_restaurant',
+                data=data,
+                conflict_fields=['h_restaurant_pk', 'snapshot_dt'],
+                version_field='update_ts'
+            )
+
+    def insert_bridge_order_product_category(self, *, msg: dict, load_src: str = dds_mapping.DEFAULT_LOAD_SRC):
+        """
+        Метод готовит данные для вставки в таблицу bridge_order_product_category и передает преобразованные данные
+        в универсальный метод _insert.
+        """
+        for data in dds_mapping.bridge_order_product_category_rows(msg, load_src):
+            self._insert(
+                table_name='bridge_order_product_category',
+                data=data,
+                conflict_fields=['hk_order_product_pk']
+            )
@@ -0,0 +1,124 @@
+import threading
+from collections import defaultdict
+from logging import Logger
+from typing import Optional, Set
+
+from lib.metrics import KNOWN_KEYS_LOOKUPS
+from lib.pg import PgConnect
+from lib.snapshot import SnapshotReader, write_snapshot
+
+# Таблицы, строки которых повторяются из заказа в заказ: хабы и линки справочников. Таблица -> колонка ключа.
+# Сателлиты не кэшируются: повторная вставка обновляет их load_dt, и после смены имени A -> B -> A последней
+# версией по load_dt снова должна стать A.
+CACHED_TABLES = {
+    'h_user': 'h_user_pk',
+    'h_product': 'h_product_pk',
+    'h_category': 'h_category_pk',
+    'h_restaurant': 'h_restaurant_pk',
+    'l_product_restaurant': 'hk_product_restaurant_pk',
+    'l_product_category': 'hk_product_category_pk',
+}
+
+SNAPSHOT_KIND = 'dds-known-keys'
+# Версия 1 содержала ключи сателлитов.
+SNAPSHOT_SCHEMA_VERSION = 2
+
+
+class KnownKeys:
+    """
+    Ключи строк справочных таблиц DDS, которые уже есть в базе. DdsRepository не отправляет в Postgres
+    вставку строки с известным ключом: пользователь, товар или ресторан из повторного заказа не дает ни одного
+    запроса к их хабам и линкам. load_dt таких строк остается временем первой загрузки. Ключ запоминается
+    после коммита вставки.
+
+    Если задан snapshot_path, ключи сохраняются в файл (save_snapshot) и при старте читаются из него
+    через отображение в память. Перед использованием файл сверяется с базой по sample случайным ключам:
+    если хотя бы одного нет (база пересоздана или восстановлена из бэкапа), файл игнорируется.
+    Args:
+        db: Подключение к хранилищу
+        logger: Логгер
+        snapshot_path: Файл снимка на диске (пустая строка - без файла)
+        snapshot_max_age: Максимальный возраст файла в секундах
+        source: База, для которой записан снимок
+        max_keys: Сколько новых ключей держать в памяти; при превышении новые ключи не запоминаются
+        sample: Сколько ключей файла сверить с базой при загрузке
+    """
+
+    def __init__(self,
+                 db: PgConnect,
+                 logger: Logger,
+                 snapshot_path: str = '',
+                 snapshot_max_age: Optional[float] = None,
+                 source: str = '',
+                 max_keys: int = 1000000,
+                 sample: int = 100) -> None:
+        self._db = db
+        self._logger = logger
+        self._snapshot_path = snapshot_path
+        self._snapshot_max_age = snapshot_max_age
+        self._source = source
+        self._max_keys = max_keys
+        self._sample = sample
+        self._keys: Set[str] = set()
+        self._snapshot: Optional[SnapshotReader] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> int:
+        """
+        Загружает и сверяет с базой файл снимка. Возвращает число ключей в нем.
+        """
+        if not self._snapshot_path:
+            return 0
+        snapshot = SnapshotReader.open(self._snapshot_path, SNAPSHOT_KIND, SNAPSHOT_SCHEMA_VERSION,
+                                       self._source, self._snapshot_max_age, self._logger)
+        if snapshot is None:
+            return 0
+        missing = self._missing_in_db(snapshot.sample(self._sample))
+        if missing:
+            self._logger.warning(f'Снимок {self._snapshot_path} не загружен: ключей нет в базе: {missing}')
+            return 0
+        self._snapshot = snapshot
+        return len(snapshot)
+
+    def contains(self, table: str, key: str) -> bool:
+        full_key = f'{table}:{key}'
+        known = full_key in self._keys or (self._snapshot is not None and full_key in self._snapshot)
+        KNOWN_KEYS_LOOKUPS.labels('hit' if known else 'miss').inc()
+        return known
+
+    def add(self, table: str, key: str) -> None:
+        if len(self._keys) < self._max_keys:
+            self._keys.add(f'{table}:{key}')
+
+    def save_snapshot(self) -> int:
+        """
+        Сохраняет ключи файла снимка и новые ключи в новый файл. Возвращает число ключей.
+        """
+        if not self._snapshot_path:
+            return 0
+        with self._lock:
+            keys = set(self._keys)
+            if self._snapshot is not None:
+                keys.update(key for key, _ in self._snapshot.items())
+            saved = write_snapshot(self._snapshot_path, SNAPSHOT_KIND, SNAPSHOT_SCHEMA_VERSION,
+                                   ((key, b'') for key in keys), self._source)
+        self._logger.info(f'Ключи DDS сохранены в {self._snapshot_path}: {saved}')
+        return saved
+
+    def _missing_in_db(self, keys) -> int:
+        by_table = defaultdict(list)
+        for full_key in keys:
+            table, _, key = full_key.partition(':')
+            if table not in CACHED_TABLES:
+                return len(keys)
+            by_table[table].append(key)
+
+        missing = 0
+        with self._db.connection() as conn:
+            for table, table_keys in by_table.items():
+                found = conn.execute(
+                    f'SELECT COUNT(*) FROM dds.{table} WHERE {CACHED_TABLES[table]} = ANY(%(keys)s::uuid[])',
+                    {'keys': table_keys}
+                ).fetchone()[0]
+                missing += len(table_keys) - found
+        return missing
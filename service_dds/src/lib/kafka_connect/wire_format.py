@@ -0,0 +1,170 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+import msgpack
+
+CONTENT_TYPE_HEADER = 'content-type'
+SCHEMA_ID_HEADER = 'x-schema-id'
+
+CONTENT_TYPE_JSON = 'application/json'
+CONTENT_TYPE_MSGPACK = 'application/msgpack'
+WIRE_FORMATS = {'json': CONTENT_TYPE_JSON, 'msgpack': CONTENT_TYPE_MSGPACK}
+
+# Реестр схем по умолчанию лежит рядом с модулем и копируется в каждый сервис вместе с lib.
+DEFAULT_REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schemas.json')
+
+# Поле схемы: имя, вложенная запись {'name', 'fields'} или список записей {'name', 'items'}.
+Field = Union[str, Dict]
+
+
+class SchemaMismatch(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Schema:
+    id: int
+    subject: str
+    fields: List[Field]
+
+
+def _encode_record(value, fields: List[Field]):
+    # Запись по схеме - массив значений в порядке полей, имена полей в сообщение не попадают.
+    if value is None:
+        return None
+    if not isinstance(value, dict) or len(value) != len(fields):
+        raise SchemaMismatch('record does not match schema')
+    result = []
+    for field in fields:
+        name = field if isinstance(field, str) else field['name']
+        if name not in value:
+            raise SchemaMismatch(f'field {name} is missing')
+        result.append(_encode_value(value[name], field))
+    return result
+
+
+def _encode_value(value, field: Field):
+    if isinstance(field, str):
+        return value
+    if 'items' in field:
+        if value is None:
+            return None
+        if not isinstance(value, list):
+            raise SchemaMismatch(f'field {field["name"]} is not a list')
+        return [_encode_record(item, field['items']) for item in value]
+    return _encode_record(value, field['fields'])
+
+
+def _decode_record(value, fields: List[Field]):
+    if value is None:
+        return None
+    if len(value) != len(fields):
+        raise ValueError('record length does not match schema')
+    result = {}
+    for field, item in zip(fields, value):
+        if isinstance(field, str):
+            result[field] = item
+        elif 'items' in field:
+            result[field['name']] = None if item is None else [_decode_record(i, field['items']) for i in item]
+        else:
+            result[field['name']] = _decode_record(item, field['fields'])
+    return result
+
+
+class SchemaRegistry:
+    """
+    Локальная замена реестра схем: JSON-файл со списком схем {id, subject, fields}.
+    id схемы неизменен и передается в заголовке сообщения. Новая версия схемы добавляется в файл
+    с новым id, старая остается: читатель декодирует сообщение по схеме, с которой оно записано,
+    а писатель использует последнюю схему своего subject.
+    """
+
+    def __init__(self, path: str = DEFAULT_REGISTRY_PATH) -> None:
+        with open(path, encoding='utf-8') as f:
+            schemas = [Schema(s['id'], s['subject'], s['fields']) for s in json.load(f)['schemas']]
+        self._by_id = {s.id: s for s in schemas}
+        if len(self._by_id) != len(schemas):
+            raise ValueError(f'duplicate schema id in {path}')
+        self._latest = {}
+        for schema in sorted(schemas, key=lambda s: s.id):
+            self._latest[schema.subject] = schema
+
+    def get(self, schema_id: int) -> Schema:
+        if schema_id not in self._by_id:
+            raise ValueError(f'unknown schema id: {schema_id}')
+        return self._by_id[schema_id]
+
+    def latest(self, subject: str) -> Optional[Schema]:
+        return self._latest.get(subject)
+
+
+class WireFormat:
+    """
+    Сериализация сообщений Kafka. Формат записывается в заголовок content-type, и консьюмер выбирает
+    декодер по нему, а не по своей настройке: пока сервисы переходят на msgpack, в топике могут лежать
+    оба формата. Сообщение без заголовка читается как JSON.
+
+    msgpack с subject кодирует запись по последней схеме subject массивом значений без имен полей
+    (id схемы - в заголовке x-schema-id). Сообщение, которое не совпадает со схемой, отправляется
+    msgpack-словарем без схемы.
+    Args:
+        content_type: json или msgpack - формат исходящих сообщений
+        registry: Реестр схем (None - реестр по умолчанию загружается при первом обращении)
+        subject: Subject исходящих сообщений в реестре (пустая строка - без схемы)
+    """
+
+    def __init__(self, content_type: str = 'json', registry: Optional[SchemaRegistry] = None,
+                 subject: str = '') -> None:
+        if content_type not in WIRE_FORMATS:
+            raise ValueError(f'unknown wire format: {content_type}')
+        self._content_type = WIRE_FORMATS[content_type]
+        self._registry = registry
+        self._subject = subject
+
+    @property
+    def registry(self) -> SchemaRegistry:
+        if self._registry is None:
+            self._registry = SchemaRegistry()
+        return self._registry
+
+    def encode(self, payload: Dict, headers: Optional[Dict[str, str]] = None) -> Tuple[bytes, Dict[str, str]]:
+        """
+        Возвращает тело сообщения и заголовки с форматом. Заголовки формата из входящего сообщения
+        (например, при отправке в retry) заменяются.
+        """
+        headers = {k: v for k, v in (headers or {}).items() if k not in (CONTENT_TYPE_HEADER, SCHEMA_ID_HEADER)}
+        headers[CONTENT_TYPE_HEADER] = self._content_type
+        if self._content_type == CONTENT_TYPE_JSON:
+            return json.dumps(payload).encode(), headers
+
+        schema = self.registry.latest(self._subject) if self._subject else None
+        if schema:
+            try:
+                body = msgpack.packb(_encode_record(payload, schema.fields), use_bin_type=True)
+                headers[SCHEMA_ID_HEADER] = str(schema.id)
+                return body, headers
+            except SchemaMismatch:
+                pass
+        return msgpack.packb(payload, use_bin_type=True), headers
+
+    def decode(self, raw: bytes, headers: Dict[str, bytes]) -> Dict:
+        content_type = _header(headers, CONTENT_TYPE_HEADER) or CONTENT_TYPE_JSON
+        if content_type == CONTENT_TYPE_JSON:
+            return json.loads(raw.decode())
+        if content_type != CONTENT_TYPE_MSGPACK:
+            raise ValueError(f'unsupported content type: {content_type}')
+
+        value = msgpack.unpackb(raw, raw=False)
+        schema_id = _header(headers, SCHEMA_ID_HEADER)
+        if schema_id:
+            return _decode_record(value, self.registry.get(int(schema_id)).fields)
+        return value
+
+
+def _header(headers: Dict[str, bytes], name: str) -> Optional[str]:
+    value = headers.get(name)
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
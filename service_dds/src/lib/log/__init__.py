@@ -0,0 +1 @@
+from .structured_logger import BatchStats, StructuredLogger  # noqa
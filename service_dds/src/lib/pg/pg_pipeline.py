@@ -0,0 +1,84 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Generator, Optional
+
+from lib.metrics import DB_PIPELINE_LATENCY, DB_PIPELINE_STATEMENTS, DB_PIPELINE_TABLE_LATENCY
+from .pg_connect import PgConnect
+
+
+class PgPipeline:
+    """
+    Транзакция через одно соединение в режиме pipeline libpq. Запросы внутри transaction() уходят в базу
+    друг за другом без ожидания ответа, результаты собираются при выходе из блока (sync), поэтому сетевая
+    задержка до базы оплачивается один раз на блок, а не на каждый запрос. Семантика запросов не меняется.
+
+    Ошибка любого запроса обнаруживается при выходе из блока, откатывает всю транзакцию и пробрасывается
+    вызывающему с исходным типом (классификация временных ошибок в FailureHandler работает как раньше).
+    Поэтому блок должен охватывать одно сообщение: тогда ошибка относится к сообщению, которое ее вызвало.
+    Действия, которые можно выполнить только после записи в базу (кэши в памяти), регистрируются через
+    after_commit и выполняются после коммита.
+
+    Открытый блок у каждого потока свой. Вложенный блок выполняется в транзакции внешнего.
+    Args:
+        db: Подключение к хранилищу
+        name: Имя репозитория для метрик
+    """
+
+    def __init__(self, db: PgConnect, name: str) -> None:
+        self._db = db
+        self._name = name
+        self._local = threading.local()
+
+    def connection(self):
+        """
+        Соединение открытого в этом потоке блока или None, если блок не открыт.
+        """
+        return getattr(self._local, 'conn', None)
+
+    def execute(self, sql: str, params: Optional[Dict] = None, table: Optional[str] = None) -> None:
+        """
+        Ставит запрос в очередь открытого блока. Результат запроса не читается.
+        Время отдельного запроса в pipeline не измерить, поэтому длительность блока попадает
+        в db_pipeline_table_duration_seconds по каждой таблице (table), которую он писал.
+        """
+        self._local.conn.execute(sql, params)
+        self._local.statements += 1
+        if table:
+            self._local.tables.add(table)
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        if self.connection() is None:
+            callback()
+        else:
+            self._local.callbacks.append(callback)
+
+    @contextmanager
+    def transaction(self) -> Generator[None, None, None]:
+        if self.connection() is not None:
+            yield
+            return
+
+        self._local.statements = 0
+        self._local.tables = set()
+        self._local.callbacks = []
+        started = time.perf_counter()
+        try:
+            with self._db.connection() as conn:
+                with conn.pipeline():
+                    self._local.conn = conn
+                    try:
+                        yield
+                    finally:
+                        self._local.conn = None
+            callbacks = self._local.callbacks
+        finally:
+            self._local.callbacks = []
+        if self._local.statements:
+            duration = time.perf_counter() - started
+            DB_PIPELINE_LATENCY.labels(self._name).observe(duration)
+            DB_PIPELINE_STATEMENTS.labels(self._name).observe(self._local.statements)
+            for table in self._local.tables:
+                DB_PIPELINE_TABLE_LATENCY.labels(self._name, table).observe(duration)
+        for callback in callbacks:
+            callback()
@@ -0,0 +1,2 @@
+from lib.redis.redis_client import RedisClient  # noqa
+from lib.redis.order_enrichment import enrich_order, menu_index, order_items_info  # noqa
@@ -0,0 +1,66 @@
+from typing import Dict, List
+
+
+# Обогащение заказа документами Redis. Общее для STG-сервиса и загрузчика истории DDS (backfill.py):
+# оба должны отправлять в DDS сообщения одного вида.
+
+
+def menu_index(restaurant: Dict) -> Dict[str, Dict]:
+    """
+    Меню ресторана, индексированное по id блюда.
+    """
+    return {item['_id']: item for item in restaurant['menu']}
+
+
+def order_items_info(order_items: List[Dict], menu: Dict[str, Dict]) -> List[Dict[str, str]]:
+    """
+    Позиции заказа с именем и категорией блюда из меню (menu_index). Блюда нет в меню - KeyError.
+    """
+    items = []
+    for it in order_items:
+        menu_item = menu[it['id']]
+        items.append({
+            'id': it['id'],
+            'price': it['price'],
+            'quantity': it['quantity'],
+            'name': menu_item['name'],
+            'category': menu_item['category']
+        })
+    return items
+
+
+def enrich_order(object_id: int, object_type: str, payload: Dict, user: Dict, restaurant: Dict,
+                 menu: Dict[str, Dict]) -> Dict:
+    """
+    Сообщение заказа для DDS: событие источника с именами пользователя, ресторана и блюд.
+    Args:
+        object_id: Id заказа
+        object_type: Тип события
+        payload: Тело события из исходного топика
+        user: Документ пользователя из Redis
+        restaurant: Документ ресторана из Redis
+        menu: Меню ресторана (menu_index)
+    """
+    return {
+        'object_id': object_id,
+        'object_type': object_type,
+        'payload': {
+            'id': object_id,
+            'date': payload['date'],
+            'cost': payload['cost'],
+            'payment': payload['payment'],
+            'status': payload['final_status'],
+            # Время версии заказа в источнике: по нему DDS упорядочивает версии в PIT-таблицах.
+            'update_ts': payload.get('update_ts') or payload['date'],
+            'restaurant': {
+                'id': restaurant['_id'],
+                'name': restaurant['name']
+            },
+            'user': {
+                'id': user['_id'],
+                'name': user['name'],
+                'login': user['login']
+            },
+            'products': order_items_info(payload['order_items'], menu)
+        }
+    }
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import mmap
+import os
+import random
+import struct
+import time
+import zlib
+from logging import Logger
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from lib.metrics import SNAPSHOT_LOADS
+
+# Раскладка файла:
+#   MAGIC | записи | индекс | футер (JSON) | длина футера u32 | crc32 футера u32 | MAGIC
+# Запись: crc32(ключ + значение) u32, длина ключа u32, длина значения u32, ключ, значение.
+# Индекс: пары (хэш ключа u64, offset записи u64), отсортированные по хэшу, - поиск идет бинарным поиском
+# по отображенному в память файлу, поэтому загрузка снимка не читает записи, а чтение касается пары страниц.
+FORMAT_VERSION = 1
+MAGIC = b'DWHSNAP1'
+_RECORD = struct.Struct('<III')
+_INDEX = struct.Struct('<QQ')
+_TRAILER = struct.Struct('<II')
+
+
+def key_hash(key: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+def write_snapshot(path: str, kind: str, schema_version: int, items: Iterable[Tuple[str, bytes]],
+                   source: str = '') -> int:
+    """
+    Записывает снимок атомарно: во временный файл, fsync и переименование. Возвращает число записей.
+    Args:
+        path: Путь к файлу снимка
+        kind: Вид снимка, например redis-dimensions; читатель другого вида файл не примет
+        schema_version: Версия содержимого у вызывающего; меняется, когда меняется смысл значений
+        items: Пары (ключ, значение), ключи уникальны
+        source: Откуда получены данные (адрес Redis, база Postgres); снимок другого источника не загружается
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    index = []
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        offset = len(MAGIC)
+        for key, value in items:
+            key_bytes = key.encode('utf-8')
+            index.append((key_hash(key_bytes), offset))
+            record = _RECORD.pack(zlib.crc32(key_bytes + value), len(key_bytes), len(value)) + key_bytes + value
+            f.write(record)
+            offset += len(record)
+
+        index.sort()
+        index_bytes = b''.join(_INDEX.pack(h, o) for h, o in index)
+        f.write(index_bytes)
+        footer = json.dumps({
+            'format_version': FORMAT_VERSION,
+            'kind': kind,
+            'schema_version': schema_version,
+            'source': source,
+            'created_at': time.time(),
+            'count': len(index),
+            'index_offset': offset,
+            'index_crc32': zlib.crc32(index_bytes),
+        }).encode('utf-8')
+        f.write(footer)
+        f.write(_TRAILER.pack(len(footer), zlib.crc32(footer)))
+        f.write(MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(index)
+
+
+class SnapshotReader:
+    """
+    Снимок, отображенный в память. Записи читаются по требованию, контрольная сумма записи проверяется
+    при чтении: поврежденная запись считается отсутствующей. Экземпляры создаются через open.
+    """
+
+    def __init__(self, path: str, mm: mmap.mmap, footer: dict) -> None:
+        self.path = path
+        self.created_at: float = footer['created_at']
+        self._mm = mm
+        self._count: int = footer['count']
+        self._index_offset: int = footer['index_offset']
+        self.corrupt_records = 0
+
+    @classmethod
+    def open(cls, path: str, kind: str, schema_version: int, source: str = '',
+             max_age: Optional[float] = None, logger: Optional[Logger] = None) -> Optional['SnapshotReader']:
+        """
+        Открывает снимок. Если файла нет, он другого вида, версии или источника, старше max_age секунд
+        или поврежден, возвращает None: вызывающий стартует с пустым кэшем, как без снимка.
+        """
+        result, reader = cls._open(path, kind, schema_version, source, max_age)
+        SNAPSHOT_LOADS.labels(kind, result).inc()
+        if logger and result != 'missing':
+            if reader:
+                logger.info(f'Снимок {path} загружен: записей {len(reader)}, '
+                            f'возраст {time.time() - reader.created_at:.0f} с')
+            else:
+                logger.warning(f'Снимок {path} не загружен: {result}')
+        return reader
+
+    @classmethod
+    def _open(cls, path: str, kind: str, schema_version: int, source: str,
+              max_age: Optional[float]) -> Tuple[str, Optional['SnapshotReader']]:
+        if not os.path.exists(path):
+            return 'missing', None
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < 2 * len(MAGIC) + _TRAILER.size:
+                return 'corrupt', None
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        tail = size - len(MAGIC)
+        if mm[:len(MAGIC)] != MAGIC or mm[tail:] != MAGIC:
+            return 'corrupt', None
+        footer_len, footer_crc = _TRAILER.unpack_from(mm, tail - _TRAILER.size)
+        footer_start = tail - _TRAILER.size - footer_len
+        if footer_start < len(MAGIC) or zlib.crc32(mm[footer_start:footer_start + footer_len]) != footer_crc:
+            return 'corrupt', None
+        footer = json.loads(mm[footer_start:footer_start + footer_len])
+
+        if footer['format_version'] != FORMAT_VERSION or footer['kind'] != kind \
+                or footer['schema_version'] != schema_version or footer['source'] != source:
+            return 'version', None
+        if max_age is not None and time.time() - footer['created_at'] > max_age:
+            return 'stale', None
+        index_end = footer['index_offset'] + footer['count'] * _INDEX.size
+        if index_end != footer_start or zlib.crc32(mm[footer['index_offset']:index_end]) != footer['index_crc32']:
+            return 'corrupt', None
+        return 'loaded', cls(path, mm, footer)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def get(self, key: str) -> Optional[bytes]:
+        key_bytes = key.encode('utf-8')
+        target = key_hash(key_bytes)
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if _INDEX.unpack_from(self._mm, self._index_offset + mid * _INDEX.size)[0] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        # Совпадение хэша не гарантирует совпадение ключа: проверяем все записи с этим хэшем.
+        while lo < self._count:
+            h, offset = _INDEX.unpack_from(self._mm, self._index_offset + lo * _INDEX.size)
+            if h != target:
+                return None
+            record = self._record(offset)
+            if record is not None and record[0] == key_bytes:
+                return record[1]
+            lo += 1
+        return None
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def items(self) -> Iterator[Tuple[str, bytes]]:
+        """
+        Все неповрежденные записи в порядке записи в файл.
+        """
+        offset = len(MAGIC)
+        while offset < self._index_offset:
+            crc, key_len, value_len = _RECORD.unpack_from(self._mm, offset)
+            record = self._record(offset)
+            if record is not None:
+                yield record[0].decode('utf-8'), record[1]
+            offset += _RECORD.size + key_len + value_len
+
+    def sample(self, n: int) -> List[str]:
+        """
+        Ключи n случайных записей - для выборочной сверки снимка с источником.
+        """
+        keys = []
+        for i in random.sample(range(self._count), min(n, self._count)):
+            record = self._record(_INDEX.unpack_from(self._mm, self._index_offset + i * _INDEX.size)[1])
+            if record is not None:
+                keys.append(record[0].decode('utf-8'))
+        return keys
+
+    def _record(self, offset: int) -> Optional[Tuple[bytes, bytes]]:
+        if offset + _RECORD.size > self._index_offset:
+            self.corrupt_records += 1
+            return None
+        crc, key_len, value_len = _RECORD.unpack_from(self._mm, offset)
+        start = offset + _RECORD.size
+        if start + key_len + value_len > self._index_offset:
+            self.corrupt_records += 1
+            return None
+        data = self._mm[start:start + key_len + value_len]
+        if zlib.crc32(data) != crc:
+            self.corrupt_records += 1
+            return None
+        return data[:key_len], data[key_len:]
@@ -0,0 +1,65 @@
+import time
+from typing import Dict, Optional
+
+from lib.kafka_connect import KafkaMessage
+from lib.metrics import PIPELINE_E2E_LATENCY, PIPELINE_HOP_LATENCY
+
+# Время попадания заказа в исходный топик (unix time в секундах).
+ORIGIN_HEADER = 'x-trace-origin-ts'
+# Время, в которое слой передал заказ дальше: x-trace-stg-ts, x-trace-dds-ts и т.д.
+STAGE_HEADER_TEMPLATE = 'x-trace-{stage}-ts'
+STAGE_HEADER_PREFIX = 'x-trace-'
+STAGE_HEADER_SUFFIX = '-ts'
+
+
+class TraceContext:
+    """
+    Временные метки прохождения заказа через слои STG -> DDS -> CDM.
+    Метки передаются между сервисами в заголовках Kafka, поэтому формат сообщений не меняется.
+    """
+
+    def __init__(self, origin_ts: float, stages: Optional[Dict[str, float]] = None) -> None:
+        self.origin_ts = origin_ts
+        self.stages = stages or {}
+
+    @classmethod
+    def from_message(cls, message: KafkaMessage) -> 'TraceContext':
+        """
+        Восстанавливает контекст из заголовков сообщения.
+        Если заголовков нет (сообщение из исходного топика), за начало отсчета берется
+        время создания сообщения в Kafka, а если нет и его - текущее время.
+        """
+        stages = {}
+        origin_ts = None
+        for key, value in message.headers.items():
+            if key == ORIGIN_HEADER:
+                origin_ts = float(value)
+            elif key.startswith(STAGE_HEADER_PREFIX) and key.endswith(STAGE_HEADER_SUFFIX):
+                stage = key[len(STAGE_HEADER_PREFIX):-len(STAGE_HEADER_SUFFIX)]
+                stages[stage] = float(value)
+
+        if origin_ts is None:
+            origin_ts = message.timestamp / 1000 if message.timestamp else time.time()
+        return cls(origin_ts, stages)
+
+    def upstream_ts(self) -> float:
+        """
+        Время, когда заказ был передан последним из пройденных слоев.
+        """
+        return max(self.stages.values(), default=self.origin_ts)
+
+    def record(self, stage: str) -> None:
+        """
+        Отмечает завершение обработки заказа слоем stage и пишет задержки в гистограммы:
+        время на текущем шаге и время с момента появления заказа в исходном топике.
+        """
+        now = time.time()
+        PIPELINE_HOP_LATENCY.labels(stage).observe(max(now - self.upstream_ts(), 0))
+        PIPELINE_E2E_LATENCY.labels(stage).observe(max(now - self.origin_ts, 0))
+        self.stages[stage] = now
+
+    def to_headers(self) -> Dict[str, str]:
+        headers = {ORIGIN_HEADER: repr(self.origin_ts)}
+        for stage, ts in self.stages.items():
+            headers[STAGE_HEADER_TEMPLATE.format(stage=stage)] = repr(ts)
+        return headers
@@ -0,0 +1,31 @@
+import argparse
+import logging
+
+from app_config import AppConfig
+from lib.kafka_connect import add_replay_arguments, replay_from_args
+from dds_loader.dds_message_processor_job import DdsMessageProcessor
+from dds_loader.repository.dds_repository import DdsRepository
+
+# Переигрывание топика STG через DDS-процессор без сброса offset консьюмер-группы.
+# Пример запуска в контейнере DDS-сервиса:
+#   python replay.py --from-timestamp 2024-05-01T10:00:00 --to-timestamp 2024-05-01T12:00:00 --rate 50
+#   python replay.py --partition 3 --from-offset 1500 --to-offset 1999 --dry-run
+# Загрузка в DDS идемпотентна; переигранные заказы заново отправляются в выходной топик для CDM.
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Переигрывание топика через DDS-процессор')
+    add_replay_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger('dds_replay')
+
+    config = AppConfig()
+    consumer = config.kafka_replay_consumer(args.topic)
+    proc = DdsMessageProcessor(
+        consumer,
+        config.kafka_producer(),
+        DdsRepository(config.pg_warehouse_db(), use_pipeline=bool(config.pg_pipeline)),
+        args.batch_size,
+        logger)
+    replay_from_args(args, consumer, proc, logger, config.failure_handler())
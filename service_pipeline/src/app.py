@@ -0,0 +1,144 @@
+import logging
+import os
+import sys
+
+# Совмещенный режим собирается из кода трех сервисов. Пакет lib у них общий, берется из service_stg
+# (там есть все подпакеты), поэтому каталог STG идет в sys.path первым.
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for service in ('service_cdm', 'service_dds', 'service_stg'):
+    sys.path.insert(0, os.path.join(ROOT, service, 'src'))
+
+from apscheduler.schedulers.background import BackgroundScheduler  # noqa: E402
+from flask import Flask, Response, jsonify, request  # noqa: E402
+
+from cdm_loader.cdm_message_processor_job import CdmMessageProcessor  # noqa: E402
+from cdm_loader.repository.cdm_repository import CdmRepository  # noqa: E402
+from dds_loader.dds_message_processor_job import DdsMessageProcessor  # noqa: E402
+from dds_loader.repository.dds_repository import DdsRepository  # noqa: E402
+from lib.kafka_connect import InProcessProducer  # noqa: E402
+from lib.metrics import render_metrics  # noqa: E402
+from lib.snapshot import save_on_shutdown  # noqa: E402
+from lib.profiling import BatchProfiler  # noqa: E402
+from pipeline_config import PipelineConfig  # noqa: E402
+from stg_loader.repository.stg_repository import StgRepository  # noqa: E402
+from stg_loader.stg_message_processor_job import StgMessageProcessor  # noqa: E402
+
+app = Flask(__name__)
+
+# Профайлер оборачивает функции run и run_retries процессора STG: в совмещенном режиме в них входит обработка
+# всех трех слоев.
+profiler = BatchProfiler()
+
+
+# Заводим endpoint для проверки, поднялся ли сервис.
+# Обратиться к нему можно будет GET-запросом по адресу localhost:5000/health.
+@app.get('/health')
+def health():
+    return 'healthy'
+
+
+# Endpoint для сбора метрик Prometheus. Метрики всех трех слоев собираются в одном процессе.
+@app.get('/metrics')
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
+# Включение профилирования следующих N батчей:
+# POST localhost:5000/admin/profile?batches=5&mode=sampling (или mode=cprofile).
+@app.post('/admin/profile')
+def start_profile():
+    try:
+        profiler.start(
+            batches=int(request.args.get('batches', 1)),
+            mode=request.args.get('mode', 'sampling'),
+            interval=float(request.args.get('interval', 0.005)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(profiler.status())
+
+
+@app.get('/admin/profile')
+def get_profile():
+    return jsonify(dict(profiler.status(), report=profiler.report(int(request.args.get('top', 50)))))
+
+
+@app.get('/admin/profile/collapsed')
+def get_profile_collapsed():
+    return Response(profiler.collapsed(), content_type='text/plain; charset=utf-8')
+
+
+if __name__ == '__main__':
+    config = PipelineConfig()
+    app.logger.setLevel(logging.getLevelName(config.log_level))
+
+    db = config.pg_warehouse_db()
+    batch_size = 100
+
+    # Снимок документов Redis для обогащения в STG загружается до запуска процессора.
+    redis_client = config.redis_client()
+    if config.redis_snapshot:
+        redis_client = config.dimension_store(app.logger)
+        redis_client.start()
+        if config.redis_snapshot_path:
+            save_on_shutdown(redis_client.save_snapshot)
+    known_keys = config.known_keys(app.logger)
+    if known_keys:
+        known_keys.load()
+        if config.dds_known_keys_path:
+            save_on_shutdown(known_keys.save_snapshot)
+
+    # Слои собираются с конца: CDM не читает Kafka, DDS передает ему заказ через InProcessProducer,
+    # так же STG передает заказ в DDS. Ошибка в DDS или CDM возвращается в STG, и исходное сообщение
+    # уходит в retry/DLQ STG. Повторная обработка безопасна: вставки STG и DDS идемпотентны.
+    # В конце батча STG вызывает flush по цепочке, и CDM записывает агрегаты батча.
+    cdm_proc = CdmMessageProcessor(
+        None,
+        CdmRepository(db, bool(config.pg_pipeline)),
+        batch_size,
+        app.logger,
+        config.log_payload_sample_rate)
+
+    dds_proc = DdsMessageProcessor(
+        None,
+        InProcessProducer('in-process-cdm', cdm_proc.process, config.dds_topic_producer(), cdm_proc.flush),
+        DdsRepository(db, known_keys, bool(config.pg_pipeline)),
+        batch_size,
+        app.logger,
+        config.log_payload_sample_rate)
+
+    proc = StgMessageProcessor(
+        config.kafka_consumer(),
+        InProcessProducer('in-process-dds', dds_proc.process, config.stg_topic_producer(), dds_proc.flush),
+        redis_client,
+        StgRepository(db),
+        batch_size,
+        app.logger,
+        config.log_payload_sample_rate,
+        config.failure_handler(),
+        config.kafka_retry_consumer(),
+        config.batch_max_bytes)
+
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(func=profiler.wrap(proc.run), trigger="interval", seconds=config.pipeline_job_interval)
+    # Слушатель keyspace-уведомлений перезапускается, если потерял соединение с Redis.
+    if config.redis_snapshot:
+        scheduler.add_job(func=redis_client.ensure_listening, trigger="interval", seconds=config.DEFAULT_JOB_INTERVAL)
+    # Снимки кэшей сохраняются на диск для быстрого старта после перезапуска.
+    if config.redis_snapshot and config.redis_snapshot_path:
+        scheduler.add_job(func=redis_client.save_snapshot, trigger="interval", seconds=config.snapshot_interval,
+                          max_instances=1)
+    if known_keys and config.dds_known_keys_path:
+        scheduler.add_job(func=known_keys.save_snapshot, trigger="interval", seconds=config.snapshot_interval,
+                          max_instances=1)
+    if config.kafka_retry_topic:
+        scheduler.add_job(func=profiler.wrap(proc.run_retries), trigger="interval", seconds=config.DEFAULT_JOB_INTERVAL)
+    partition_manager = config.partition_manager(app.logger)
+    partition_manager.run()
+    scheduler.add_job(func=partition_manager.run, trigger="interval", seconds=config.stg_partition_job_interval)
+    if config.stg_archive_dir:
+        scheduler.add_job(func=config.partition_archiver(app.logger).run, trigger="interval",
+                          seconds=config.stg_partition_job_interval)
+    scheduler.start()
+
+    app.run(debug=True, host='0.0.0.0', use_reloader=False)
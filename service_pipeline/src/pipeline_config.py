@@ -0,0 +1,65 @@
+import os
+from typing import Optional
+
+from app_config import AppConfig
+from dds_loader.repository.known_keys import KnownKeys
+from lib.kafka_connect import KafkaProducer
+
+
+class PipelineConfig(AppConfig):
+    """
+    Конфиг совмещенного режима. Kafka, Postgres, Redis, retry/DLQ и секционирование настраиваются
+    теми же переменными, что и у STG-сервиса: из Kafka читается только исходный топик.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        # Промежуточные топики STG -> DDS и DDS -> CDM. Слои передают заказ друг другу в памяти,
+        # в топики сообщения отправляются только если они заданы (для других потребителей).
+        self.pipeline_stg_topic = str(os.getenv('PIPELINE_STG_TOPIC') or "")
+        self.pipeline_dds_topic = str(os.getenv('PIPELINE_DDS_TOPIC') or "")
+        # Ключ сообщений DDS -> CDM. Для STG -> DDS используется KAFKA_MESSAGE_KEY, как у STG-сервиса.
+        self.pipeline_dds_message_key = str(os.getenv('PIPELINE_DDS_MESSAGE_KEY') or "user.id")
+
+        # Интервал запуска джоба в секундах. Задержки между слоями нет, поэтому его имеет смысл держать маленьким.
+        self.pipeline_job_interval = int(os.getenv('PIPELINE_JOB_INTERVAL') or 1)
+
+        # Кэш ключей справочных строк DDS и его файл, как у DDS-сервиса.
+        self.dds_known_keys = int(os.getenv('DDS_KNOWN_KEYS') or 0)
+        self.dds_known_keys_path = str(os.getenv('DDS_KNOWN_KEYS_PATH') or "")
+
+        # Вставки DDS и инкременты CDM одного сообщения - одной транзакцией в режиме pipeline, как у сервисов.
+        self.pg_pipeline = int(os.getenv('PG_PIPELINE') or 1)
+
+    def known_keys(self, logger) -> Optional[KnownKeys]:
+        if not self.dds_known_keys:
+            return None
+        return KnownKeys(
+            self.pg_warehouse_db(),
+            logger,
+            snapshot_path=self.dds_known_keys_path,
+            snapshot_max_age=self.snapshot_max_age,
+            source=f'{self.pg_warehouse_host}:{self.pg_warehouse_port}/{self.pg_warehouse_dbname}'
+        )
+
+    def stg_topic_producer(self) -> Optional[KafkaProducer]:
+        return self._keyed_producer(self.pipeline_stg_topic, self.kafka_message_key, 'stg-orders')
+
+    def dds_topic_producer(self) -> Optional[KafkaProducer]:
+        return self._keyed_producer(self.pipeline_dds_topic, self.pipeline_dds_message_key, 'dds-orders')
+
+    def _keyed_producer(self, topic: str, key_field: str, subject: str) -> Optional[KafkaProducer]:
+        if not topic:
+            return None
+        return KafkaProducer(
+            self.kafka_host,
+            self.kafka_port,
+            self.kafka_producer_username,
+            self.kafka_producer_password,
+            topic,
+            self.CERTIFICATE_PATH,
+            key_field,
+            self.wire_format(subject),
+            self.kafka_compression
+        )
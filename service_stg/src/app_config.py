@@ -1,8 +1,12 @@
 import os
+import socket
+from typing import Optional
 
-from lib.kafka_connect import KafkaConsumer, KafkaProducer
+from lib.kafka_connect import FailureHandler, KafkaConsumer, KafkaProducer, SchemaRegistry, WireFormat
 from lib.pg import PgConnect
-from lib.redis import RedisClient
+from lib.redis import RedisClient, RedisDimensionStore
+from stg_loader.archive import PartitionArchiver
+from stg_loader.partitions import PartitionManager
 
 
 class AppConfig:
@@ -17,13 +21,65 @@ class AppConfig:
         self.kafka_consumer_password = str(os.getenv('KAFKA_CONSUMER_PASSWORD') or "")
         self.kafka_consumer_group = str(os.getenv('KAFKA_CONSUMER_GROUP') or "")
         self.kafka_consumer_topic = str(os.getenv('KAFKA_SOURCE_TOPIC') or "")
+        # Постоянный id участника консьюмер-группы (static membership). По умолчанию - имя пода из POD_NAME;
+        # пустое значение - динамическое членство. Id должен сохраняться при перезапуске, поэтому
+        # случайный HOSTNAME контейнера для этого не подходит.
+        self.kafka_instance_id = str(os.getenv('KAFKA_GROUP_INSTANCE_ID') or os.getenv('POD_NAME') or "")
+        self.kafka_session_timeout_ms = int(os.getenv('KAFKA_SESSION_TIMEOUT_MS') or 45000)
+        # Ограничения памяти консьюмера: объем одного ответа брокера на fetch (не меньше 1000000), очередь
+        # предзагруженных librdkafka сообщений в КБ и объем прочитанных, но еще не зафиксированных сообщений,
+        # после которого чтение партиций приостанавливается до commit.
+        self.kafka_fetch_max_bytes = int(os.getenv('KAFKA_FETCH_MAX_BYTES') or 8388608)
+        self.kafka_queued_max_kbytes = int(os.getenv('KAFKA_QUEUED_MAX_KBYTES') or 16384)
+        self.kafka_max_inflight_bytes = int(os.getenv('KAFKA_MAX_INFLIGHT_BYTES') or 33554432)
+        # Лимит объема батча процессора в байтах, в дополнение к числу сообщений (0 - без лимита).
+        self.batch_max_bytes = int(os.getenv('BATCH_MAX_BYTES') or 8388608)
+        # Число сообщений в батче процессора.
+        self.batch_size = int(os.getenv('BATCH_SIZE') or 100)
+        self.kafka_debug = str(os.getenv('KAFKA_DEBUG') or "")
         self.kafka_producer_username = str(os.getenv('KAFKA_CONSUMER_USERNAME') or "")
         self.kafka_producer_password = str(os.getenv('KAFKA_CONSUMER_PASSWORD') or "")
         self.kafka_producer_topic = str(os.getenv('KAFKA_DESTINATION_TOPIC') or "")
+        # Поле, по которому ключуются исходящие сообщения (путь через точку). По умолчанию - id пользователя:
+        # заказы одного пользователя попадают в одну партицию, и консьюмеры следующего слоя не делят пользователей.
+        self.kafka_message_key = str(os.getenv('KAFKA_MESSAGE_KEY') or "payload.user.id")
+
+        # Формат исходящих сообщений: json или msgpack по схеме KAFKA_SCHEMA_SUBJECT, и сжатие батчей
+        # (zstd, lz4, gzip, snappy). Реестр схем - JSON-файл KAFKA_SCHEMA_REGISTRY, по умолчанию
+        # lib/kafka_connect/schemas.json. Входящие сообщения читаются в формате из их заголовка content-type.
+        self.kafka_wire_format = str(os.getenv('KAFKA_WIRE_FORMAT') or "json")
+        self.kafka_schema_subject = str(os.getenv('KAFKA_SCHEMA_SUBJECT') or "stg-orders")
+        self.kafka_schema_registry = str(os.getenv('KAFKA_SCHEMA_REGISTRY') or "")
+        self.kafka_compression = str(os.getenv('KAFKA_COMPRESSION') or "")
+        # Транзакционный режим: 1 - сообщения батча и offset консьюмера фиксируются одной транзакцией Kafka,
+        # после падения батч не дублируется в исходящем топике. transactional.id должен сохраняться при перезапуске,
+        # по умолчанию строится из KAFKA_GROUP_INSTANCE_ID: тогда перезапущенный экземпляр сразу отменяет
+        # незавершенную транзакцию, а не ждет KAFKA_TRANSACTION_TIMEOUT_MS.
+        self.kafka_transactional = int(os.getenv('KAFKA_TRANSACTIONAL') or 0)
+        self.kafka_transactional_id = str(os.getenv('KAFKA_TRANSACTIONAL_ID') or "")
+        self.kafka_transaction_timeout_ms = int(os.getenv('KAFKA_TRANSACTION_TIMEOUT_MS') or 60000)
+
+        # Топики для повторной обработки и для сообщений, которые обработать не удалось.
+        # Если топик не задан, соответствующий маршрут отключен.
+        self.kafka_retry_topic = str(os.getenv('KAFKA_RETRY_TOPIC') or "")
+        self.kafka_dlq_topic = str(os.getenv('KAFKA_DLQ_TOPIC') or "")
+        self.retry_max_attempts = int(os.getenv('RETRY_MAX_ATTEMPTS') or 5)
+        self.retry_base_backoff = float(os.getenv('RETRY_BASE_BACKOFF') or 1.0)
+        self.retry_max_backoff = float(os.getenv('RETRY_MAX_BACKOFF') or 300.0)
 
         self.redis_host = str(os.getenv('REDIS_HOST') or "")
         self.redis_port = int(str(os.getenv('REDIS_PORT')) or 0)
         self.redis_password = str(os.getenv('REDIS_PASSWORD') or "")
+        # Локальный снимок документов Redis для обогащения: 1 - загрузить все документы при старте
+        # и сбрасывать измененные по keyspace-уведомлениям, 0 - каждый раз читать Redis.
+        self.redis_snapshot = int(os.getenv('REDIS_SNAPSHOT') or 0)
+        self.redis_snapshot_match = str(os.getenv('REDIS_SNAPSHOT_MATCH') or "*")
+        self.redis_snapshot_batch_size = int(os.getenv('REDIS_SNAPSHOT_BATCH_SIZE') or 500)
+        # Файл, в который снимок сохраняется раз в SNAPSHOT_INTERVAL секунд и при остановке. При старте
+        # обогащение сразу идет из файла, если он не старше SNAPSHOT_MAX_AGE секунд. Пустое значение - без файла.
+        self.redis_snapshot_path = str(os.getenv('REDIS_SNAPSHOT_PATH') or "")
+        self.snapshot_interval = int(os.getenv('SNAPSHOT_INTERVAL') or 300)
+        self.snapshot_max_age = int(os.getenv('SNAPSHOT_MAX_AGE') or 3600)
 
         self.pg_warehouse_host = str(os.getenv('PG_WAREHOUSE_HOST') or "")
         self.pg_warehouse_port = int(str(os.getenv('PG_WAREHOUSE_PORT') or 0))
@@ -31,14 +87,40 @@ class AppConfig:
         self.pg_warehouse_user = str(os.getenv('PG_WAREHOUSE_USER') or "")
         self.pg_warehouse_password = str(os.getenv('PG_WAREHOUSE_PASSWORD') or "")
 
-    def kafka_producer(self):
+        # Секционирование stg.order_events по sent_dttm: размер секции (day или month), сколько будущих секций
+        # создавать заранее и сколько прошлых хранить (0 - хранить все). Старые секции отсоединяются (detach)
+        # или удаляются (drop). Джоб обслуживания запускается раз в STG_PARTITION_JOB_INTERVAL секунд.
+        self.stg_partition_interval = str(os.getenv('STG_PARTITION_INTERVAL') or "month")
+        self.stg_partition_premake = int(os.getenv('STG_PARTITION_PREMAKE') or 3)
+        self.stg_partition_retention = int(os.getenv('STG_PARTITION_RETENTION') or 0)
+        self.stg_partition_retention_action = str(os.getenv('STG_PARTITION_RETENTION_ACTION') or "detach")
+        self.stg_partition_job_interval = int(os.getenv('STG_PARTITION_JOB_INTERVAL') or 3600)
+
+        # Каталог архива: отсоединенные секции выгружаются туда в Parquet и удаляются из базы.
+        # Пустое значение - выгрузка выключена, отсоединенные секции остаются в базе.
+        self.stg_archive_dir = str(os.getenv('STG_ARCHIVE_DIR') or "")
+        self.stg_archive_batch_size = int(os.getenv('STG_ARCHIVE_BATCH_SIZE') or 100000)
+
+        self.log_level = str(os.getenv('LOG_LEVEL') or "INFO").upper()
+        self.log_payload_sample_rate = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE') or 0)
+
+    def kafka_producer(self, transactional: bool = False):
+        transactional_id = ''
+        if transactional:
+            transactional_id = self.kafka_transactional_id or \
+                f'{self.kafka_producer_topic}-{self.kafka_instance_id or socket.gethostname()}'
         return KafkaProducer(
             self.kafka_host,
             self.kafka_port,
             self.kafka_producer_username,
             self.kafka_producer_password,
             self.kafka_producer_topic,
-            self.CERTIFICATE_PATH
+            self.CERTIFICATE_PATH,
+            self.kafka_message_key,
+            self.wire_format(),
+            self.kafka_compression,
+            transactional_id=transactional_id,
+            transaction_timeout_ms=self.kafka_transaction_timeout_ms
         )
 
     def kafka_consumer(self):
@@ -49,7 +131,14 @@ class AppConfig:
             self.kafka_consumer_password,
             self.kafka_consumer_topic,
             self.kafka_consumer_group,
-            self.CERTIFICATE_PATH
+            self.CERTIFICATE_PATH,
+            self.kafka_debug,
+            self.wire_format(),
+            instance_id=self.kafka_instance_id,
+            session_timeout_ms=self.kafka_session_timeout_ms,
+            fetch_max_bytes=self.kafka_fetch_max_bytes,
+            queued_max_kbytes=self.kafka_queued_max_kbytes,
+            max_inflight_bytes=self.kafka_max_inflight_bytes
         )
 
     def redis_client(self) -> RedisClient:
@@ -60,6 +149,91 @@ class AppConfig:
             self.CERTIFICATE_PATH
         )
 
+    def wire_format(self, subject: Optional[str] = None) -> WireFormat:
+        return WireFormat(
+            self.kafka_wire_format,
+            SchemaRegistry(self.kafka_schema_registry) if self.kafka_schema_registry else None,
+            self.kafka_schema_subject if subject is None else subject
+        )
+
+    def dimension_store(self, logger) -> RedisDimensionStore:
+        return RedisDimensionStore(
+            self.redis_client(),
+            logger,
+            match=self.redis_snapshot_match,
+            batch_size=self.redis_snapshot_batch_size,
+            snapshot_path=self.redis_snapshot_path,
+            snapshot_max_age=self.snapshot_max_age,
+            source=f'{self.redis_host}:{self.redis_port}'
+        )
+
+    # Retry- и dead-letter топики пишутся в JSON: их читают люди и сторонние инструменты.
+    def _topic_producer(self, topic: str) -> Optional[KafkaProducer]:
+        if not topic:
+            return None
+        return KafkaProducer(
+            self.kafka_host,
+            self.kafka_port,
+            self.kafka_producer_username,
+            self.kafka_producer_password,
+            topic,
+            self.CERTIFICATE_PATH
+        )
+
+    def failure_handler(self, producer: Optional[KafkaProducer] = None) -> FailureHandler:
+        # С транзакционным продюсером сообщения retry- и dead-letter маршрутов уходят в транзакцию батча:
+        # после ее отмены батч обрабатывается заново, и маршрут не дублируется.
+        if producer is not None and producer.transactional:
+            retry_producer = producer.for_topic(self.kafka_retry_topic) if self.kafka_retry_topic else None
+            dlq_producer = producer.for_topic(self.kafka_dlq_topic) if self.kafka_dlq_topic else None
+        else:
+            retry_producer = self._topic_producer(self.kafka_retry_topic)
+            dlq_producer = self._topic_producer(self.kafka_dlq_topic)
+        return FailureHandler(
+            retry_producer,
+            dlq_producer,
+            self.retry_max_attempts,
+            self.retry_base_backoff,
+            self.retry_max_backoff
+        )
+
+    # Консьюмер для переигрывания топика: партиции назначаются вручную, offset группы не фиксируются.
+    def kafka_replay_consumer(self, topic: str = '') -> KafkaConsumer:
+        return KafkaConsumer(
+            self.kafka_host,
+            self.kafka_port,
+            self.kafka_consumer_username,
+            self.kafka_consumer_password,
+            topic or self.kafka_consumer_topic,
+            f'{self.kafka_consumer_group}-replay',
+            self.CERTIFICATE_PATH,
+            self.kafka_debug,
+            self.wire_format(),
+            subscribe=False,
+            fetch_max_bytes=self.kafka_fetch_max_bytes,
+            queued_max_kbytes=self.kafka_queued_max_kbytes
+        )
+
+    def kafka_retry_consumer(self) -> Optional[KafkaConsumer]:
+        if not self.kafka_retry_topic:
+            return None
+        return KafkaConsumer(
+            self.kafka_host,
+            self.kafka_port,
+            self.kafka_consumer_username,
+            self.kafka_consumer_password,
+            self.kafka_retry_topic,
+            self.kafka_consumer_group,
+            self.CERTIFICATE_PATH,
+            self.kafka_debug,
+            self.wire_format(),
+            instance_id=f'{self.kafka_instance_id}-retry' if self.kafka_instance_id else '',
+            session_timeout_ms=self.kafka_session_timeout_ms,
+            fetch_max_bytes=self.kafka_fetch_max_bytes,
+            queued_max_kbytes=self.kafka_queued_max_kbytes,
+            max_inflight_bytes=self.kafka_max_inflight_bytes
+        )
+
     def pg_warehouse_db(self):
         return PgConnect(
             self.pg_warehouse_host,
@@ -68,3 +242,22 @@ class AppConfig:
             self.pg_warehouse_user,
             self.pg_warehouse_password
         )
+
+    def partition_manager(self, logger) -> PartitionManager:
+        return PartitionManager(
+            self.pg_warehouse_db(),
+            logger,
+            interval=self.stg_partition_interval,
+            premake=self.stg_partition_premake,
+            retention=self.stg_partition_retention,
+            retention_action=self.stg_partition_retention_action
+        )
+
+    def partition_archiver(self, logger, drop_after_export: bool = True) -> PartitionArchiver:
+        return PartitionArchiver(
+            self.pg_warehouse_db(),
+            logger,
+            self.stg_archive_dir,
+            batch_size=self.stg_archive_batch_size,
+            drop_after_export=drop_after_export
+        )
@@ -0,0 +1,28 @@
+import argparse
+import logging
+
+from app_config import AppConfig
+
+# Выгрузка старых секций stg.order_events в Parquet, то же самое делает джоб STG-сервиса при заданном STG_ARCHIVE_DIR.
+# Пример запуска в контейнере STG-сервиса:
+#   python archive.py --archive-dir /archive
+#   python archive.py --archive-dir /archive --partition order_events_p2023_01 --keep-table
+# Без --partition выгружаются все секции, отсоединенные retention.
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Выгрузка секций stg.order_events в Parquet')
+    parser.add_argument('--archive-dir', help='Каталог архива (по умолчанию STG_ARCHIVE_DIR)')
+    parser.add_argument('--partition', action='append', help='Имя секции; можно указать несколько раз')
+    parser.add_argument('--keep-table', action='store_true', help='Не удалять таблицу секции после выгрузки')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger('stg_archive')
+
+    config = AppConfig()
+    if args.archive_dir:
+        config.stg_archive_dir = args.archive_dir
+    if not config.stg_archive_dir:
+        parser.error('не задан каталог архива: --archive-dir или STG_ARCHIVE_DIR')
+
+    config.partition_archiver(logger, drop_after_export=not args.keep_table).run(args.partition)
@@ -0,0 +1 @@
+from .order_events_archive import ArchiveManifest, ORDER_EVENTS_SCHEMA, SCHEMA_VERSION, file_sha256, flatten_event, unflatten_event  # noqa
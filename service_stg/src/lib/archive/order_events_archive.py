@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import pyarrow as pa
+
+# Версия раскладки файлов. Меняется вместе со схемой, читатель проверяет ее по манифесту.
+SCHEMA_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+DTTM_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Известные поля payload раскладываются по колонкам, все остальное сохраняется в payload_extra как JSON,
+# поэтому из файла восстанавливается исходный payload без потерь.
+_ITEM_TYPE = pa.struct([
+    ('id', pa.string()),
+    ('name', pa.string()),
+    ('price', pa.float64()),
+    ('quantity', pa.int64()),
+])
+_STATUS_TYPE = pa.struct([
+    ('status', pa.string()),
+    ('dttm', pa.timestamp('us')),
+])
+
+ORDER_EVENTS_SCHEMA = pa.schema([
+    ('object_id', pa.int64()),
+    ('object_type', pa.string()),
+    ('sent_dttm', pa.timestamp('us')),
+    ('restaurant_id', pa.string()),
+    ('user_id', pa.string()),
+    ('order_date', pa.timestamp('us')),
+    ('cost', pa.float64()),
+    ('payment', pa.float64()),
+    ('bonus_payment', pa.float64()),
+    ('bonus_grant', pa.float64()),
+    ('final_status', pa.string()),
+    ('update_ts', pa.timestamp('us')),
+    ('order_items', pa.list_(_ITEM_TYPE)),
+    ('statuses', pa.list_(_STATUS_TYPE)),
+    ('payload_extra', pa.string()),
+])
+
+
+def _parse_dttm(value: str) -> datetime:
+    return datetime.strptime(value, DTTM_FORMAT)
+
+
+def _format_dttm(value: Optional[datetime]) -> Optional[str]:
+    return value.strftime(DTTM_FORMAT) if value else None
+
+
+def _number(value):
+    # Целые суммы в исходных событиях хранятся без дробной части, сохраняем это при восстановлении.
+    if value is not None and float(value).is_integer():
+        return int(value)
+    return value
+
+
+def _amount(value) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError('amount is not a number')
+    return float(value)
+
+
+def _text(value) -> str:
+    if not isinstance(value, str):
+        raise TypeError('value is not a string')
+    return value
+
+
+def _ref_id(value: Dict) -> str:
+    if set(value) != {'id'}:
+        raise ValueError('unexpected reference fields')
+    return _text(value['id'])
+
+
+def _items(value: List[Dict]) -> List[Dict]:
+    if any(set(item) != {'id', 'name', 'price', 'quantity'} for item in value):
+        raise ValueError('unexpected order item fields')
+    for item in value:
+        _text(item['id']), _text(item['name']), _amount(item['price'])
+        if isinstance(item['quantity'], bool) or not isinstance(item['quantity'], int):
+            raise TypeError('quantity is not an integer')
+    return value
+
+
+def _statuses(value: List[Dict]) -> List[Dict]:
+    if any(set(status) != {'status', 'dttm'} for status in value):
+        raise ValueError('unexpected status fields')
+    return [{'status': _text(s['status']), 'dttm': _parse_dttm(s['dttm'])} for s in value]
+
+
+# Поле payload -> (колонка, преобразование). Если значение не укладывается в колонку
+# (другой формат даты, лишние поля), оно целиком уходит в payload_extra.
+_COLUMNS = {
+    'restaurant': ('restaurant_id', _ref_id),
+    'user': ('user_id', _ref_id),
+    'date': ('order_date', _parse_dttm),
+    'cost': ('cost', _amount),
+    'payment': ('payment', _amount),
+    'bonus_payment': ('bonus_payment', _amount),
+    'bonus_grant': ('bonus_grant', _amount),
+    'final_status': ('final_status', _text),
+    'update_ts': ('update_ts', _parse_dttm),
+    'order_items': ('order_items', _items),
+    'statuses': ('statuses', _statuses),
+}
+
+
+def flatten_event(object_id: int, object_type: str, sent_dttm: datetime, payload: Dict) -> Dict:
+    """
+    Превращает строку stg.order_events в запись с колонками ORDER_EVENTS_SCHEMA.
+    """
+    record = {'object_id': object_id, 'object_type': object_type, 'sent_dttm': sent_dttm}
+    extra = {}
+    for key, value in payload.items():
+        column = _COLUMNS.get(key)
+        if column is None or value is None:
+            extra[key] = value
+            continue
+        try:
+            record[column[0]] = column[1](value)
+        except (KeyError, TypeError, ValueError):
+            extra[key] = value
+    record['payload_extra'] = json.dumps(extra, ensure_ascii=False) if extra else None
+    return record
+
+
+def unflatten_event(record: Dict) -> Tuple[int, str, Dict]:
+    """
+    Обратное преобразование: (object_id, object_type, payload) в том виде, в каком событие лежало в STG.
+    """
+    restore = {
+        'restaurant': lambda v: {'id': v},
+        'user': lambda v: {'id': v},
+        'date': _format_dttm,
+        'cost': _number,
+        'payment': _number,
+        'bonus_payment': _number,
+        'bonus_grant': _number,
+        'final_status': str,
+        'update_ts': _format_dttm,
+        'order_items': lambda v: [dict(it, price=_number(it['price'])) for it in v],
+        'statuses': lambda v: [{'status': s['status'], 'dttm': _format_dttm(s['dttm'])} for s in v],
+    }
+    payload = {}
+    for key, (column, _) in _COLUMNS.items():
+        if record.get(column) is not None:
+            payload[key] = restore[key](record[column])
+    if record.get('payload_extra'):
+        payload.update(json.loads(record['payload_extra']))
+    return record['object_id'], record['object_type'], payload
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ArchiveManifest:
+    """
+    Манифест архива: список файлов с числом строк, диапазонами object_id и sent_dttm и контрольной суммой.
+    Файл перезаписывается атомарно, поэтому читатель никогда не видит недописанный манифест.
+    """
+
+    def __init__(self, archive_dir: str) -> None:
+        self._archive_dir = archive_dir
+        self._path = os.path.join(archive_dir, MANIFEST_NAME)
+
+    def load(self) -> Dict:
+        if not os.path.exists(self._path):
+            return {'schema_version': SCHEMA_VERSION, 'table': 'stg.order_events', 'files': []}
+        with open(self._path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['schema_version'] != SCHEMA_VERSION:
+            raise ValueError(f"unsupported archive schema version: {manifest['schema_version']}")
+        return manifest
+
+    def files(self) -> List[Dict]:
+        return self.load()['files']
+
+    def path(self, entry: Dict) -> str:
+        return os.path.join(self._archive_dir, entry['file'])
+
+    def file_name(self, partition: str) -> str:
+        """
+        Свободное имя файла для выгрузки секции. Период, заново созданный и снова отсоединенный, выгружается
+        повторно: следующий файл получает номер (order_events_p2023_01.2.parquet), прежний не перезаписывается.
+        """
+        taken = {f['file'] for f in self.files()}
+        file_name = f'{partition}.parquet'
+        sequence = 1
+        while file_name in taken or os.path.exists(os.path.join(self._archive_dir, file_name)):
+            sequence += 1
+            file_name = f'{partition}.{sequence}.parquet'
+        return file_name
+
+    def add(self, entry: Dict) -> None:
+        manifest = self.load()
+        if any(f['file'] == entry['file'] for f in manifest['files']):
+            raise ValueError(f"archive file {entry['file']} is already in the manifest")
+        manifest['files'].append(entry)
+        manifest['files'].sort(key=lambda f: f['min_sent_dttm'] or '')
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self._path)
@@ -1 +1,5 @@
-from .kafka_connectors import KafkaConsumer, KafkaProducer  # noqa
+from .kafka_connectors import KafkaConsumer, KafkaMessage, KafkaProducer, TopicProducer, message_key  # noqa
+from .failure_handler import FailureHandler, is_transient  # noqa
+from .in_process import InProcessProducer  # noqa
+from .wire_format import SchemaRegistry, WireFormat  # noqa
+from .replay import KafkaReplay, add_replay_arguments, parse_timestamp, replay_from_args  # noqa
@@ -0,0 +1,125 @@
+import random
+import time
+from typing import Dict, Optional
+
+import psycopg
+from confluent_kafka import KafkaException
+
+from lib.metrics import MESSAGES_DEAD_LETTERED, MESSAGES_RETRIED
+from .kafka_connectors import KafkaMessage, KafkaProducer
+
+try:
+    import redis
+    _REDIS_TRANSIENT = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError,
+                        redis.exceptions.BusyLoadingError)
+except ImportError:
+    _REDIS_TRANSIENT = ()
+
+ATTEMPT_HEADER = 'x-retry-attempt'
+NOT_BEFORE_HEADER = 'x-retry-not-before'
+ERROR_HEADER_PREFIX = 'x-error-'
+
+ROUTE_RETRY = 'retry'
+ROUTE_DEAD_LETTER = 'dead_letter'
+ROUTE_DROPPED = 'dropped'
+
+# Ошибки, после которых повтор имеет смысл: сеть, таймауты, конфликты блокировок.
+_TRANSIENT_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    psycopg.OperationalError,
+    psycopg.errors.SerializationFailure,
+    psycopg.errors.DeadlockDetected,
+    psycopg.errors.LockNotAvailable,
+    psycopg.errors.QueryCanceled,
+) + _REDIS_TRANSIENT
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Возвращает True, если ошибка временная и сообщение стоит обработать повторно.
+    Все остальные ошибки (битые данные, нарушение ограничений, отсутствующие ключи) считаются
+    ошибками сообщения: повтор их не исправит.
+    """
+    if isinstance(error, KafkaException):
+        return error.args[0].retriable()
+    return isinstance(error, _TRANSIENT_ERRORS)
+
+
+class FailureHandler:
+    """
+    Отправляет сообщения, обработка которых завершилась ошибкой, в retry-топик
+    (временные ошибки, с экспоненциальной задержкой) или в dead-letter топик (все остальные).
+    Основной поток при этом не останавливается.
+    Args:
+        retry_producer: Продюсер retry-топика. Если не задан, повторов нет
+        dlq_producer: Продюсер dead-letter топика. Если не задан, сообщение только логируется
+        max_attempts: Максимальное количество повторов
+        base_backoff: Задержка перед первым повтором в секундах, далее удваивается
+        max_backoff: Верхняя граница задержки в секундах
+    """
+
+    def __init__(self,
+                 retry_producer: Optional[KafkaProducer] = None,
+                 dlq_producer: Optional[KafkaProducer] = None,
+                 max_attempts: int = 5,
+                 base_backoff: float = 1.0,
+                 max_backoff: float = 300.0) -> None:
+        self._retry_producer = retry_producer
+        self._dlq_producer = dlq_producer
+        self._max_attempts = max_attempts
+        self._base_backoff = base_backoff
+        self._max_backoff = max_backoff
+
+    @staticmethod
+    def attempt(message: KafkaMessage) -> int:
+        return int(message.headers.get(ATTEMPT_HEADER, 0))
+
+    @staticmethod
+    def due_in(message: KafkaMessage) -> float:
+        """
+        Сколько секунд осталось до момента, когда сообщение из retry-топика можно обрабатывать.
+        """
+        not_before = message.headers.get(NOT_BEFORE_HEADER)
+        if not_before is None:
+            return 0.0
+        return float(not_before) - time.time()
+
+    def backoff(self, attempt: int) -> float:
+        # Небольшой джиттер, чтобы сообщения, упавшие одновременно, не повторялись одной пачкой.
+        delay = min(self._base_backoff * 2 ** attempt, self._max_backoff)
+        return delay * random.uniform(0.8, 1.0)
+
+    def handle(self, message: KafkaMessage, error: Exception) -> str:
+        """
+        Отправляет сообщение в retry- или dead-letter топик и возвращает выбранный маршрут.
+        """
+        attempt = self.attempt(message)
+        headers = {k: v.decode() if isinstance(v, bytes) else v for k, v in message.headers.items()}
+
+        if self._retry_producer and is_transient(error) and attempt < self._max_attempts:
+            headers[ATTEMPT_HEADER] = str(attempt + 1)
+            headers[NOT_BEFORE_HEADER] = repr(time.time() + self.backoff(attempt))
+            self._retry_producer.produce(message.value, headers=headers, key=message.key)
+            MESSAGES_RETRIED.labels(message.topic).inc()
+            return ROUTE_RETRY
+
+        if self._dlq_producer:
+            headers.update(self._error_headers(message, error))
+            self._dlq_producer.produce(message.value, headers=headers, key=message.key)
+            MESSAGES_DEAD_LETTERED.labels(message.topic).inc()
+            return ROUTE_DEAD_LETTER
+
+        return ROUTE_DROPPED
+
+    @staticmethod
+    def _error_headers(message: KafkaMessage, error: Exception) -> Dict[str, str]:
+        return {
+            f'{ERROR_HEADER_PREFIX}class': type(error).__name__,
+            f'{ERROR_HEADER_PREFIX}message': str(error)[:1000],
+            f'{ERROR_HEADER_PREFIX}kind': 'transient' if is_transient(error) else 'poison',
+            f'{ERROR_HEADER_PREFIX}topic': message.topic,
+            f'{ERROR_HEADER_PREFIX}partition': str(message.partition),
+            f'{ERROR_HEADER_PREFIX}offset': str(message.offset),
+            f'{ERROR_HEADER_PREFIX}failed-at': repr(time.time()),
+        }
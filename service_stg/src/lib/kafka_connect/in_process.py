@@ -0,0 +1,48 @@
+import time
+from typing import Callable, Dict, Optional
+
+from lib.kafka_connect.kafka_connectors import KafkaMessage, KafkaProducer
+from lib.metrics import MESSAGES_PRODUCED
+
+
+class InProcessProducer:
+    """
+    Продюсер для совмещенного режима: вместо отправки в Kafka сразу передает сообщение
+    обработчику следующего слоя в том же процессе, без сериализации и без ожидания планировщика.
+    Если задан downstream, сообщение после успешной обработки дополнительно отправляется в промежуточный топик
+    для других потребителей.
+    Ошибка обработчика пробрасывается вызывающему процессору, и сообщение уходит в его retry/dead-letter маршрут.
+    Args:
+        topic: Имя шага для метрик и поля topic передаваемого сообщения
+        handler: Обработчик следующего слоя
+        downstream: Продюсер промежуточного топика (None - не отправлять)
+        on_flush: Вызывается в конце батча вызывающего процессора (запись агрегатов следующего слоя)
+    """
+
+    def __init__(self, topic: str, handler: Callable[[KafkaMessage], None],
+                 downstream: Optional[KafkaProducer] = None,
+                 on_flush: Optional[Callable[[], None]] = None) -> None:
+        self.topic = topic
+        self._handler = handler
+        self._downstream = downstream
+        self._on_flush = on_flush
+
+    def produce(self, payload: Dict, headers: Optional[Dict[str, str]] = None, key: Optional[str] = None) -> None:
+        self._handler(KafkaMessage(
+            value=payload,
+            headers=dict(headers or {}),
+            topic=self.topic,
+            timestamp=int(time.time() * 1000),
+            key=key
+        ))
+        # В промежуточный топик попадает только обработанное сообщение: если обработчик упал, повтор из retry
+        # отправит его заново, и копия от неудачной попытки была бы дублем.
+        if self._downstream:
+            self._downstream.produce(payload, headers=headers, key=key)
+        MESSAGES_PRODUCED.labels(self.topic).inc()
+
+    def flush(self) -> None:
+        if self._downstream:
+            self._downstream.flush()
+        if self._on_flush:
+            self._on_flush()
@@ -1,15 +1,75 @@
-import json
-from typing import Dict, Optional
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
-from confluent_kafka import Consumer, Producer
+from confluent_kafka import OFFSET_BEGINNING, Consumer, KafkaException, Producer, TopicPartition
+
+from lib.kafka_connect.wire_format import WireFormat
+from lib.metrics import (KAFKA_BACKPRESSURE_PAUSES, KAFKA_INFLIGHT_BYTES, KAFKA_REBALANCES, KAFKA_TRANSACTIONS,
+                         MESSAGES_PRODUCED)
 
 
 def error_callback(err):
     print('Something went wrong: {}'.format(err))
 
 
+@dataclass
+class KafkaMessage:
+    """
+    Прочитанное из Kafka сообщение вместе со служебной информацией.
+    Args:
+        value: Десериализованное тело сообщения
+        headers: Заголовки сообщения
+        topic: Топик, из которого прочитано сообщение
+        partition: Номер партиции
+        offset: Смещение сообщения в партиции
+        timestamp: Время создания сообщения в миллисекундах (None, если брокер его не передал)
+        size: Размер тела сообщения в байтах
+        key: Ключ сообщения (None, если сообщение отправлено без ключа)
+    """
+    value: Dict
+    headers: Dict[str, bytes] = field(default_factory=dict)
+    topic: str = ''
+    partition: int = -1
+    offset: int = -1
+    timestamp: Optional[int] = None
+    size: int = 0
+    key: Optional[str] = None
+
+
+def message_key(payload: Dict, key_field: str) -> Optional[str]:
+    """
+    Достает ключ сообщения по пути через точку, например payload.user.id.
+    Если поля нет, возвращает None: такое сообщение уйдет без ключа в произвольную партицию.
+    """
+    value = payload
+    for part in key_field.split('.'):
+        if not isinstance(value, dict) or value.get(part) is None:
+            return None
+        value = value[part]
+    return str(value)
+
+
 class KafkaProducer:
-    def __init__(self, host: str, port: int, user: str, password: str, topic: str, cert_path: str) -> None:
+    """
+    Продюсер топика. Если задан key_field, сообщения отправляются с ключом из этого поля:
+    все заказы одного пользователя попадают в одну партицию и читаются одним консьюмером группы по порядку.
+
+    Если задан transactional_id, продюсер транзакционный: сообщения батча отправляются без ожидания доставки
+    каждого внутри транзакции (begin_transaction), а offset консьюмера фиксируются в той же транзакции
+    (KafkaConsumer.commit(transaction=...)). Консьюмеры read_committed видят сообщения батча только после коммита
+    транзакции, и после падения батч не дублируется ни в топике, ни в offset. Продюсер с тем же transactional_id,
+    запущенный позже, отменяет незавершенную транзакцию предыдущего.
+    Args:
+        key_field: Путь к полю ключа через точку (пустая строка - без ключа)
+        wire_format: Формат сообщений (None - JSON)
+        compression: Сжатие батчей сообщений librdkafka: zstd, lz4, gzip, snappy (пустая строка - без сжатия)
+        transactional_id: Постоянный id транзакционного продюсера (пустая строка - без транзакций)
+        transaction_timeout_ms: Через сколько миллисекунд брокер отменяет незавершенную транзакцию
+    """
+
+    def __init__(self, host: str, port: int, user: str, password: str, topic: str, cert_path: str,
+                 key_field: str = '', wire_format: Optional[WireFormat] = None, compression: str = '',
+                 transactional_id: str = '', transaction_timeout_ms: int = 60000) -> None:
         params = {
             'bootstrap.servers': f'{host}:{port}',
             'security.protocol': 'SASL_SSL',
@@ -18,17 +78,186 @@ class KafkaProducer:
             'sasl.username': user,
             'sasl.password': password,
             'error_cb': error_callback,
+            # Тот же хэш ключа, что у Java-клиента: партиция ключа не зависит от языка продюсера.
+            'partitioner': 'murmur2_random',
         }
+        # Сжимается батч сообщений целиком: повторяющиеся между заказами строки (имена, категории)
+        # сжимаются лучше, чем в каждом сообщении отдельно. Консьюмер распаковывает батч сам.
+        if compression:
+            params['compression.type'] = compression
+        # transactional.id включает идемпотентность продюсера: повторная отправка не дублирует сообщения.
+        if transactional_id:
+            params['transactional.id'] = transactional_id
+            params['transaction.timeout.ms'] = transaction_timeout_ms
 
         self.topic = topic
+        self.wire_format = wire_format or WireFormat()
+        self.key_field = key_field
+        self.transactional = bool(transactional_id)
+        self._params = params
+        self._in_transaction = False
+        self._initialized = False
         self.p = Producer(params)
+        if self.transactional:
+            self._init_transactions()
+
+    def produce(self, payload: Dict, headers: Optional[Dict[str, str]] = None, key: Optional[str] = None) -> None:
+        """
+        Отправляет сообщение. Явно переданный key важнее key_field (так retry сохраняет ключ исходного сообщения).
+        """
+        if key is None and self.key_field:
+            key = message_key(payload, self.key_field)
+        value, headers = self.wire_format.encode(payload, headers)
+        self.send(self.topic, value, key, headers)
+
+    def send(self, topic: str, value: bytes, key: Optional[str], headers) -> None:
+        """
+        Отправляет уже сериализованное сообщение в topic. У транзакционного продюсера - в текущей транзакции.
+        """
+        while True:
+            try:
+                self.p.produce(topic, value, key=key, headers=headers)
+                break
+            except BufferError:
+                # Очередь продюсера заполнена: ждем доставки части сообщений.
+                self.p.poll(1)
+        if self.transactional:
+            # Доставка сообщений транзакции проверяется при ее коммите.
+            self.p.poll(0)
+        else:
+            self.p.flush(10)
+        MESSAGES_PRODUCED.labels(topic).inc()
+
+    def for_topic(self, topic: str) -> 'TopicProducer':
+        """
+        Продюсер другого топика поверх этого: у транзакционного продюсера сообщения попадают в его транзакцию.
+        """
+        return TopicProducer(self, topic)
+
+    def flush(self, timeout: float = 10) -> None:
+        self.p.flush(timeout)
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._in_transaction
 
-    def produce(self, payload: Dict) -> None:
-        self.p.produce(self.topic, json.dumps(payload))
-        self.p.flush(10)
+    def begin_transaction(self) -> None:
+        """
+        Начинает транзакцию, если она еще не начата. Без транзакции транзакционный продюсер не отправляет сообщения.
+        """
+        if self._in_transaction:
+            return
+        if not self._initialized:
+            self._init_transactions()
+        try:
+            self.p.begin_transaction()
+        except KafkaException as e:
+            if e.args[0].fatal():
+                self._recreate()
+            raise
+        self._in_transaction = True
+
+    def commit_transaction(self, offsets: List[TopicPartition], group_metadata, timeout: float = 30) -> None:
+        """
+        Фиксирует offset консьюмера в текущей транзакции и коммитит ее вместе с отправленными сообщениями.
+        Если коммит не удался, транзакция отменяется и ошибка пробрасывается.
+        """
+        try:
+            if offsets:
+                self.p.send_offsets_to_transaction(offsets, group_metadata, timeout)
+            self.p.commit_transaction(timeout)
+        except KafkaException:
+            KAFKA_TRANSACTIONS.labels(self.topic, 'failed').inc()
+            self.abort_transaction(timeout)
+            raise
+        self._in_transaction = False
+        KAFKA_TRANSACTIONS.labels(self.topic, 'committed').inc()
+
+    def abort_transaction(self, timeout: float = 30) -> None:
+        """
+        Отменяет текущую транзакцию: ее сообщения не увидит ни один консьюмер read_committed.
+        Если отменить не удалось (фатальная ошибка продюсера, например его вытеснил продюсер с тем же
+        transactional_id, или брокер недоступен), продюсер пересоздается: инициализация нового с тем же
+        transactional_id отменяет незавершенную транзакцию.
+        """
+        if not self._in_transaction:
+            return
+        self._in_transaction = False
+        KAFKA_TRANSACTIONS.labels(self.topic, 'aborted').inc()
+        try:
+            self.p.abort_transaction(timeout)
+        except KafkaException as e:
+            print('Abort transaction failed, recreating producer: {}'.format(e))
+            self._recreate()
+
+    def _init_transactions(self) -> None:
+        self.p.init_transactions(30)
+        self._initialized = True
+
+    def _recreate(self) -> None:
+        KAFKA_TRANSACTIONS.labels(self.topic, 'recreated').inc()
+        try:
+            self.p.purge()
+        except KafkaException:
+            pass
+        self.p = Producer(self._params)
+        self._initialized = False
+        # Если брокер недоступен, инициализация повторится в следующем begin_transaction.
+        try:
+            self._init_transactions()
+        except KafkaException as e:
+            print('Init transactions failed: {}'.format(e))
+
+
+class TopicProducer:
+    """
+    Отправка в другой топик через KafkaProducer (for_topic): так сообщения retry- и dead-letter маршрутов
+    попадают в транзакцию батча и отменяются вместе с ней. Формат - JSON, без ключевого поля.
+    """
+
+    def __init__(self, producer: KafkaProducer, topic: str) -> None:
+        self.topic = topic
+        self.wire_format = WireFormat()
+        self._producer = producer
+
+    def produce(self, payload: Dict, headers: Optional[Dict[str, str]] = None, key: Optional[str] = None) -> None:
+        value, headers = self.wire_format.encode(payload, headers)
+        self._producer.send(self.topic, value, key, headers)
+
+    def flush(self, timeout: float = 10) -> None:
+        self._producer.flush(timeout)
 
 
 class KafkaConsumer:
+    """
+    Консьюмер топика в группе.
+
+    Партиции распределяются стратегией cooperative-sticky: при ребалансировке отзываются только переезжающие
+    партиции, остальные консьюмеры группы продолжают чтение. Если задан instance_id, консьюмер - статический
+    участник группы (group.instance.id): перезапуск, уложившийся в session_timeout_ms, не вызывает ребалансировку,
+    и консьюмер получает те же партиции. Перед отзывом партиций вызываются обработчики on_revoke (процессор
+    дописывает накопленное за батч), после чего фиксируются offset отзываемых партиций, поэтому новый владелец
+    не получает уже обработанные сообщения повторно.
+
+    Память консьюмера ограничивается с двух сторон. fetch_max_bytes и queued_max_kbytes ограничивают ответ брокера
+    и очередь предзагруженных librdkafka сообщений. max_inflight_bytes ограничивает объем прочитанных, но еще
+    не зафиксированных сообщений: партиция, превысившая свою долю лимита (лимит, деленный на число назначенных
+    партиций), приостанавливается, остальные читаются дальше; при превышении общего лимита приостанавливаются все,
+    и consume_message сразу возвращает None - процессор заканчивает батч. После commit чтение возобновляется.
+
+    Консьюмер читает с isolation.level=read_committed: сообщения транзакционного продюсера видны после коммита
+    транзакции, сообщения отмененной транзакции пропускаются.
+    Args:
+        wire_format: Формат сообщений (None - JSON)
+        subscribe: Подписаться на топик (False - партиции назначаются вручную через assign)
+        instance_id: Постоянный id участника группы, например имя пода (пустая строка - динамическое членство)
+        session_timeout_ms: Через сколько миллисекунд без heartbeat участник считается выбывшим
+        fetch_max_bytes: Максимальный объем одного ответа брокера на fetch (0 - по умолчанию librdkafka)
+        queued_max_kbytes: Объем очереди предзагруженных сообщений в килобайтах (0 - по умолчанию librdkafka)
+        max_inflight_bytes: Лимит объема прочитанных и не зафиксированных сообщений (0 - без лимита);
+            для консьюмера без commit (переигрывание) не задается
+    """
+
     def __init__(self,
                  host: str,
                  port: int,
@@ -36,7 +265,15 @@ class KafkaConsumer:
                  password: str,
                  topic: str,
                  group: str,
-                 cert_path: str
+                 cert_path: str,
+                 debug: str = '',
+                 wire_format: Optional[WireFormat] = None,
+                 subscribe: bool = True,
+                 instance_id: str = '',
+                 session_timeout_ms: int = 45000,
+                 fetch_max_bytes: int = 0,
+                 queued_max_kbytes: int = 0,
+                 max_inflight_bytes: int = 0
                  ) -> None:
         params = {
             'bootstrap.servers': f'{host}:{port}',
@@ -49,19 +286,238 @@ class KafkaConsumer:
             'auto.offset.reset': 'earliest',
             'enable.auto.commit': False,
             'error_cb': error_callback,
-            'debug': 'all',
-            'client.id': 'someclientkey'
+            'client.id': instance_id or group,
+            'partition.assignment.strategy': 'cooperative-sticky',
+            'session.timeout.ms': session_timeout_ms,
+            'isolation.level': 'read_committed',
         }
+        if instance_id:
+            params['group.instance.id'] = instance_id
+        # librdkafka требует fetch.max.bytes не меньше message.max.bytes (1000000 по умолчанию).
+        if fetch_max_bytes:
+            params['fetch.max.bytes'] = fetch_max_bytes
+        if queued_max_kbytes:
+            params['queued.max.messages.kbytes'] = queued_max_kbytes
+        # Отладочный вывод librdkafka очень объемный, поэтому включается только явно,
+        # например debug='consumer,cgrp,topic,fetch'.
+        if debug:
+            params['debug'] = debug
 
         self.topic = topic
+        # Формат каждого сообщения определяется по его заголовку content-type, настройка консьюмера
+        # нужна только для реестра схем.
+        self.wire_format = wire_format or WireFormat()
+        self._revoke_handlers: List[Callable[[], None]] = []
+        # Объем прочитанных и не зафиксированных сообщений по партициям и приостановленные из-за него партиции.
+        self._max_inflight_bytes = max_inflight_bytes
+        self._inflight: Dict[int, int] = {}
+        self._throttled: Set[int] = set()
         self.c = Consumer(params)
-        self.c.subscribe([topic])
+        # Без подписки партиции назначаются вручную через assign (например, при переигрывании топика),
+        # и консьюмер не участвует в ребалансировке группы.
+        if subscribe:
+            self.c.subscribe([topic], on_assign=self._on_assign, on_revoke=self._on_revoke, on_lost=self._on_lost)
+
+    def on_revoke(self, handler: Callable[[], None]) -> None:
+        """
+        Регистрирует обработчик, который вызывается перед отзывом партиций, до фиксации их offset.
+        Обработчики вызываются внутри poll, в потоке, который читает сообщения.
+        """
+        self._revoke_handlers.append(handler)
+
+    def _on_assign(self, consumer: Consumer, partitions: List[TopicPartition]) -> None:
+        KAFKA_REBALANCES.labels(self.topic, 'assign').inc()
+
+    def _on_revoke(self, consumer: Consumer, partitions: List[TopicPartition]) -> None:
+        KAFKA_REBALANCES.labels(self.topic, 'revoke').inc()
+        self._forget(partitions)
+        try:
+            for handler in self._revoke_handlers:
+                handler()
+        except Exception as e:
+            # Накопленное не записано: offset не фиксируем, новый владелец перечитает сообщения.
+            print('Revoke handler failed, offsets are not committed: {}'.format(e))
+            return
+        offsets = [tp for tp in consumer.position(partitions) if tp.offset >= 0]
+        if offsets:
+            try:
+                consumer.commit(offsets=offsets, asynchronous=False)
+            except KafkaException as e:
+                print('Commit on revoke failed: {}'.format(e))
+
+    def _on_lost(self, consumer: Consumer, partitions: List[TopicPartition]) -> None:
+        # Партиции уже принадлежат другому участнику: накопленное дописываем, но offset не фиксируем.
+        KAFKA_REBALANCES.labels(self.topic, 'lost').inc()
+        self._forget(partitions)
+        try:
+            for handler in self._revoke_handlers:
+                handler()
+        except Exception as e:
+            print('Revoke handler failed: {}'.format(e))
 
     def consume(self, timeout: float = 3.0) -> Optional[Dict]:
+        message = self.consume_message(timeout)
+        if not message:
+            return None
+        return message.value
+
+    def consume_message(self, timeout: float = 3.0) -> Optional[KafkaMessage]:
+        """
+        Читает одно сообщение и возвращает его вместе с заголовками и положением в топике.
+        Если исчерпан лимит max_inflight_bytes, сразу возвращает None.
+        """
+        if self._max_inflight_bytes and sum(self._inflight.values()) >= self._max_inflight_bytes:
+            return None
         msg = self.c.poll(timeout=timeout)
         if not msg:
             return None
         if msg.error():
             raise Exception(msg.error())
-        val = msg.value().decode()
-        return json.loads(val)
+        raw = msg.value()
+        key = msg.key()
+        headers = {k: v for k, v in (msg.headers() or [])}
+        timestamp_type, timestamp = msg.timestamp()
+        if self._max_inflight_bytes:
+            self._track(msg.partition(), len(raw))
+        return KafkaMessage(
+            value=self.wire_format.decode(raw, headers),
+            headers=headers,
+            topic=msg.topic(),
+            partition=msg.partition(),
+            offset=msg.offset(),
+            timestamp=timestamp if timestamp_type else None,
+            size=len(raw),
+            key=key.decode() if key is not None else None
+        )
+
+    def seek(self, message: KafkaMessage) -> None:
+        """
+        Возвращает позицию партиции на указанное сообщение: следующий poll прочитает его снова.
+        """
+        self.c.seek(TopicPartition(message.topic, message.partition, message.offset))
+        # Сообщение будет прочитано снова и учтено еще раз.
+        if message.partition in self._inflight:
+            self._inflight[message.partition] = max(self._inflight[message.partition] - message.size, 0)
+
+    def commit(self, transaction: Optional[KafkaProducer] = None) -> None:
+        """
+        Синхронно фиксирует текущие позиции консьюмера по всем назначенным партициям.
+        Если передан транзакционный продюсер, позиции фиксируются в его текущей транзакции, и транзакция
+        коммитится: отправленные за батч сообщения и offset прочитанных становятся видны одновременно.
+        Прочитанные сообщения больше не считаются необработанными, приостановленные партиции возобновляются.
+        """
+        # Фиксируются именно позиции, а не сохраненные librdkafka offset: после seek назад (retry-сообщение,
+        # время которого не наступило) сохраненный offset может быть уже за этим сообщением.
+        offsets = [tp for tp in self.c.position(self.c.assignment()) if tp.offset >= 0]
+        if transaction is not None:
+            transaction.commit_transaction(offsets, self.c.consumer_group_metadata())
+        elif offsets:
+            self.c.commit(offsets=offsets, asynchronous=False)
+        self._release()
+
+    def rewind(self) -> None:
+        """
+        Возвращает назначенные партиции на зафиксированные offset (без зафиксированного offset - в начало):
+        сообщения после них будут прочитаны снова. Нужен после отмены транзакции батча.
+        """
+        assignment = self.c.assignment()
+        for tp in self.c.committed(assignment, timeout=10):
+            if tp.offset < 0:
+                tp.offset = OFFSET_BEGINNING
+            self.c.seek(tp)
+        self._release()
+
+    def _track(self, partition: int, size: int) -> None:
+        self._inflight[partition] = self._inflight.get(partition, 0) + size
+        total = sum(self._inflight.values())
+        KAFKA_INFLIGHT_BYTES.labels(self.topic).set(total)
+        if total >= self._max_inflight_bytes:
+            throttle = [tp.partition for tp in self.c.assignment() if tp.topic == self.topic]
+        elif self._inflight[partition] * max(len(self.c.assignment()), 1) >= self._max_inflight_bytes:
+            throttle = [partition]
+        else:
+            return
+        throttle = [p for p in throttle if p not in self._throttled]
+        if throttle:
+            self.c.pause([TopicPartition(self.topic, p) for p in throttle])
+            self._throttled.update(throttle)
+            KAFKA_BACKPRESSURE_PAUSES.labels(self.topic).inc(len(throttle))
+
+    def _release(self) -> None:
+        self._inflight.clear()
+        KAFKA_INFLIGHT_BYTES.labels(self.topic).set(0)
+        if self._throttled:
+            self.c.resume([TopicPartition(self.topic, p) for p in self._throttled])
+            self._throttled.clear()
+
+    def _forget(self, partitions: List[TopicPartition]) -> None:
+        for tp in partitions:
+            if tp.topic == self.topic:
+                self._inflight.pop(tp.partition, None)
+                self._throttled.discard(tp.partition)
+
+    def assigned_partitions(self) -> List[int]:
+        """
+        Номера партиций топика, назначенных консьюмеру группой. Пока сообщения ключуются по пользователю,
+        пользователи этих партиций обрабатываются только этим консьюмером, и их состояние можно держать в памяти.
+        """
+        return sorted(tp.partition for tp in self.c.assignment() if tp.topic == self.topic)
+
+    def partitions(self, timeout: float = 10) -> List[int]:
+        """
+        Номера всех партиций топика по метаданным брокера.
+        """
+        metadata = self.c.list_topics(self.topic, timeout=timeout).topics[self.topic]
+        if metadata.error:
+            raise KafkaException(metadata.error)
+        return sorted(metadata.partitions)
+
+    def watermarks(self, partitions: List[int], timeout: float = 10) -> Dict[int, Tuple[int, int]]:
+        """
+        Первый offset и offset следующего сообщения (high watermark) каждой партиции.
+        """
+        return {p: self.c.get_watermark_offsets(TopicPartition(self.topic, p), timeout=timeout)
+                for p in partitions}
+
+    def offsets_for_times(self, partitions: List[int], timestamp: int, timeout: float = 10) -> Dict[int, int]:
+        """
+        Offset первого сообщения каждой партиции со временем не раньше timestamp (в миллисекундах).
+        Если таких сообщений нет, возвращается -1.
+        """
+        result = self.c.offsets_for_times([TopicPartition(self.topic, p, timestamp) for p in partitions],
+                                          timeout=timeout)
+        return {tp.partition: tp.offset for tp in result}
+
+    def assign(self, offsets: Dict[int, int]) -> None:
+        """
+        Назначает консьюмеру партиции топика и начинает чтение каждой с указанного offset.
+        """
+        self.c.assign([TopicPartition(self.topic, p, offset) for p, offset in offsets.items()])
+
+    def pause(self, partitions: List[int]) -> None:
+        self.c.pause([TopicPartition(self.topic, p) for p in partitions])
+
+    def positions(self) -> Dict[int, int]:
+        """
+        Offset следующего сообщения, которое консьюмер прочитает из каждой назначенной партиции (-1 - еще не читал).
+        """
+        return {tp.partition: tp.offset for tp in self.c.position(self.c.assignment()) if tp.topic == self.topic}
+
+    def lag(self) -> Dict[int, int]:
+        """
+        Возвращает отставание консьюмера по каждой назначенной ему партиции.
+        Верхняя граница партиции берется из кэша librdkafka, который обновляется при каждом fetch,
+        поэтому метод не делает лишних запросов к брокеру.
+        """
+        result = {}
+        assignment = self.c.assignment()
+        if not assignment:
+            return result
+
+        for tp in self.c.position(assignment):
+            low, high = self.c.get_watermark_offsets(tp, cached=True)
+            if high < 0:
+                continue
+            offset = tp.offset if tp.offset >= 0 else low
+            result[tp.partition] = max(high - offset, 0)
+        return result
@@ -0,0 +1,190 @@
+import argparse
+import time
+from datetime import datetime, timezone
+from logging import Logger
+from typing import Dict, List, Optional, Tuple
+
+from lib.kafka_connect.failure_handler import FailureHandler
+from lib.kafka_connect.kafka_connectors import KafkaConsumer
+from lib.log import BatchStats, StructuredLogger
+from lib.metrics import MESSAGES_CONSUMED, MESSAGES_FAILED
+
+
+def parse_timestamp(value: str) -> int:
+    """
+    Дата и время в ISO-формате (без часового пояса - UTC) или число миллисекунд -> миллисекунды Unix.
+    """
+    if value.isdigit():
+        return int(value)
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def add_replay_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Общие аргументы команды replay.py всех сервисов.
+    """
+    parser.add_argument('--topic', help='Топик (по умолчанию KAFKA_SOURCE_TOPIC сервиса)')
+    parser.add_argument('--partition', type=int, action='append', help='Партиция; можно указать несколько раз')
+    parser.add_argument('--from-timestamp', type=parse_timestamp,
+                        help='Начать с первого сообщения не раньше этого времени (ISO, UTC, или миллисекунды)')
+    parser.add_argument('--to-timestamp', type=parse_timestamp,
+                        help='Остановиться перед первым сообщением не раньше этого времени')
+    parser.add_argument('--from-offset', type=int, help='Начальный offset в каждой партиции')
+    parser.add_argument('--to-offset', type=int, help='Последний offset в каждой партиции (включительно)')
+    parser.add_argument('--rate', type=float, default=0, help='Сообщений в секунду (0 - без ограничения)')
+    parser.add_argument('--batch-size', type=int, default=100, help='Сообщений между вызовами flush процессора')
+    parser.add_argument('--route-failures', action='store_true',
+                        help='Отправлять ошибочные сообщения в retry/dead-letter топики сервиса, а не только в лог')
+    parser.add_argument('--dry-run', action='store_true', help='Только показать диапазоны offset по партициям')
+
+
+class KafkaReplay:
+    """
+    Переигрывание диапазона топика через процессор сервиса без сброса offset консьюмер-группы.
+
+    Консьюмер создается без подписки (subscribe=False), партиции назначаются вручную, offset не фиксируются,
+    поэтому живой консьюмер группы продолжает работать как обычно. Диапазон каждой партиции вычисляется
+    заранее: начало - по времени (offsets_for_times) или offset, конец - по времени, offset или high watermark
+    на момент старта, так что переигрывание заканчивается, даже если в топик продолжают писать.
+    Скорость ограничивается rate_limit сообщений в секунду, чтобы не отнимать ресурсы у живого трафика.
+    Args:
+        consumer: Консьюмер топика без подписки
+        processor: Процессор сервиса: process(message) обрабатывает сообщение, flush() записывает накопленное
+        logger: Логгер
+        rate_limit: Сообщений в секунду (0 - без ограничения)
+        batch_size: Сообщений между вызовами flush
+        failure_handler: Маршрутизация ошибочных сообщений в retry/dead-letter (None - только лог)
+        idle_timeout: Секунд без сообщений, после которых переигрывание останавливается
+    """
+
+    def __init__(self,
+                 consumer: KafkaConsumer,
+                 processor,
+                 logger: Logger,
+                 rate_limit: float = 0,
+                 batch_size: int = 100,
+                 failure_handler: Optional[FailureHandler] = None,
+                 idle_timeout: float = 60) -> None:
+        self._consumer = consumer
+        self._processor = processor
+        self._logger = StructuredLogger(logger)
+        self._rate_limit = rate_limit
+        self._batch_size = batch_size
+        self._failures = failure_handler
+        self._idle_timeout = idle_timeout
+
+    def plan(self,
+             partitions: Optional[List[int]] = None,
+             from_timestamp: Optional[int] = None,
+             to_timestamp: Optional[int] = None,
+             from_offset: Optional[int] = None,
+             to_offset: Optional[int] = None) -> Dict[int, Tuple[int, int]]:
+        """
+        Диапазоны [начало, конец) offset по партициям. Пустые диапазоны не возвращаются.
+        """
+        partitions = partitions or self._consumer.partitions()
+        watermarks = self._consumer.watermarks(partitions)
+        start = {p: low for p, (low, _) in watermarks.items()}
+        end = {p: high for p, (_, high) in watermarks.items()}
+
+        if from_timestamp is not None:
+            for p, offset in self._consumer.offsets_for_times(partitions, from_timestamp).items():
+                start[p] = offset if offset >= 0 else end[p]
+        if from_offset is not None:
+            start = {p: max(offset, from_offset) for p, offset in start.items()}
+        if to_timestamp is not None:
+            for p, offset in self._consumer.offsets_for_times(partitions, to_timestamp).items():
+                if offset >= 0:
+                    end[p] = min(end[p], offset)
+        if to_offset is not None:
+            end = {p: min(offset, to_offset + 1) for p, offset in end.items()}
+
+        return {p: (start[p], end[p]) for p in partitions if start[p] < end[p]}
+
+    def run(self, plan: Dict[int, Tuple[int, int]]) -> Dict:
+        stats = BatchStats()
+        if not plan:
+            self._logger.info('Переигрывать нечего', topic=self._consumer.topic)
+            return stats.fields()
+
+        self._logger.info('Переигрывание начато', topic=self._consumer.topic,
+                          partitions={p: list(r) for p, r in plan.items()}, rate=self._rate_limit)
+        remaining = {p: end for p, (_, end) in plan.items()}
+        self._consumer.assign({p: start for p, (start, _) in plan.items()})
+
+        interval = 1 / self._rate_limit if self._rate_limit > 0 else 0
+        next_at = time.monotonic()
+        unflushed = 0
+        idle_since = time.monotonic()
+        while remaining:
+            message = self._consumer.consume_message(timeout=1.0)
+            if message is None:
+                # Конец диапазона может прийтись на запись без сообщения (маркер транзакции, удаленная compaction):
+                # сверяем позиции консьюмера с концом диапазона.
+                for p, position in self._consumer.positions().items():
+                    if p in remaining and position >= remaining[p]:
+                        self._finish(remaining, p)
+                if remaining and time.monotonic() - idle_since > self._idle_timeout:
+                    self._logger.warning('Переигрывание остановлено: нет новых сообщений',
+                                         topic=self._consumer.topic, positions=self._consumer.positions())
+                    break
+                continue
+            idle_since = time.monotonic()
+
+            end = remaining.get(message.partition)
+            if end is None or message.offset >= end:
+                self._finish(remaining, message.partition)
+                continue
+
+            if interval:
+                now = time.monotonic()
+                if next_at > now:
+                    time.sleep(next_at - now)
+                # После паузы (например, долгого flush) не навёрстываем пачкой, а продолжаем в заданном темпе.
+                next_at = max(next_at, now) + interval
+
+            stats.consumed += 1
+            MESSAGES_CONSUMED.labels(message.topic).inc()
+            try:
+                self._processor.process(message)
+                stats.produced += 1
+            except Exception as e:
+                stats.failed += 1
+                MESSAGES_FAILED.labels(message.topic).inc()
+                route = self._failures.handle(message, e) if self._failures else 'log'
+                self._logger.error('Ошибка при переигрывании сообщения', partition=message.partition,
+                                   offset=message.offset, error=repr(e), route=route)
+
+            unflushed += 1
+            if unflushed >= self._batch_size:
+                self._processor.flush()
+                unflushed = 0
+            if message.offset + 1 >= end:
+                self._finish(remaining, message.partition)
+
+        self._processor.flush()
+        result = stats.fields()
+        self._logger.info('Переигрывание завершено', topic=self._consumer.topic, **result)
+        return result
+
+    def _finish(self, remaining: Dict[int, int], partition: int) -> None:
+        if remaining.pop(partition, None) is not None:
+            self._consumer.pause([partition])
+
+
+def replay_from_args(args: argparse.Namespace, consumer: KafkaConsumer, processor, logger: Logger,
+                     failure_handler: Optional[FailureHandler] = None) -> Dict:
+    """
+    Запуск переигрывания по аргументам add_replay_arguments. С --dry-run возвращает только диапазоны.
+    """
+    replay = KafkaReplay(consumer, processor, logger, args.rate, args.batch_size,
+                         failure_handler if args.route_failures else None)
+    plan = replay.plan(args.partition, args.from_timestamp, args.to_timestamp, args.from_offset, args.to_offset)
+    if args.dry_run:
+        for partition, (start, end) in sorted(plan.items()):
+            logger.info(f'{consumer.topic}[{partition}]: offset {start}..{end - 1}, сообщений {end - start}')
+        return {'plan': plan}
+    return replay.run(plan)
@@ -0,0 +1,150 @@
+from typing import Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Метрики объявлены на уровне модуля, так как prometheus_client хранит их в глобальном реестре.
+# Метрики с метками не попадают в выдачу /metrics, пока сервис ни разу их не использовал,
+# поэтому один и тот же модуль можно держать во всех сервисах.
+
+MESSAGES_CONSUMED = Counter(
+    'messages_consumed_total',
+    'Количество сообщений, прочитанных из Kafka',
+    ['topic'])
+
+MESSAGES_PRODUCED = Counter(
+    'messages_produced_total',
+    'Количество сообщений, отправленных в Kafka',
+    ['topic'])
+
+MESSAGES_FAILED = Counter(
+    'messages_failed_total',
+    'Количество сообщений, обработка которых завершилась ошибкой',
+    ['topic'])
+
+MESSAGES_RETRIED = Counter(
+    'messages_retried_total',
+    'Количество сообщений, отправленных в retry-топик после временной ошибки',
+    ['topic'])
+
+MESSAGES_DEAD_LETTERED = Counter(
+    'messages_dead_lettered_total',
+    'Количество сообщений, отправленных в dead-letter топик',
+    ['topic'])
+
+BATCH_DURATION = Histogram(
+    'batch_duration_seconds',
+    'Длительность обработки одного батча сообщений',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+
+DB_UPSERT_LATENCY = Histogram(
+    'db_upsert_duration_seconds',
+    'Длительность вставки данных в таблицу Postgres',
+    ['table'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+
+DB_PIPELINE_LATENCY = Histogram(
+    'db_pipeline_duration_seconds',
+    'Длительность транзакции сообщения в режиме pipeline libpq: от первого запроса до коммита',
+    ['repository'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+
+DB_PIPELINE_TABLE_LATENCY = Histogram(
+    'db_pipeline_table_duration_seconds',
+    'Длительность транзакции pipeline, в которой писалась таблица (замена db_upsert_duration_seconds в pipeline)',
+    ['repository', 'table'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+
+DB_PIPELINE_STATEMENTS = Histogram(
+    'db_pipeline_statements',
+    'Число запросов в одной транзакции pipeline',
+    ['repository'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200))
+
+REDIS_LATENCY = Histogram(
+    'redis_request_duration_seconds',
+    'Длительность запроса к Redis',
+    ['command'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+
+REDIS_LOOKUPS = Counter(
+    'redis_lookups_total',
+    'Количество поисков в Redis по результату (hit - ключ найден, miss - нет)',
+    ['result'])
+
+DIMENSION_LOOKUPS = Counter(
+    'dimension_store_lookups_total',
+    'Количество чтений локального снимка документов Redis '
+    '(local - из памяти, snapshot - из файла снимка, remote - запрос в Redis)',
+    ['result'])
+
+DIMENSION_INVALIDATIONS = Counter(
+    'dimension_store_invalidations_total',
+    'Количество документов, сброшенных из локального снимка по keyspace-уведомлениям Redis')
+
+DIMENSION_DOCUMENTS = Gauge(
+    'dimension_store_documents',
+    'Количество документов в локальном снимке Redis')
+
+TOPK_LOOKUPS = Counter(
+    'topk_index_lookups_total',
+    'Количество запросов топов пользователя (memory - из индекса в памяти, table - загрузка из витрин)',
+    ['result'])
+
+TOPK_ENTRIES = Gauge(
+    'topk_index_entries',
+    'Количество записей счетчиков пользователей в индексе топов')
+
+KAFKA_REBALANCES = Counter(
+    'kafka_rebalances_total',
+    'Количество событий ребалансировки консьюмер-группы (assign, revoke, lost)',
+    ['topic', 'event'])
+
+KAFKA_INFLIGHT_BYTES = Gauge(
+    'kafka_inflight_bytes',
+    'Объем прочитанных, но еще не зафиксированных сообщений консьюмера в байтах',
+    ['topic'])
+
+KAFKA_BACKPRESSURE_PAUSES = Counter(
+    'kafka_backpressure_pauses_total',
+    'Количество приостановок чтения партиций из-за превышения лимита объема необработанных сообщений',
+    ['topic'])
+
+KAFKA_TRANSACTIONS = Counter(
+    'kafka_transactions_total',
+    'Транзакции продюсера по результату (committed, aborted, failed) и пересоздания продюсера (recreated)',
+    ['topic', 'result'])
+
+KNOWN_KEYS_LOOKUPS = Counter(
+    'dds_known_keys_lookups_total',
+    'Проверки ключей справочных строк DDS перед вставкой (hit - строка уже в базе, вставка пропущена)',
+    ['result'])
+
+SNAPSHOT_LOADS = Counter(
+    'snapshot_loads_total',
+    'Загрузки локальных снимков кэшей при старте по результату (loaded, missing, version, stale, corrupt)',
+    ['kind', 'result'])
+
+CONSUMER_LAG = Gauge(
+    'kafka_consumer_lag',
+    'Отставание консьюмера от конца партиции в сообщениях',
+    ['topic', 'partition'])
+
+PIPELINE_HOP_LATENCY = Histogram(
+    'pipeline_hop_latency_seconds',
+    'Время от передачи заказа предыдущим слоем до завершения его обработки текущим слоем',
+    ['stage'],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 25, 50, 75, 100, 150, 300, 600))
+
+PIPELINE_E2E_LATENCY = Histogram(
+    'pipeline_end_to_end_latency_seconds',
+    'Время от появления заказа в исходном топике до завершения его обработки текущим слоем',
+    ['stage'],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 25, 50, 75, 100, 150, 300, 600, 1200))
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Возвращает текущие значения всех метрик в текстовом формате Prometheus
+    и соответствующий Content-Type.
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,166 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from typing import Callable, Dict, Optional
+
+MODES = ('sampling', 'cprofile')
+
+
+class _StackSampler(threading.Thread):
+    """
+    Периодически снимает стек потока, в котором выполняется батч, и считает одинаковые стеки.
+    Результат - collapsed stacks, которые понимают flamegraph.pl и speedscope.
+    """
+
+    def __init__(self, thread_id: int, interval: float, stacks: Counter) -> None:
+        super().__init__(daemon=True)
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stacks = stacks
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            self._stacks[';'.join(reversed(names))] += 1
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+class BatchProfiler:
+    """
+    Профилирование следующих N вызовов обернутых функций процессора (run и run_retries) по запросу.
+    Пока профилирование не включено, обертка стоит одну проверку счетчика на батч.
+    Каждый батч профилируется отдельно и добавляется в результат после завершения, поэтому отчет
+    содержит только завершенные батчи и не зависит от профилируемых в этот момент потоков.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._mode = 'sampling'
+        self._interval = 0.005
+        self._batches = 0
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+        self._stats: Optional[pstats.Stats] = None
+        self._stacks: Counter = Counter()
+
+    def wrap(self, func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self._remaining:
+                return func(*args, **kwargs)
+            return self._call_profiled(func, args, kwargs)
+        return wrapper
+
+    def start(self, batches: int, mode: str = 'sampling', interval: float = 0.005) -> None:
+        """
+        Включает профилирование для следующих batches батчей. Предыдущий результат сбрасывается.
+        Args:
+            batches: Количество батчей, которые нужно профилировать
+            mode: sampling - сэмплирование стеков, cprofile - детерминированный cProfile
+            interval: Интервал сэмплирования стеков в секундах
+        """
+        if mode not in MODES:
+            raise ValueError(f'Неизвестный режим профилирования: {mode}')
+        if batches <= 0:
+            raise ValueError('Количество батчей должно быть положительным')
+        with self._lock:
+            self._mode = mode
+            self._interval = interval
+            self._batches = 0
+            self._started = time.time()
+            self._finished = None
+            self._stats = None
+            self._stacks = Counter()
+            self._remaining = batches
+
+    def _call_profiled(self, func: Callable, args, kwargs):
+        stacks: Counter = Counter()
+        sampler = _StackSampler(threading.get_ident(), self._interval, stacks)
+        sampler.start()
+        profile = cProfile.Profile() if self._mode == 'cprofile' else None
+        if profile is not None:
+            profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if profile is not None:
+                profile.create_stats()
+            sampler.stop()
+            with self._lock:
+                self._stacks.update(stacks)
+                # Пустой профиль pstats не принимает.
+                if profile is not None and profile.stats:
+                    if self._stats is None:
+                        self._stats = pstats.Stats(profile)
+                    else:
+                        self._stats.add(profile)
+                self._batches += 1
+                self._remaining = max(self._remaining - 1, 0)
+                if not self._remaining:
+                    self._finished = time.time()
+
+    def status(self) -> Dict:
+        return {
+            'active': bool(self._remaining),
+            'mode': self._mode,
+            'remaining_batches': self._remaining,
+            'profiled_batches': self._batches,
+            'started': self._started,
+            'finished': self._finished,
+        }
+
+    def collapsed(self) -> str:
+        """
+        Стеки в формате collapsed: "frame;frame;frame count" на строку.
+        """
+        with self._lock:
+            stacks = self._stacks.most_common()
+        return '\n'.join(f'{stack} {count}' for stack, count in stacks)
+
+    def report(self, top: int = 50) -> str:
+        """
+        Агрегированный профиль завершенных батчей: статистика cProfile либо самые частые функции по сэмплам.
+        Пока ни один батч не завершен, возвращает пустую строку.
+        """
+        with self._lock:
+            if self._mode == 'cprofile':
+                if self._stats is None:
+                    return ''
+                out = io.StringIO()
+                self._stats.stream = out
+                self._stats.sort_stats('cumulative').print_stats(top)
+                return out.getvalue()
+            stacks = dict(self._stacks)
+
+        total = sum(stacks.values())
+        if not total:
+            return ''
+        own, inclusive = Counter(), Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+
+        lines = [f'samples: {total}', f'{"own %":>7} {"total %":>8}  function']
+        for frame, count in own.most_common(top):
+            lines.append(f'{100 * count / total:7.1f} {100 * inclusive[frame] / total:8.1f}  {frame}')
+        return '\n'.join(lines)
@@ -0,0 +1,189 @@
+import json
+import threading
+import time
+from logging import Logger
+from typing import Dict, Optional
+
+from lib.metrics import DIMENSION_DOCUMENTS, DIMENSION_INVALIDATIONS, DIMENSION_LOOKUPS
+from lib.redis.redis_client import RedisClient
+from lib.snapshot import SnapshotReader, write_snapshot
+
+# Версия содержимого файла снимка: документ Redis в JSON под своим ключом.
+SNAPSHOT_KIND = 'redis-dimensions'
+SNAPSHOT_SCHEMA_VERSION = 1
+
+
+class RedisDimensionStore:
+    """
+    Локальный снимок документов Redis (пользователи, рестораны с меню) для обогащения заказов.
+    Интерфейс get/set как у RedisClient, поэтому снимок передается процессору вместо клиента.
+
+    start подписывается на keyspace-уведомления и затем загружает все документы SCAN + MGET.
+    Уведомление об изменении ключа сбрасывает документ из снимка, следующий get прочитает его из Redis.
+    Каждый сброс получает номер, и документ, прочитанный из Redis до сброса, в снимок не записывается:
+    загрузка, которая идет параллельно с изменениями, не вернет устаревшее значение.
+    Если слушатель потерял соединение, уведомления могли пропасть: снимок очищается, и до перезапуска
+    слушателя (ensure_listening) get читает Redis напрямую. Документы снимка общие, изменять их нельзя.
+
+    Если задан snapshot_path, документы периодически и при остановке сохраняются в файл (save_snapshot).
+    При старте файл отображается в память, и процессор сразу читает документы из него, пока загрузка из Redis
+    идет в фоне. Документ из файла используется, только если по его ключу не было уведомлений с момента старта;
+    после загрузки из Redis файл больше не читается. Изменения, сделанные в Redis, пока сервис был остановлен,
+    видны только после загрузки, поэтому возраст файла ограничен snapshot_max_age.
+    Args:
+        client: Клиент Redis
+        logger: Логгер
+        match: Шаблон ключей снимка
+        batch_size: Ключей в одной команде MGET
+        snapshot_path: Файл снимка на диске (пустая строка - без файла)
+        snapshot_max_age: Максимальный возраст файла в секундах, более старый игнорируется
+        source: Адрес Redis; файл, записанный для другого Redis или шаблона ключей, игнорируется
+    """
+
+    def __init__(self, client: RedisClient, logger: Logger, match: str = '*', batch_size: int = 500,
+                 snapshot_path: str = '', snapshot_max_age: Optional[float] = None, source: str = '') -> None:
+        self._client = client
+        self._logger = logger
+        self._match = match
+        self._batch_size = batch_size
+        self._documents: Dict[str, Dict] = {}
+        self._invalidated_at: Dict[str, int] = {}
+        self._generation = 0
+        self._reset_at = 0
+        self._lock = threading.Lock()
+        self._listener = None
+        self._snapshot_path = snapshot_path
+        self._snapshot_max_age = snapshot_max_age
+        self._source = f'{source}/{match}'
+        self._snapshot: Optional[SnapshotReader] = None
+        self._snapshot_opened = False
+        self._warm = False
+
+    def start(self) -> int:
+        """
+        Запускает слушателя уведомлений и загружает снимок. Возвращает число загруженных документов.
+        При первом старте с файлом снимка загрузка из Redis идет в фоне, а возвращается число документов файла.
+        """
+        if not self._client.enable_keyspace_events():
+            self._logger.warning('Не удалось включить keyspace-уведомления Redis командой CONFIG, '
+                                 'они должны быть включены в настройках Redis (notify-keyspace-events)')
+        self._listener = self._client.subscribe_keyspace(self._on_event, self._match, self._on_listener_error)
+
+        # Файл читается только при первом старте: после потери слушателя уведомления уже пропущены.
+        if self._snapshot_path and not self._snapshot_opened:
+            self._snapshot_opened = True
+            self._snapshot = SnapshotReader.open(self._snapshot_path, SNAPSHOT_KIND, SNAPSHOT_SCHEMA_VERSION,
+                                                 self._source, self._snapshot_max_age, self._logger)
+            if self._snapshot is not None:
+                threading.Thread(target=self.warm_up, name='redis-warm-up', daemon=True).start()
+                return len(self._snapshot)
+        return self.warm_up()
+
+    def ensure_listening(self) -> None:
+        """
+        Джоб: перезапускает слушателя и загружает снимок заново, если соединение слушателя было потеряно.
+        """
+        if self._listener is None:
+            self.start()
+
+    def warm_up(self) -> int:
+        started = time.monotonic()
+        # Один номер на всю загрузку: ключ, измененный за время загрузки, в снимок не попадет.
+        with self._lock:
+            generation = self._generation
+        loaded = 0
+        batch = {}
+        for key, document in self._client.iter_documents(self._match, self._batch_size):
+            batch[key] = document
+            if len(batch) >= self._batch_size:
+                loaded += self._store(batch, generation)
+                batch = {}
+        loaded += self._store(batch, generation)
+        with self._lock:
+            if generation >= self._reset_at:
+                self._warm = True
+                self._snapshot = None
+        self._logger.info(f'Снимок Redis загружен: документов {loaded} '
+                          f'за {time.monotonic() - started:.1f} с')
+        return loaded
+
+    def save_snapshot(self) -> int:
+        """
+        Сохраняет документы в файл снимка. Пока загрузка из Redis не завершена, файл не перезаписывается:
+        в памяти еще не все документы. Возвращает число сохраненных документов.
+        """
+        with self._lock:
+            if not self._snapshot_path or not self._warm:
+                return 0
+            documents = list(self._documents.items())
+        saved = write_snapshot(self._snapshot_path, SNAPSHOT_KIND, SNAPSHOT_SCHEMA_VERSION,
+                               ((key, json.dumps(document).encode('utf-8')) for key, document in documents),
+                               self._source)
+        self._logger.info(f'Снимок Redis сохранен в {self._snapshot_path}: документов {saved}')
+        return saved
+
+    def get(self, k) -> Dict:
+        document = self._documents.get(k)
+        if document is not None:
+            DIMENSION_LOOKUPS.labels('local').inc()
+            return document
+
+        snapshot = self._snapshot
+        if snapshot is not None and k not in self._invalidated_at:
+            raw = snapshot.get(k)
+            if raw is not None:
+                DIMENSION_LOOKUPS.labels('snapshot').inc()
+                document = json.loads(raw)
+                # Номер 0: документ из файла не записывается, если ключ уже сбрасывался.
+                self._store({k: document}, 0)
+                return document
+
+        DIMENSION_LOOKUPS.labels('remote').inc()
+        with self._lock:
+            generation = self._generation
+        document = self._client.get(k)
+        self._store({k: document}, generation)
+        return document
+
+    def set(self, k, v):
+        self._client.set(k, v)
+        self._invalidate(k)
+
+    def _store(self, documents: Dict[str, Dict], generation: int) -> int:
+        # Документы прочитаны из Redis, когда счетчик сбросов был равен generation.
+        # Ключи, сброшенные после этого, не записываются: прочитанное значение могло устареть.
+        # Без слушателя и для чтений до его остановки снимок не пополняется.
+        stored = 0
+        with self._lock:
+            if self._listener is None or generation < self._reset_at:
+                return 0
+            for key, document in documents.items():
+                if self._invalidated_at.get(key, 0) <= generation:
+                    self._documents[key] = document
+                    stored += 1
+            DIMENSION_DOCUMENTS.set(len(self._documents))
+        return stored
+
+    def _invalidate(self, key: str) -> None:
+        with self._lock:
+            self._generation += 1
+            self._invalidated_at[key] = self._generation
+            if self._documents.pop(key, None) is not None:
+                DIMENSION_INVALIDATIONS.inc()
+            DIMENSION_DOCUMENTS.set(len(self._documents))
+
+    def _on_event(self, key: str, event: str) -> None:
+        self._invalidate(key)
+
+    def _on_listener_error(self, error: Exception, pubsub, thread) -> None:
+        self._logger.warning(f'Слушатель keyspace-уведомлений Redis остановлен: {error}, снимок очищен')
+        thread.stop()
+        with self._lock:
+            self._listener = None
+            self._snapshot = None
+            self._warm = False
+            self._generation += 1
+            self._reset_at = self._generation
+            self._documents.clear()
+            self._invalidated_at.clear()
+            DIMENSION_DOCUMENTS.set(0)
@@ -1,7 +1,14 @@
 import json
-from typing import Dict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
 import redis
+from redis.client import PubSubWorkerThread
+
+from lib.metrics import REDIS_LATENCY, REDIS_LOOKUPS
+
+# События keyspace-уведомлений: K - канал __keyspace@<db>__:<ключ>, g - общие команды (del, expire, rename),
+# $ - строковые команды (set), x и e - истечение и вытеснение ключа.
+KEYSPACE_EVENTS = 'Kg$xe'
 
 
 class RedisClient:
@@ -17,5 +24,74 @@ class RedisClient:
         self._client.set(k, json.dumps(v))
 
     def get(self, k) -> Dict:
-        obj: str = self._client.get(k)  # type: ignore
+        with REDIS_LATENCY.labels('get').time():
+            obj: str = self._client.get(k)  # type: ignore
+        REDIS_LOOKUPS.labels('miss' if obj is None else 'hit').inc()
         return json.loads(obj)
+
+    def iter_documents(self, match: str = '*', batch_size: int = 500,
+                       pipeline_size: int = 10) -> Iterator[Tuple[str, Dict]]:
+        """
+        Возвращает все JSON-документы с ключами по шаблону. Ключи перебираются SCAN, значения читаются MGET
+        по batch_size ключей, pipeline_size команд MGET отправляются одним pipeline.
+        Ключи других типов и значения, которые не являются JSON-объектом, пропускаются.
+        """
+        keys = []
+        for key in self._client.scan_iter(match=match, count=batch_size):
+            keys.append(key)
+            if len(keys) >= batch_size * pipeline_size:
+                yield from self._mget_documents(keys, batch_size)
+                keys = []
+        if keys:
+            yield from self._mget_documents(keys, batch_size)
+
+    def _mget_documents(self, keys: List[bytes], batch_size: int) -> Iterator[Tuple[str, Dict]]:
+        batches = [keys[i:i + batch_size] for i in range(0, len(keys), batch_size)]
+        with REDIS_LATENCY.labels('mget').time():
+            pipe = self._client.pipeline(transaction=False)
+            for batch in batches:
+                pipe.mget(batch)
+            results = pipe.execute()
+
+        for batch, values in zip(batches, results):
+            for key, raw in zip(batch, values):
+                if raw is None:
+                    continue
+                try:
+                    document = json.loads(raw)
+                except ValueError:
+                    continue
+                if isinstance(document, dict):
+                    yield key.decode(), document
+
+    def enable_keyspace_events(self) -> bool:
+        """
+        Включает keyspace-уведомления. В управляемом Redis команда CONFIG бывает запрещена,
+        тогда уведомления включаются в настройках кластера, а метод возвращает False.
+        """
+        try:
+            self._client.config_set('notify-keyspace-events', KEYSPACE_EVENTS)
+        except redis.RedisError:
+            return False
+        return True
+
+    def subscribe_keyspace(self,
+                           handler: Callable[[str, str], None],
+                           match: str = '*',
+                           exception_handler: Optional[Callable] = None) -> PubSubWorkerThread:
+        """
+        Подписывается на изменения ключей по шаблону и запускает поток-слушатель.
+        Args:
+            handler: Вызывается с ключом и событием (set, del, expired, ...) в потоке слушателя
+            match: Шаблон ключей
+            exception_handler: Обработчик ошибок соединения: (ошибка, pubsub, поток)
+        """
+        db = self._client.connection_pool.connection_kwargs.get('db', 0)
+        prefix = f'__keyspace@{db}__:'
+
+        def on_message(message: Dict) -> None:
+            handler(message['channel'].decode()[len(prefix):], message['data'].decode())
+
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(**{prefix + match: on_message})
+        return pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=exception_handler)
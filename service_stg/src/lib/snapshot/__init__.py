@@ -0,0 +1,2 @@
+from .snapshot_file import FORMAT_VERSION, SnapshotReader, write_snapshot  # noqa
+from .shutdown import save_on_shutdown  # noqa
@@ -0,0 +1,19 @@
+import atexit
+import signal
+import sys
+import threading
+from typing import Callable
+
+
+def _exit_on_sigterm(signum, frame) -> None:
+    # SIGTERM по умолчанию завершает процесс без atexit-обработчиков, поэтому превращаем его в обычный выход.
+    sys.exit(0)
+
+
+def save_on_shutdown(save: Callable[[], None]) -> None:
+    """
+    Вызывает save при завершении процесса, в том числе по SIGTERM (docker stop, удаление пода).
+    """
+    atexit.register(save)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _exit_on_sigterm)
@@ -0,0 +1 @@
+from .trace_context import TraceContext  # noqa
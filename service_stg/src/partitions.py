@@ -0,0 +1,30 @@
+import argparse
+import logging
+
+from app_config import AppConfig
+
+# Ручное обслуживание секций stg.order_events, то же самое делает джоб STG-сервиса.
+# Пример запуска в контейнере STG-сервиса:
+#   python partitions.py --premake 6
+#   python partitions.py --retention 12 --retention-action drop
+# Без аргументов используются настройки STG_PARTITION_* из окружения.
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Создание и очистка секций stg.order_events')
+    parser.add_argument('--premake', type=int, help='Сколько будущих секций создать заранее')
+    parser.add_argument('--retention', type=int, help='Сколько прошлых секций хранить (0 - все)')
+    parser.add_argument('--retention-action', choices=['detach', 'drop'], help='Что делать со старыми секциями')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger('stg_partitions')
+
+    config = AppConfig()
+    if args.premake is not None:
+        config.stg_partition_premake = args.premake
+    if args.retention is not None:
+        config.stg_partition_retention = args.retention
+    if args.retention_action:
+        config.stg_partition_retention_action = args.retention_action
+
+    logger.info(config.partition_manager(logger).run())
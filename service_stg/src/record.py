@@ -0,0 +1,107 @@
+import argparse
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Dict
+
+from app_config import AppConfig
+from lib.kafka_connect import KafkaMessage, KafkaReplay, parse_timestamp
+
+# Запись окна исходного, STG- и DDS-топиков и снимка Redis в сжатые файлы для нагрузочного прогона
+# (python -m benchmarks.replay) на реальном перекосе ключей и размерах сообщений.
+# Пример запуска в контейнере STG-сервиса:
+#   python record.py --output /archive/rec-0501 --from-timestamp 2024-05-01T10:00:00 \
+#       --to-timestamp 2024-05-01T11:00:00 --dds-topic dds-orders
+# Offset консьюмер-группы не меняются: топики читаются консьюмером без подписки, как в replay.py.
+# Файлы содержат персональные данные пользователей, хранить их нужно так же, как архив STG.
+
+
+class TopicRecorder:
+    """
+    Процессор для KafkaReplay: вместо обработки дописывает сообщение в сжатый JSONL. Тело пишется
+    десериализованным, размер исходного сообщения и его положение в топике сохраняются.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self.count = 0
+
+    def process(self, message: KafkaMessage) -> None:
+        self._file.write(json.dumps({
+            'value': message.value,
+            'headers': {k: v.decode('utf-8', 'replace') for k, v in message.headers.items() if v is not None},
+            'key': message.key,
+            'timestamp': message.timestamp,
+            'partition': message.partition,
+            'offset': message.offset,
+            'size': message.size,
+        }, ensure_ascii=False, default=str))
+        self._file.write('\n')
+        self.count += 1
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def record_topic(config: AppConfig, topic: str, path: str, args, logger) -> Dict:
+    consumer = config.kafka_replay_consumer(topic)
+    recorder = TopicRecorder(path)
+    try:
+        replay = KafkaReplay(consumer, recorder, logger, batch_size=1000)
+        replay.run(replay.plan(args.partition, args.from_timestamp, args.to_timestamp))
+    finally:
+        recorder.close()
+    return {'topic': topic, 'file': os.path.basename(path), 'messages': recorder.count}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Запись окна топиков и снимка Redis для нагрузочного прогона')
+    parser.add_argument('--output', required=True, help='Каталог записи')
+    parser.add_argument('--from-timestamp', type=parse_timestamp, required=True,
+                        help='Начало окна (ISO, UTC, или миллисекунды)')
+    parser.add_argument('--to-timestamp', type=parse_timestamp, required=True, help='Конец окна')
+    parser.add_argument('--partition', type=int, action='append', help='Партиция; можно указать несколько раз')
+    parser.add_argument('--source-topic', help='Исходный топик (по умолчанию KAFKA_SOURCE_TOPIC)')
+    parser.add_argument('--stg-topic', help='Топик STG (по умолчанию KAFKA_DESTINATION_TOPIC)')
+    parser.add_argument('--dds-topic', default='', help='Топик DDS (пустое значение - не записывать)')
+    parser.add_argument('--no-redis', action='store_true', help='Не записывать снимок Redis')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger('stg_record')
+
+    config = AppConfig()
+    os.makedirs(args.output, exist_ok=True)
+    # Имена файлов совпадают с входами слоев бенчмарка: source -> STG, stg -> DDS, dds -> CDM.
+    topics = {
+        'source': args.source_topic or config.kafka_consumer_topic,
+        'stg': args.stg_topic or config.kafka_producer_topic,
+        'dds': args.dds_topic,
+    }
+    manifest = {
+        'recorded_at': time.time(),
+        'from_timestamp': args.from_timestamp,
+        'to_timestamp': args.to_timestamp,
+        'partitions': args.partition,
+        'topics': {},
+    }
+    for name, topic in topics.items():
+        if topic:
+            manifest['topics'][name] = record_topic(
+                config, topic, os.path.join(args.output, f'{name}.jsonl.gz'), args, logger)
+
+    if not args.no_redis:
+        documents = dict(config.redis_client().iter_documents(config.redis_snapshot_match,
+                                                              config.redis_snapshot_batch_size))
+        with gzip.open(os.path.join(args.output, 'redis.json.gz'), 'wt', encoding='utf-8') as f:
+            json.dump(documents, f, ensure_ascii=False)
+        manifest['redis_documents'] = len(documents)
+
+    with open(os.path.join(args.output, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    logger.info(f'Запись завершена: {json.dumps(manifest, ensure_ascii=False)}')
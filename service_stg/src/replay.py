@@ -0,0 +1,32 @@
+import argparse
+import logging
+
+from app_config import AppConfig
+from lib.kafka_connect import add_replay_arguments, replay_from_args
+from stg_loader.repository.stg_repository import StgRepository
+from stg_loader.stg_message_processor_job import StgMessageProcessor
+
+# Переигрывание исходного топика через STG-процессор без сброса offset консьюмер-группы.
+# Пример запуска в контейнере STG-сервиса:
+#   python replay.py --from-timestamp 2024-05-01T10:00:00 --to-timestamp 2024-05-01T12:00:00 --rate 200
+#   python replay.py --partition 3 --from-offset 1500 --to-offset 1999 --dry-run
+# Переигранные заказы заново отправляются в выходной топик и дальше проходят DDS и CDM.
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Переигрывание топика через STG-процессор')
+    add_replay_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger('stg_replay')
+
+    config = AppConfig()
+    consumer = config.kafka_replay_consumer(args.topic)
+    proc = StgMessageProcessor(
+        consumer,
+        config.kafka_producer(),
+        config.redis_client(),
+        StgRepository(config.pg_warehouse_db()),
+        args.batch_size,
+        logger)
+    replay_from_args(args, consumer, proc, logger, config.failure_handler())
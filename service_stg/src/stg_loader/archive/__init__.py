@@ -0,0 +1 @@
+from .partition_archiver import PartitionArchiver  # noqa
@@ -0,0 +1,160 @@
+import os
+from datetime import datetime
+from logging import Logger
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from psycopg import Connection
+
+from lib.archive import ArchiveManifest, ORDER_EVENTS_SCHEMA, file_sha256, flatten_event
+from lib.pg import PgConnect
+
+
+class PartitionArchiver:
+    """
+    Выгружает старые секции stg.order_events в Parquet-файлы (zstd) и удаляет их из базы.
+
+    По умолчанию выгружаются отсоединенные секции, которые оставляет retention PartitionManager.
+    Строки читаются серверным курсором пачками по batch_size, каждая пачка - отдельная row group,
+    поэтому память не зависит от размера секции. Файл пишется во временный, сверяется по числу строк
+    с таблицей и только после этого переименовывается и попадает в манифест. Таблица удаляется последней.
+    Повторная выгрузка того же периода пишет новый файл с номером и не трогает прежний.
+    Args:
+        db: Подключение к хранилищу
+        logger: Логгер
+        archive_dir: Каталог архива с файлами и manifest.json
+        batch_size: Строк в одной row group
+        compression: Кодек Parquet
+        compression_level: Уровень сжатия кодека (None - по умолчанию)
+        drop_after_export: Удалять ли таблицу секции после выгрузки
+    """
+
+    def __init__(self,
+                 db: PgConnect,
+                 logger: Logger,
+                 archive_dir: str,
+                 batch_size: int = 100000,
+                 compression: str = 'zstd',
+                 compression_level: Optional[int] = None,
+                 drop_after_export: bool = True,
+                 schema: str = 'stg',
+                 table_name: str = 'order_events') -> None:
+        self._db = db
+        self._logger = logger
+        self._archive_dir = archive_dir
+        self._manifest = ArchiveManifest(archive_dir)
+        self._batch_size = batch_size
+        self._compression = compression
+        self._compression_level = compression_level
+        self._drop_after_export = drop_after_export
+        self._schema = schema
+        self._table_name = table_name
+
+    def run(self, partitions: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Выгружает указанные секции (подключенные предварительно отсоединяются) или все отсоединенные.
+        """
+        os.makedirs(self._archive_dir, exist_ok=True)
+        with self._db.connection() as conn:
+            if partitions:
+                for name in partitions:
+                    self._detach(conn, name)
+            else:
+                partitions = self.detached_partitions(conn)
+
+        exported = []
+        for name in partitions:
+            exported.append(self.export(name))
+        return exported
+
+    def detached_partitions(self, conn: Connection) -> List[str]:
+        rows = conn.execute(
+            """
+                SELECT c.relname
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = %(schema)s
+                  AND c.relname LIKE %(pattern)s
+                  AND c.relkind = 'r'
+                  AND NOT c.relispartition
+                ORDER BY c.relname
+            """,
+            {'schema': self._schema, 'pattern': f'{self._table_name}\\_p%'}
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def export(self, name: str) -> Dict:
+        table = f'{self._schema}.{name}'
+        file_name = self._manifest.file_name(name)
+        path = os.path.join(self._archive_dir, file_name)
+        tmp_path = path + '.tmp'
+
+        rows = 0
+        min_id = max_id = min_dttm = max_dttm = None
+        with self._db.connection() as conn:
+            expected = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            with pq.ParquetWriter(tmp_path, ORDER_EVENTS_SCHEMA, compression=self._compression,
+                                  compression_level=self._compression_level) as writer:
+                with conn.cursor(name='stg_archive') as cur:
+                    cur.itersize = self._batch_size
+                    # Сортировка по object_id дает узкие min/max в статистике row group:
+                    # читатель по диапазону object_id пропускает лишние row group целиком.
+                    cur.execute(f'SELECT object_id, object_type, sent_dttm, payload FROM {table} '
+                                f'ORDER BY object_id, sent_dttm')
+                    while True:
+                        batch = cur.fetchmany(self._batch_size)
+                        if not batch:
+                            break
+                        writer.write_table(pa.Table.from_pylist(
+                            [flatten_event(*row) for row in batch], schema=ORDER_EVENTS_SCHEMA))
+                        rows += len(batch)
+                        min_id = batch[0][0] if min_id is None else min_id
+                        max_id = batch[-1][0]
+                        batch_min = min(row[2] for row in batch)
+                        batch_max = max(row[2] for row in batch)
+                        min_dttm = batch_min if min_dttm is None else min(min_dttm, batch_min)
+                        max_dttm = batch_max if max_dttm is None else max(max_dttm, batch_max)
+
+        written = pq.ParquetFile(tmp_path).metadata.num_rows
+        if written != expected or rows != expected:
+            os.remove(tmp_path)
+            raise RuntimeError(f'{table}: в таблице {expected} строк, выгружено {rows}, в файле {written}')
+        os.replace(tmp_path, path)
+
+        entry = {
+            'file': file_name,
+            'partition': name,
+            'rows': rows,
+            'min_object_id': min_id,
+            'max_object_id': max_id,
+            'min_sent_dttm': min_dttm.isoformat(sep=' ') if min_dttm else None,
+            'max_sent_dttm': max_dttm.isoformat(sep=' ') if max_dttm else None,
+            'bytes': os.path.getsize(path),
+            'sha256': file_sha256(path),
+            'compression': self._compression,
+            'exported_at': datetime.now().isoformat(sep=' ', timespec='seconds'),
+        }
+        self._manifest.add(entry)
+
+        if self._drop_after_export:
+            with self._db.connection() as conn:
+                conn.execute(f'DROP TABLE {table}')
+        self._logger.info(f'Секция {table} выгружена в {path}: строк {rows}, байт {entry["bytes"]}')
+        return entry
+
+    def _detach(self, conn: Connection, name: str) -> None:
+        attached = conn.execute(
+            """
+                SELECT c.relispartition
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = %(schema)s AND c.relname = %(name)s
+            """,
+            {'schema': self._schema, 'name': name}
+        ).fetchone()
+        if attached is None:
+            raise ValueError(f'partition {self._schema}.{name} does not exist')
+        if attached[0]:
+            conn.execute(f'ALTER TABLE {self._schema}.{self._table_name} '
+                         f'DETACH PARTITION {self._schema}.{name}')
@@ -0,0 +1 @@
+from .partition_manager import PartitionManager  # noqa
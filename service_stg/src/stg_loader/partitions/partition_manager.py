@@ -0,0 +1,225 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from logging import Logger
+from typing import Dict, List, Optional, Set
+
+from psycopg import Connection
+
+from lib.pg import PgConnect
+
+PARTITION_INTERVALS = ('day', 'month')
+RETENTION_ACTIONS = ('detach', 'drop')
+
+
+@dataclass(frozen=True)
+class Partition:
+    name: str
+    start: datetime
+    end: datetime
+
+
+def period_start(moment: datetime, interval: str) -> datetime:
+    if interval == 'day':
+        return datetime(moment.year, moment.month, moment.day)
+    return datetime(moment.year, moment.month, 1)
+
+
+def next_period(start: datetime, interval: str) -> datetime:
+    if interval == 'day':
+        return start + timedelta(days=1)
+    if start.month == 12:
+        return datetime(start.year + 1, 1, 1)
+    return datetime(start.year, start.month + 1, 1)
+
+
+def previous_period(start: datetime, interval: str) -> datetime:
+    if interval == 'day':
+        return start - timedelta(days=1)
+    if start.month == 1:
+        return datetime(start.year - 1, 12, 1)
+    return datetime(start.year, start.month - 1, 1)
+
+
+def partition_for(table_name: str, start: datetime, interval: str) -> Partition:
+    suffix = start.strftime('%Y_%m_%d' if interval == 'day' else '%Y_%m')
+    return Partition(f'{table_name}_p{suffix}', start, next_period(start, interval))
+
+
+class PartitionManager:
+    """
+    Обслуживает секционированную по sent_dttm таблицу stg.order_events.
+
+    ensure_partitions заранее создает секции на текущий и premake следующих периодов, поэтому вставки
+    не попадают в секцию по умолчанию. Строки, которые все же в нее попали (события из далекого прошлого
+    или будущего), переносятся в новую секцию при ее создании. Секция не создается, если таблица с ее именем
+    уже есть (отсоединенная retention секция ждет выгрузки) или период старше retention: такие строки
+    (опоздавшие или переигранные события) остаются в секции по умолчанию.
+    apply_retention отсоединяет (detach) или удаляет (drop) секции старше retention периодов.
+    Отсоединенная секция остается обычной таблицей stg.order_events_p*, ее можно выгрузить и удалить позже.
+    """
+
+    def __init__(self,
+                 db: PgConnect,
+                 logger: Logger,
+                 schema: str = 'stg',
+                 table_name: str = 'order_events',
+                 interval: str = 'month',
+                 premake: int = 3,
+                 retention: int = 0,
+                 retention_action: str = 'detach') -> None:
+        if interval not in PARTITION_INTERVALS:
+            raise ValueError(f'unknown partition interval: {interval}')
+        if retention_action not in RETENTION_ACTIONS:
+            raise ValueError(f'unknown retention action: {retention_action}')
+
+        self._db = db
+        self._logger = logger
+        self._schema = schema
+        self._table_name = table_name
+        self._interval = interval
+        self._premake = premake
+        self._retention = retention
+        self._retention_action = retention_action
+
+    def run(self, now: Optional[datetime] = None) -> Dict:
+        """
+        Джоб обслуживания: создание будущих секций и очистка старых.
+        """
+        now = now or datetime.now()
+        created = self.ensure_partitions(now)
+        retired = self.apply_retention(now)
+        if created or retired:
+            self._logger.info(f'Секции {self._schema}.{self._table_name}: созданы {created}, '
+                              f'{self._retention_action} {retired}')
+        return {'created': created, 'retired': retired}
+
+    def ensure_partitions(self, now: datetime) -> List[str]:
+        # Текущий и будущие периоды, а также периоды строк, попавших в секцию по умолчанию (например, загрузка истории).
+        start = period_start(now, self._interval)
+        periods = []
+        for _ in range(self._premake + 1):
+            periods.append(start)
+            start = next_period(start, self._interval)
+
+        cutoff = self._retention_cutoff(now)
+        created = []
+        with self._db.connection() as conn:
+            periods.extend(self._default_periods(conn))
+            existing = self._relations(conn)
+            for start in sorted(set(periods)):
+                partition = partition_for(self._table_name, start, self._interval)
+                if partition.name in existing:
+                    continue
+                if cutoff is not None and partition.end <= cutoff:
+                    self._logger.warning(f'Строки периода {partition.start:%Y-%m-%d} старше retention '
+                                         f'остаются в секции по умолчанию: секция {partition.name} не создается')
+                    continue
+                self._create_partition(conn, partition)
+                created.append(partition.name)
+        return created
+
+    def apply_retention(self, now: datetime) -> List[str]:
+        cutoff = self._retention_cutoff(now)
+        if cutoff is None:
+            return []
+
+        retired = []
+        with self._db.connection() as conn:
+            for partition in self.partitions(conn):
+                if partition.end > cutoff:
+                    continue
+                if self._retention_action == 'drop':
+                    conn.execute(f'DROP TABLE {self._schema}.{partition.name}')
+                else:
+                    conn.execute(f'ALTER TABLE {self._schema}.{self._table_name} '
+                                 f'DETACH PARTITION {self._schema}.{partition.name}')
+                retired.append(partition.name)
+        return retired
+
+    def partitions(self, conn: Connection) -> List[Partition]:
+        """
+        Секции таблицы с диапазонами, по возрастанию. Секция по умолчанию не возвращается.
+        """
+        rows = conn.execute(
+            """
+                SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_class p ON p.oid = i.inhparent
+                JOIN pg_namespace n ON n.oid = p.relnamespace
+                WHERE n.nspname = %(schema)s AND p.relname = %(table_name)s
+            """,
+            {'schema': self._schema, 'table_name': self._table_name}
+        ).fetchall()
+
+        partitions = []
+        for name, bound in rows:
+            if bound == 'DEFAULT':
+                continue
+            # FOR VALUES FROM ('2024-05-01 00:00:00') TO ('2024-06-01 00:00:00')
+            start, end = [value.split("'")[1] for value in bound.split(' TO ')]
+            partitions.append(Partition(name, datetime.fromisoformat(start), datetime.fromisoformat(end)))
+        return sorted(partitions, key=lambda p: p.start)
+
+    def _retention_cutoff(self, now: datetime) -> Optional[datetime]:
+        """
+        Начало самого старого хранимого периода (None - retention не задан).
+        """
+        if not self._retention:
+            return None
+        cutoff = period_start(now, self._interval)
+        for _ in range(self._retention):
+            cutoff = previous_period(cutoff, self._interval)
+        return cutoff
+
+    def _relations(self, conn: Connection) -> Set[str]:
+        """
+        Имена всех таблиц схемы с префиксом секций, включая отсоединенные.
+        """
+        rows = conn.execute(
+            """
+                SELECT c.relname
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = %(schema)s AND c.relname LIKE %(prefix)s
+            """,
+            {'schema': self._schema, 'prefix': f'{self._table_name}\\_p%'}
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def _default_periods(self, conn: Connection) -> List[datetime]:
+        rows = conn.execute(
+            f"""
+                SELECT DISTINCT date_trunc(%(interval)s, sent_dttm)
+                FROM {self._schema}.{self._table_name}_default
+            """,
+            {'interval': self._interval}
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _create_partition(self, conn: Connection, partition: Partition) -> None:
+        table = f'{self._schema}.{self._table_name}'
+        default = f'{self._schema}.{self._table_name}_default'
+        bounds = {'start': partition.start, 'end': partition.end}
+
+        # Новую секцию нельзя создать, пока в секции по умолчанию лежат строки из ее диапазона.
+        # Создаем таблицу отдельно, переносим в нее эти строки и только потом подключаем.
+        conn.execute(f'CREATE TABLE {self._schema}.{partition.name} (LIKE {table} INCLUDING DEFAULTS)')
+        moved = conn.execute(
+            f"""
+                WITH moved AS (
+                    DELETE FROM {default}
+                    WHERE sent_dttm >= %(start)s AND sent_dttm < %(end)s
+                    RETURNING *
+                )
+                INSERT INTO {self._schema}.{partition.name}
+                SELECT * FROM moved
+            """,
+            bounds
+        ).rowcount
+        conn.execute(
+            f"ALTER TABLE {table} ATTACH PARTITION {self._schema}.{partition.name} "
+            f"FOR VALUES FROM ('{partition.start.isoformat(sep=' ')}') TO ('{partition.end.isoformat(sep=' ')}')"
+        )
+        if moved:
+            self._logger.info(f'В секцию {partition.name} перенесено строк из секции по умолчанию: {moved}')
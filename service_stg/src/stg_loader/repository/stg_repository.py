@@ -1,6 +1,7 @@
 from datetime import datetime
 
 
+from lib.metrics import DB_UPSERT_LATENCY
 from lib.pg import PgConnect
 
 class StgRepository:
@@ -14,22 +15,22 @@ class StgRepository:
                             payload: str
                             ) -> None:
 
-        with self._db.connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                        INSERT INTO stg.order_events(object_id, object_type, sent_dttm, payload)
-                        VALUES (%(object_id)s, %(object_type)s, %(sent_dttm)s, %(payload)s)
-                        ON CONFLICT (object_id) DO UPDATE
-                        SET
-                            object_type = EXCLUDED.object_type,
-                            sent_dttm = EXCLUDED.sent_dttm,
-                            payload = EXCLUDED.payload
-                    """,
-                    {
-                        'object_id': object_id,
-                        'object_type': object_type,
-                        'sent_dttm': sent_dttm,
-                        'payload': payload
-                    }
-                )
+        with DB_UPSERT_LATENCY.labels('order_events').time():
+            with self._db.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                            INSERT INTO stg.order_events(object_id, object_type, sent_dttm, payload)
+                            VALUES (%(object_id)s, %(object_type)s, %(sent_dttm)s, %(payload)s)
+                            ON CONFLICT (object_id, sent_dttm) DO UPDATE
+                            SET
+                                object_type = EXCLUDED.object_type,
+                                payload = EXCLUDED.payload
+                        """,
+                        {
+                            'object_id': object_id,
+                            'object_type': object_type,
+                            'sent_dttm': sent_dttm,
+                            'payload': payload
+                        }
+                    )
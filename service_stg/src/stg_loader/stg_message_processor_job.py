@@ -1,10 +1,14 @@
-import time
 import json
+import threading
 from datetime import datetime
 from logging import Logger
-from typing  import List, Dict
+from typing import Optional
 
-from lib.kafka_connect.kafka_connectors import KafkaConsumer, KafkaProducer
+from lib.kafka_connect import FailureHandler, KafkaConsumer, KafkaMessage, KafkaProducer
+from lib.log import BatchStats, StructuredLogger
+from lib.metrics import BATCH_DURATION, CONSUMER_LAG, MESSAGES_CONSUMED, MESSAGES_FAILED
+from lib.tracing import TraceContext
+from lib.redis.order_enrichment import enrich_order, menu_index
 from lib.redis.redis_client import RedisClient
 from stg_loader.repository.stg_repository import StgRepository
 
@@ -16,104 +20,166 @@ class StgMessageProcessor:
                  redis_client: RedisClient,
                  stg_repository: StgRepository,
                  batch_size: int = 100,
-                 logger: Logger = None) -> None:
+                 logger: Logger = None,
+                 log_sample_rate: float = 0.0,
+                 failure_handler: FailureHandler = None,
+                 retry_consumer: KafkaConsumer = None,
+                 batch_max_bytes: int = 0) -> None:
         self._consumer = consumer
         self._producer = producer
         self._redis = redis_client
         self._stg_repository = stg_repository
         self._batch_size = batch_size
-        self._logger = logger
-
-
-    def get_items_info(self, order_items: list, restaurant: dict) -> List[Dict[str, str]]:
-        items = []
-
-        menu = restaurant['menu']
-
-        for it in order_items:
-            menu_item = next(x for x in menu if x['_id'] == it['id'])
-            result = {
-                'id': it['id'],
-                'price': it['price'],
-                'quantity': it['quantity'],
-                'name': menu_item['name'],
-                'category': menu_item['category']
-            }
-            items.append(result)
-        return items
+        # Батч ограничен и по объему: пачка крупных заказов не раздувает память процесса (0 - только по числу).
+        self._batch_max_bytes = batch_max_bytes
+        self._logger = StructuredLogger(logger, log_sample_rate)
+        self._failures = failure_handler or FailureHandler()
+        self._retry_consumer = retry_consumer
+        # Транзакционный продюсер (KAFKA_TRANSACTIONAL=1): отправленные за батч сообщения и offset прочитанных
+        # фиксируются одной транзакцией. Транзакция у продюсера одна, поэтому основной и retry-батчи идут по очереди.
+        self._transaction = producer if getattr(producer, 'transactional', False) else None
+        self._transaction_lock = threading.Lock()
+        self._revoke_error: Optional[Exception] = None
+        # Перед отзывом партиций при ребалансировке дописываем накопленное за батч, после чего консьюмер
+        # фиксирует offset отзываемых партиций.
+        for c in (consumer, retry_consumer):
+            if c:
+                c.on_revoke(lambda c=c: self._on_revoke(c))
 
     # функция, которая будет вызываться по расписанию.
     def run(self) -> None:
+        self._run_batch(self._consumer)
+
+    # функция, которая по расписанию обрабатывает сообщения из retry-топика.
+    def run_retries(self) -> None:
+        if self._retry_consumer:
+            self._run_batch(self._retry_consumer, delayed=True)
+
+    def _run_batch(self, consumer: KafkaConsumer, delayed: bool = False) -> None:
+        if not self._transaction:
+            self._consume_batch(consumer, delayed)
+            return
+        with self._transaction_lock:
+            self._revoke_error = None
+            self._transaction.begin_transaction()
+            try:
+                self._consume_batch(consumer, delayed)
+            except Exception:
+                # Сообщения батча не видны консьюмерам read_committed, offset не сдвинулись:
+                # батч будет прочитан и обработан снова.
+                try:
+                    self._transaction.abort_transaction()
+                finally:
+                    consumer.rewind()
+                raise
+
+    def _consume_batch(self, consumer: KafkaConsumer, delayed: bool = False) -> None:
         # Пишем в лог, что джоб был запущен.
-        self._logger.info(f"{datetime.utcnow()}: START")
+        self._logger.debug('START', topic=consumer.topic)
+        stats = BatchStats()
 
-        # Имитация работы. Здесь будет реализована обработка сообщений.
         for _ in range(self._batch_size):
-            msg = self._consumer.consume()
-            if not msg:
+            message = consumer.consume_message()
+            if self._revoke_error is not None:
+                # Транзакция при отзыве партиций не закоммичена: прочитанное до отзыва нужно прочитать заново.
+                raise self._revoke_error
+            if not message:
                 self._logger.debug('Сообщений из кафки нет')
                 break
-            self._logger.debug(f'Получено сообщение из кафки: {msg}')
-
-            # Вставляем сообщениие в postgr
+            if delayed and self._failures.due_in(message) > 0:
+                # Время повтора еще не наступило: возвращаем сообщение в очередь до следующего запуска.
+                consumer.seek(message)
+                break
+            stats.consumed += 1
+            stats.bytes += message.size
+            MESSAGES_CONSUMED.labels(consumer.topic).inc()
+            self._logger.payload('Получено сообщение из кафки', message.value, offset=message.offset)
             try:
-                self._logger.info('Вставляем сообщение в postgr')
-
-                # Преобразуем данные в нужный формат
-                object_id = int(msg['object_id'])
-                object_type = msg['object_type']
-                payload = json.dumps(msg['payload'])
-                sent_dttm = datetime.strptime(msg['sent_dttm'], '%Y-%m-%d %H:%M:%S')
-
-                # Вставляем сообщениие в postgr
-                self._stg_repository.order_events_insert(
-                        object_id,
-                        object_type,
-                        sent_dttm,
-                        payload
-                )
-
-                self._logger.debug(f'Сообщение {object_id} вставлено в stg.order_events')
-
-                # Достаем данные из оперативной памяти облака
-                user_id = msg['payload']['user']['id']
-                rest_id = msg['payload']['restaurant']['id']
-
-                # Получаем информацию из Redis
-                user_info = self._redis.get(user_id)
-                self._logger.debug(f'Получили информацию о пользовател из Redis: {user_info}')
-
-                rest_info = self._redis.get(rest_id)
-                self._logger.debug(f'Получили информацию о ресторане из Redis: {rest_info}')
-
-                # Формируем итоговое сообщение
-                result = {
-                    'object_id': object_id,
-                    'object_type': object_type,
-                    'payload': {
-                        'id': object_id,
-                        'date': msg['payload']['date'],
-                        'cost': msg['payload']['cost'],
-                        'payment': msg['payload']['payment'],
-                        'status': msg['payload']['final_status'],
-                        'restaurant': {
-                            'id': rest_info['_id'],
-                            'name': rest_info['name']
-                        },
-                        'user': {
-                            'id': user_info['_id'],
-                            'name': user_info['name'],
-                            'login': user_info['login']
-                        },
-                        'products': self.get_items_info(msg['payload']['order_items'], rest_info)
-                    }
-                }
-
-                self._producer.produce(result)
-                self._logger.info(f'Сообщение отправлено продюсеру: {result}')
-
+                self._process(message)
+                stats.produced += 1
             except Exception as e:
-                self._logger.error(f'Ошибка при вставке сообщения: {e}')
+                # Ошибочное сообщение уходит в retry- или dead-letter топик, батч продолжается.
+                stats.failed += 1
+                MESSAGES_FAILED.labels(consumer.topic).inc()
+                route = self._failures.handle(message, e)
+                self._logger.error('Ошибка при вставке сообщения',
+                                   offset=message.offset, error=repr(e), route=route)
+            if self._batch_max_bytes and stats.bytes >= self._batch_max_bytes:
+                break
 
-        # Пишем в лог, что джоб успешно завершен.
-        self._logger.info(f"{datetime.utcnow()}: FINISH")
+        # Отправленные сообщения доставлены до фиксации offset. В совмещенном режиме здесь же
+        # следующие слои записывают агрегаты, накопленные за батч.
+        self.flush()
+
+        # Все прочитанные сообщения обработаны или переданы в retry/dead-letter топики.
+        # В транзакционном режиме offset фиксируются вместе с отправленными сообщениями.
+        consumer.commit(self._transaction)
+
+        # Обновляем метрики батча: длительность обработки и отставание консьюмера по каждой партиции.
+        BATCH_DURATION.observe(stats.duration())
+        for partition, lag in consumer.lag().items():
+            CONSUMER_LAG.labels(consumer.topic, partition).set(lag)
+
+        # Пишем в лог итоговую строку по батчу.
+        self._logger.batch_summary(stats)
+
+    # Обработка одного сообщения вне батча, например при переигрывании топика (replay.py).
+    # Ошибки пробрасываются вызывающему.
+    def process(self, message: KafkaMessage) -> None:
+        self._process(message)
+
+    def flush(self) -> None:
+        self._producer.flush()
+
+    def _on_revoke(self, consumer: KafkaConsumer) -> None:
+        if not self._transaction:
+            self.flush()
+            return
+        # Отзыв партиций приходит внутри poll, то есть во время батча этого консьюмера: прочитанное до него
+        # фиксируем открытой транзакцией, остаток батча пойдет в новой.
+        try:
+            self.flush()
+            if self._transaction.in_transaction:
+                consumer.commit(self._transaction)
+                self._transaction.begin_transaction()
+        except Exception as e:
+            # Консьюмер ошибку обработчика только пишет в лог и не фиксирует offset. Батч прерывается сразу
+            # после poll: транзакция отменяется, консьюмер возвращается на зафиксированные offset.
+            self._revoke_error = e
+            raise
+
+    def _process(self, message: KafkaMessage) -> None:
+        msg = message.value
+        trace = TraceContext.from_message(message)
+
+        # Преобразуем данные в нужный формат
+        object_id = int(msg['object_id'])
+        object_type = msg['object_type']
+        payload = json.dumps(msg['payload'])
+        sent_dttm = datetime.strptime(msg['sent_dttm'], '%Y-%m-%d %H:%M:%S')
+
+        # Вставляем сообщениие в postgr
+        self._stg_repository.order_events_insert(
+                object_id,
+                object_type,
+                sent_dttm,
+                payload
+        )
+
+        self._logger.debug('Сообщение вставлено в stg.order_events', object_id=object_id)
+
+        # Достаем данные из оперативной памяти облака
+        user_id = msg['payload']['user']['id']
+        rest_id = msg['payload']['restaurant']['id']
+
+        # Получаем информацию из Redis
+        user_info = self._redis.get(user_id)
+        rest_info = self._redis.get(rest_id)
+
+        # Формируем итоговое сообщение
+        result = enrich_order(object_id, object_type, msg['payload'], user_info, rest_info, menu_index(rest_info))
+
+        # Отмечаем время передачи заказа следующему слою и пробрасываем метки дальше в заголовках.
+        trace.record('stg')
+        self._producer.produce(result, headers=trace.to_headers())
+        self._logger.payload('Сообщение отправлено продюсеру', result, object_id=object_id)
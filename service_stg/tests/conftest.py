@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Тесты импортируют модули сервиса так же, как app.py: от каталога src.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
@@ -0,0 +1,65 @@
+from datetime import datetime
+
+import pyarrow as pa
+
+from lib.archive import ORDER_EVENTS_SCHEMA, ArchiveManifest, flatten_event, unflatten_event
+
+PAYLOAD = {
+    'restaurant': {'id': 'r1'},
+    'date': '2022-05-01 00:00:07',
+    'user': {'id': 'u1'},
+    'order_items': [
+        {'id': 'p1', 'name': 'Блюдо 1', 'price': 1400, 'quantity': 1},
+        {'id': 'p2', 'name': 'Блюдо 2', 'price': 99.5, 'quantity': 3},
+    ],
+    'bonus_payment': 0,
+    'cost': 1698.5,
+    'payment': 1698.5,
+    'bonus_grant': 0,
+    'statuses': [
+        {'status': 'OPEN', 'dttm': '2022-05-01 00:00:07'},
+        {'status': 'CLOSED', 'dttm': '2022-05-01 00:40:00'},
+    ],
+    'final_status': 'CLOSED',
+    'update_ts': '2022-05-01 00:40:00',
+}
+SENT_DTTM = datetime(2022, 5, 1, 0, 40)
+
+
+def round_trip(payload):
+    # Через таблицу Arrow со схемой архива: так запись проходит те же типы колонок, что и в Parquet.
+    record = flatten_event(1000001, 'order', SENT_DTTM, payload)
+    table = pa.Table.from_pylist([record], schema=ORDER_EVENTS_SCHEMA)
+    return unflatten_event(table.to_pylist()[0])
+
+
+def test_known_fields_round_trip():
+    record = flatten_event(1000001, 'order', SENT_DTTM, PAYLOAD)
+    assert record['payload_extra'] is None
+    assert round_trip(PAYLOAD) == (1000001, 'order', PAYLOAD)
+
+
+def test_unknown_and_malformed_fields_round_trip():
+    payload = dict(
+        PAYLOAD,
+        date='01.05.2022 00:00',
+        cost='1698.5',
+        restaurant={'id': 'r1', 'name': 'Ресторан 1'},
+        comment={'text': 'без лука'},
+        final_status=None,
+    )
+    record = flatten_event(1000001, 'order', SENT_DTTM, payload)
+    assert record['payload_extra'] is not None
+    assert round_trip(payload) == (1000001, 'order', payload)
+
+
+def test_manifest_keeps_every_export_of_a_partition(tmp_path):
+    manifest = ArchiveManifest(str(tmp_path))
+    name = 'order_events_p2022_05'
+    first = manifest.file_name(name)
+    manifest.add({'file': first, 'partition': name, 'rows': 2, 'min_sent_dttm': '2022-05-01 00:00:00'})
+    second = manifest.file_name(name)
+    assert first == f'{name}.parquet'
+    assert second == f'{name}.2.parquet'
+    manifest.add({'file': second, 'partition': name, 'rows': 1, 'min_sent_dttm': '2022-05-03 00:00:00'})
+    assert [f['file'] for f in manifest.files()] == [first, second]
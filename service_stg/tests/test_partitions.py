@@ -0,0 +1,64 @@
+from datetime import datetime
+
+import pytest
+
+from stg_loader.partitions.partition_manager import (
+    Partition,
+    PartitionManager,
+    next_period,
+    partition_for,
+    period_start,
+    previous_period,
+)
+
+
+@pytest.mark.parametrize('moment, interval, expected', [
+    (datetime(2024, 5, 17, 13, 45, 10), 'month', datetime(2024, 5, 1)),
+    (datetime(2024, 5, 17, 13, 45, 10), 'day', datetime(2024, 5, 17)),
+    (datetime(2024, 1, 1), 'month', datetime(2024, 1, 1)),
+])
+def test_period_start(moment, interval, expected):
+    assert period_start(moment, interval) == expected
+
+
+@pytest.mark.parametrize('start, interval, following', [
+    (datetime(2024, 5, 1), 'month', datetime(2024, 6, 1)),
+    (datetime(2023, 12, 1), 'month', datetime(2024, 1, 1)),
+    (datetime(2024, 2, 28), 'day', datetime(2024, 2, 29)),
+    (datetime(2023, 12, 31), 'day', datetime(2024, 1, 1)),
+])
+def test_next_and_previous_period_are_inverse(start, interval, following):
+    assert next_period(start, interval) == following
+    assert previous_period(following, interval) == start
+
+
+def test_periods_tile_without_gaps():
+    start = datetime(2023, 11, 1)
+    for _ in range(30):
+        following = next_period(start, 'month')
+        assert period_start(following - (following - start) / 2, 'month') == start
+        start = following
+    assert start == datetime(2026, 5, 1)
+
+
+def test_partition_for():
+    assert partition_for('order_events', datetime(2024, 5, 1), 'month') == \
+        Partition('order_events_p2024_05', datetime(2024, 5, 1), datetime(2024, 6, 1))
+    assert partition_for('order_events', datetime(2024, 12, 31), 'day') == \
+        Partition('order_events_p2024_12_31', datetime(2024, 12, 31), datetime(2025, 1, 1))
+
+
+@pytest.mark.parametrize('interval, retention, now, cutoff', [
+    ('month', 0, datetime(2024, 5, 17), None),
+    ('month', 3, datetime(2024, 5, 17), datetime(2024, 2, 1)),
+    ('month', 6, datetime(2024, 2, 10), datetime(2023, 8, 1)),
+    ('day', 7, datetime(2024, 3, 3, 12), datetime(2024, 2, 25)),
+])
+def test_retention_cutoff(interval, retention, now, cutoff):
+    manager = PartitionManager(None, None, interval=interval, retention=retention)
+    assert manager._retention_cutoff(now) == cutoff
+
+
+def test_unknown_interval():
+    with pytest.raises(ValueError):
+        PartitionManager(None, None, interval='week')
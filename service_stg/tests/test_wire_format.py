@@ -0,0 +1,113 @@
+import json
+
+import msgpack
+import pytest
+
+from lib.kafka_connect.wire_format import (
+    CONTENT_TYPE_HEADER,
+    CONTENT_TYPE_MSGPACK,
+    SCHEMA_ID_HEADER,
+    SchemaRegistry,
+    WireFormat,
+)
+
+ORDER = {
+    'object_id': 1000001,
+    'object_type': 'order',
+    'payload': {
+        'id': 1000001,
+        'date': '2022-05-01 00:00:07',
+        'cost': 2750,
+        'payment': 2750,
+        'status': 'CLOSED',
+        'update_ts': '2022-05-01 00:00:07',
+        'restaurant': {'id': 'r1', 'name': 'Ресторан 1'},
+        'user': {'id': 'u1', 'name': 'Пользователь 1', 'login': 'user_1'},
+        'products': [
+            {'id': 'p1', 'price': 1400, 'quantity': 1, 'name': 'Блюдо 1', 'category': 'Супы'},
+            {'id': 'p2', 'price': 1350, 'quantity': 1, 'name': 'Блюдо 2', 'category': 'Салаты'},
+        ]
+    }
+}
+
+
+@pytest.fixture
+def registry(tmp_path):
+    path = tmp_path / 'schemas.json'
+    path.write_text(json.dumps({'schemas': [
+        {'id': 1, 'subject': 'orders', 'fields': ['object_id', 'object_type']},
+        {'id': 2, 'subject': 'orders', 'fields': [
+            'object_id',
+            'object_type',
+            {'name': 'payload', 'fields': [
+                'id', 'date', 'cost', 'payment', 'status', 'update_ts',
+                {'name': 'restaurant', 'fields': ['id', 'name']},
+                {'name': 'user', 'fields': ['id', 'name', 'login']},
+                {'name': 'products', 'items': ['id', 'price', 'quantity', 'name', 'category']},
+            ]},
+        ]},
+    ]}), encoding='utf-8')
+    return SchemaRegistry(str(path))
+
+
+def test_json_round_trip():
+    wire = WireFormat('json')
+    body, headers = wire.encode(ORDER, {'x-trace-origin-ts': '1.0'})
+    assert headers['x-trace-origin-ts'] == '1.0'
+    assert wire.decode(body, headers) == ORDER
+
+
+def test_message_without_content_type_is_json():
+    assert WireFormat('msgpack').decode(json.dumps(ORDER).encode(), {}) == ORDER
+
+
+def test_msgpack_with_schema_round_trip(registry):
+    wire = WireFormat('msgpack', registry, subject='orders')
+    body, headers = wire.encode(ORDER)
+    # Запись кодируется по последней схеме subject, без имен полей.
+    assert headers == {CONTENT_TYPE_HEADER: CONTENT_TYPE_MSGPACK, SCHEMA_ID_HEADER: '2'}
+    assert b'restaurant' not in body
+    assert wire.decode(body, headers) == ORDER
+    # Заголовки Kafka приходят байтами.
+    assert wire.decode(body, {k: v.encode() for k, v in headers.items()}) == ORDER
+
+
+def test_msgpack_decodes_by_schema_from_header(registry):
+    body = msgpack.packb([7, 'order'], use_bin_type=True)
+    headers = {CONTENT_TYPE_HEADER: CONTENT_TYPE_MSGPACK, SCHEMA_ID_HEADER: '1'}
+    assert WireFormat('json', registry).decode(body, headers) == {'object_id': 7, 'object_type': 'order'}
+
+
+def test_schema_mismatch_falls_back_to_plain_msgpack(registry):
+    wire = WireFormat('msgpack', registry, subject='orders')
+    message = dict(ORDER, extra_field=1)
+    body, headers = wire.encode(message)
+    assert SCHEMA_ID_HEADER not in headers
+    assert wire.decode(body, headers) == message
+
+    message = {'object_id': 1, 'object_type': 'order', 'payload': dict(ORDER['payload'], products=None)}
+    message['payload'].pop('update_ts')
+    body, headers = wire.encode(message)
+    assert SCHEMA_ID_HEADER not in headers
+    assert wire.decode(body, headers) == message
+
+
+def test_retry_headers_are_replaced(registry):
+    wire = WireFormat('msgpack', registry, subject='orders')
+    stale = {CONTENT_TYPE_HEADER: 'application/json', SCHEMA_ID_HEADER: '1', 'x-retry-count': '2'}
+    body, headers = wire.encode(ORDER, stale)
+    assert headers[SCHEMA_ID_HEADER] == '2'
+    assert headers['x-retry-count'] == '2'
+    assert wire.decode(body, headers) == ORDER
+
+
+def test_unknown_schema_id(registry):
+    with pytest.raises(ValueError):
+        registry.get(99)
+
+
+def test_default_registry_encodes_stg_orders():
+    wire = WireFormat('msgpack', subject='stg-orders')
+    body, headers = wire.encode(ORDER)
+    assert SCHEMA_ID_HEADER in headers
+    assert wire.decode(body, headers) == ORDER
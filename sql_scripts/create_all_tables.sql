@@ -1,3 +1,5 @@
+CREATE SCHEMA IF NOT EXISTS stg;
+CREATE SCHEMA IF NOT EXISTS dds;
 CREATE SCHEMA IF NOT EXISTS cdm;
 
 
@@ -21,13 +23,52 @@ CREATE TABLE IF NOT EXISTS cdm.user_category_counters(
 );
 
 
+CREATE TABLE IF NOT EXISTS cdm.distinct_user_sketches(
+	dimension VARCHAR(16) NOT NULL CHECK(dimension IN ('product', 'category')),
+	dimension_id UUID NOT NULL,
+	dimension_name VARCHAR(50) NOT NULL,
+	bucket_date DATE NOT NULL,
+	sketch BYTEA NOT NULL,
+	updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+	CONSTRAINT pk_distinct_user_sketches PRIMARY KEY (dimension, dimension_id, bucket_date)
+);
+
+
+CREATE TABLE IF NOT EXISTS cdm.sales_rollups(
+	granularity VARCHAR(8) NOT NULL CHECK(granularity IN ('hour', 'day')),
+	bucket_start TIMESTAMP NOT NULL,
+	dimension VARCHAR(16) NOT NULL CHECK(dimension IN ('product', 'category')),
+	dimension_id UUID NOT NULL,
+	dimension_name VARCHAR(50) NOT NULL,
+	order_cnt INT NOT NULL CHECK(order_cnt >= 0),
+	item_cnt INT NOT NULL CHECK(item_cnt >= 0),
+	revenue NUMERIC(19, 5) NOT NULL CHECK(revenue >= 0),
+	updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+	CONSTRAINT pk_sales_rollups PRIMARY KEY (granularity, dimension, dimension_id, bucket_start)
+);
+
+
+CREATE INDEX IF NOT EXISTS idx_sales_rollups_bucket ON cdm.sales_rollups (granularity, bucket_start);
+
+
+CREATE TABLE IF NOT EXISTS cdm.rollup_orders(
+	order_id INT PRIMARY KEY,
+	order_dttm TIMESTAMP NOT NULL,
+	counted_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+
 CREATE TABLE IF NOT EXISTS stg.order_events(
-	id INT PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+	id BIGINT GENERATED ALWAYS AS IDENTITY,
 	object_id INT NOT NULL,
 	object_type VARCHAR(50) NOT NULL,
 	payload JSON NOT NULL,
-	sent_dttm TIMESTAMP NOT NULL DEFAULT NOW()
-);
+	sent_dttm TIMESTAMP NOT NULL DEFAULT NOW(),
+	CONSTRAINT pk_order_events PRIMARY KEY (object_id, sent_dttm)
+) PARTITION BY RANGE (sent_dttm);
+
+
+CREATE TABLE IF NOT EXISTS stg.order_events_default PARTITION OF stg.order_events DEFAULT;
 
 
 CREATE TABLE IF NOT EXISTS dds.h_user(
@@ -167,3 +208,101 @@ CREATE TABLE IF NOT EXISTS dds.s_order_status(
 	load_src VARCHAR NOT NULL,
 	CONSTRAINT fk_h_order_s_order_status FOREIGN KEY(h_order_pk) REFERENCES dds.h_order(h_order_pk)
 );
+
+
+CREATE TABLE IF NOT EXISTS dds.s_order_product_quantity(
+	hk_order_product_quantity_hashdiff UUID PRIMARY KEY,
+	hk_order_product_pk UUID NOT NULL,
+	quantity INT NOT NULL CHECK(quantity >= 0),
+	load_dt TIMESTAMP NOT NULL DEFAULT NOW(),
+	load_src VARCHAR NOT NULL,
+	CONSTRAINT fk_l_order_product_s_order_product_quantity FOREIGN KEY(hk_order_product_pk) REFERENCES dds.l_order_product(hk_order_product_pk)
+);
+
+
+CREATE TABLE IF NOT EXISTS dds.pit_order(
+	h_order_pk UUID NOT NULL,
+	snapshot_dt DATE NOT NULL,
+	hk_order_cost_hashdiff UUID NOT NULL,
+	hk_order_status_hashdiff UUID NOT NULL,
+	update_ts TIMESTAMP NOT NULL,
+	load_dt TIMESTAMP NOT NULL DEFAULT NOW(),
+	load_src VARCHAR NOT NULL,
+	CONSTRAINT pk_pit_order PRIMARY KEY (h_order_pk, snapshot_dt),
+	CONSTRAINT fk_h_order_pit_order FOREIGN KEY(h_order_pk) REFERENCES dds.h_order(h_order_pk),
+	CONSTRAINT fk_s_order_cost_pit_order FOREIGN KEY(hk_order_cost_hashdiff) REFERENCES dds.s_order_cost(hk_order_cost_hashdiff),
+	CONSTRAINT fk_s_order_status_pit_order FOREIGN KEY(hk_order_status_hashdiff) REFERENCES dds.s_order_status(hk_order_status_hashdiff)
+);
+
+
+CREATE TABLE IF NOT EXISTS dds.pit_user(
+	h_user_pk UUID NOT NULL,
+	snapshot_dt DATE NOT NULL,
+	hk_user_names_hashdiff UUID NOT NULL,
+	update_ts TIMESTAMP NOT NULL,
+	load_dt TIMESTAMP NOT NULL DEFAULT NOW(),
+	load_src VARCHAR NOT NULL,
+	CONSTRAINT pk_pit_user PRIMARY KEY (h_user_pk, snapshot_dt),
+	CONSTRAINT fk_h_user_pit_user FOREIGN KEY(h_user_pk) REFERENCES dds.h_user(h_user_pk),
+	CONSTRAINT fk_s_user_names_pit_user FOREIGN KEY(hk_user_names_hashdiff) REFERENCES dds.s_user_names(hk_user_names_hashdiff)
+);
+
+
+CREATE TABLE IF NOT EXISTS dds.pit_product(
+	h_product_pk UUID NOT NULL,
+	snapshot_dt DATE NOT NULL,
+	hk_product_names_hashdiff UUID NOT NULL,
+	update_ts TIMESTAMP NOT NULL,
+	load_dt TIMESTAMP NOT NULL DEFAULT NOW(),
+	load_src VARCHAR NOT NULL,
+	CONSTRAINT pk_pit_product PRIMARY KEY (h_product_pk, snapshot_dt),
+	CONSTRAINT fk_h_product_pit_product FOREIGN KEY(h_product_pk) REFERENCES dds.h_product(h_product_pk),
+	CONSTRAINT fk_s_product_names_pit_product FOREIGN KEY(hk_product_names_hashdiff) REFERENCES dds.s_product_names(hk_product_names_hashdiff)
+);
+
+
+CREATE TABLE IF NOT EXISTS dds.pit_restaurant(
+	h_restaurant_pk UUID NOT NULL,
+	snapshot_dt DATE NOT NULL,
+	hk_restaurant_names_hashdiff UUID NOT NULL,
+	update_ts TIMESTAMP NOT NULL,
+	load_dt TIMESTAMP NOT NULL DEFAULT NOW(),
+	load_src VARCHAR NOT NULL,
+	CONSTRAINT pk_pit_restaurant PRIMARY KEY (h_restaurant_pk, snapshot_dt),
+	CONSTRAINT fk_h_restaurant_pit_restaurant FOREIGN KEY(h_restaurant_pk) REFERENCES dds.h_restaurant(h_restaurant_pk),
+	CONSTRAINT fk_s_restaurant_names_pit_restaurant FOREIGN KEY(hk_restaurant_names_hashdiff) REFERENCES dds.s_restaurant_names(hk_restaurant_names_hashdiff)
+);
+
+
+CREATE TABLE IF NOT EXISTS dds.bridge_order_product_category(
+	hk_order_product_pk UUID PRIMARY KEY,
+	h_order_pk UUID NOT NULL,
+	h_product_pk UUID NOT NULL,
+	h_category_pk UUID NOT NULL,
+	hk_product_category_pk UUID NOT NULL,
+	hk_order_product_quantity_hashdiff UUID NOT NULL,
+	load_dt TIMESTAMP NOT NULL DEFAULT NOW(),
+	load_src VARCHAR NOT NULL,
+	CONSTRAINT fk_l_order_product_bridge FOREIGN KEY(hk_order_product_pk) REFERENCES dds.l_order_product(hk_order_product_pk),
+	CONSTRAINT fk_l_product_category_bridge FOREIGN KEY(hk_product_category_pk) REFERENCES dds.l_product_category(hk_product_category_pk),
+	CONSTRAINT fk_s_order_product_quantity_bridge FOREIGN KEY(hk_order_product_quantity_hashdiff) REFERENCES dds.s_order_product_quantity(hk_order_product_quantity_hashdiff)
+);
+
+
+CREATE INDEX IF NOT EXISTS ix_l_order_product_h_order_pk ON dds.l_order_product (h_order_pk);
+CREATE INDEX IF NOT EXISTS ix_l_order_product_h_product_pk ON dds.l_order_product (h_product_pk);
+CREATE INDEX IF NOT EXISTS ix_l_product_restaurant_h_product_pk ON dds.l_product_restaurant (h_product_pk);
+CREATE INDEX IF NOT EXISTS ix_l_product_restaurant_h_restaurant_pk ON dds.l_product_restaurant (h_restaurant_pk);
+CREATE INDEX IF NOT EXISTS ix_l_product_category_h_product_pk ON dds.l_product_category (h_product_pk);
+CREATE INDEX IF NOT EXISTS ix_l_product_category_h_category_pk ON dds.l_product_category (h_category_pk);
+CREATE INDEX IF NOT EXISTS ix_l_order_user_h_user_pk ON dds.l_order_user (h_user_pk);
+CREATE INDEX IF NOT EXISTS ix_l_order_user_h_order_pk ON dds.l_order_user (h_order_pk);
+CREATE INDEX IF NOT EXISTS ix_s_order_product_quantity_hk_order_product_pk ON dds.s_order_product_quantity (hk_order_product_pk);
+CREATE INDEX IF NOT EXISTS ix_bridge_order_product_category_h_order_pk ON dds.bridge_order_product_category (h_order_pk);
+CREATE INDEX IF NOT EXISTS ix_bridge_order_product_category_load_dt ON dds.bridge_order_product_category (load_dt);
+CREATE INDEX IF NOT EXISTS ix_pit_order_load_dt ON dds.pit_order (load_dt);
+
+ALTER TABLE dds.pit_order ADD COLUMN IF NOT EXISTS update_ts TIMESTAMP NOT NULL DEFAULT '-infinity';
+ALTER TABLE dds.pit_user ADD COLUMN IF NOT EXISTS update_ts TIMESTAMP NOT NULL DEFAULT '-infinity';
+ALTER TABLE dds.pit_product ADD COLUMN IF NOT EXISTS update_ts TIMESTAMP NOT NULL DEFAULT '-infinity';
+ALTER TABLE dds.pit_restaurant ADD COLUMN IF NOT EXISTS update_ts TIMESTAMP NOT NULL DEFAULT '-infinity';